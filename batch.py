@@ -0,0 +1,220 @@
+"""Пакетная обработка файлов отчетов iTest из командной строки (без веб-интерфейса).
+
+Логика та же, что у /process: "only_cli" - номера (extract_numeric_lines), "with_samples" -
+пары CLI (extract_cli_pairs) с поиском в ELK или локальном хранилище SIP-логов
+(query_elk / process_elk_hits через iter_cli_pair_results). Отчеты разбираются в пуле
+процессов; поиск для всех файлов идет в этом процессе, через общий пул соединений,
+лимит ELK_CONCURRENCY и кэш ELK, поэтому одинаковые CLI в разных отчетах ищутся один раз.
+
+Результаты пишутся построчно по мере готовности (CSV или JSONL): файл, позиция пары
+в файле, CLI, статус и строка результата. Итоги по каждому файлу - в лог и, с --summary,
+в JSON-файл. Настройки ELK - те же переменные окружения, что у приложения.
+
+    python -m batch reports/ "archive/2024-*.txt.gz" --output results.csv --summary summary.json
+    python -m batch reports/*.txt --logic only_cli --format jsonl > numbers.jsonl
+"""
+import argparse
+import asyncio
+import csv
+import glob
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, TextIO
+
+import main
+
+logger = logging.getLogger("batch")
+
+LOGIC_CHOICES = ("with_samples", "only_cli")
+OUTPUT_FIELDS = ("file", "index", "sent", "received", "status", "result")
+_READ_SIZE = 64 * 1024 # Размер куска при чтении отчета
+
+
+def expand_inputs(patterns: List[str]) -> List[str]:
+    """Файлы отчетов по аргументам: путь к файлу, каталог (все файлы рекурсивно) или glob-шаблон."""
+    paths: List[str] = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, names in os.walk(pattern):
+                paths.extend(os.path.join(root, name) for name in sorted(names) if not name.startswith("."))
+        elif os.path.isfile(pattern):
+            paths.append(pattern)
+        else:
+            matched = sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+            if not matched:
+                logger.warning(f"No report files match '{pattern}'.")
+            paths.extend(matched)
+    # Один файл, указанный несколько раз, обрабатывается один раз
+    return list(dict.fromkeys(paths))
+
+
+def _iter_file_chunks(report_file: TextIO):
+    return iter(lambda: report_file.read(_READ_SIZE), "")
+
+
+def parse_report_file(path: str, logic_choice: str) -> List:
+    """Разбирает файл отчета (можно сжатый gzip) потоком. Выполняется в процессе пула.
+
+    Возвращает номера (only_cli) или пары CLI (with_samples).
+    """
+    with open(path, "rb") as raw_file:
+        compressed = raw_file.read(2) == b"\x1f\x8b"
+    binary_file = gzip.open(path, "rb") if compressed else open(path, "rb")
+    with io.TextIOWrapper(binary_file, encoding="utf-8", errors="replace") as report_file:
+        chunks = _iter_file_chunks(report_file)
+        if logic_choice == "only_cli":
+            return list(main.iter_numeric_lines(chunks))
+        return list(main.iter_cli_pairs(chunks))
+
+
+def _init_parse_worker() -> None:
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+class ResultWriter:
+    """Пишет строки результатов в CSV или JSONL сразу по мере поступления."""
+
+    def __init__(self, output: TextIO, output_format: str):
+        self.output = output
+        self.output_format = output_format
+        self.rows = 0
+        self._csv = None
+        if output_format == "csv":
+            self._csv = csv.DictWriter(output, fieldnames=OUTPUT_FIELDS, extrasaction="ignore")
+            self._csv.writeheader()
+
+    def write(self, row: Dict) -> None:
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self.output.write(json.dumps({field: row.get(field) for field in OUTPUT_FIELDS}, ensure_ascii=False) + "\n")
+        self.rows += 1
+
+    def flush(self) -> None:
+        self.output.flush()
+
+
+async def process_report_file(path: str, logic_choice: str, pool: ProcessPoolExecutor, writer: ResultWriter) -> Dict:
+    """Разбирает один отчет в пуле процессов, выполняет поиск и пишет результаты. Возвращает итоги файла."""
+    started = time.perf_counter()
+    summary: Dict = {"file": path, "items": 0, "ok": 0, "statuses": {}, "error": None}
+    loop = asyncio.get_running_loop()
+    try:
+        parsed = await loop.run_in_executor(pool, parse_report_file, path, logic_choice)
+    except (OSError, EOFError, UnicodeError) as e:
+        logger.error(f"Could not read report {path}: {e}")
+        summary["error"] = str(e)
+        return summary
+    summary["items"] = len(parsed)
+
+    statuses: Dict[str, int] = summary["statuses"]
+    if logic_choice == "only_cli":
+        for index, number in enumerate(parsed):
+            writer.write({"file": path, "index": index, "status": main.PAIR_OK, "result": number})
+        statuses[main.PAIR_OK] = len(parsed)
+    elif parsed:
+        async for pair_result in main.iter_cli_pair_results(parsed):
+            writer.write({"file": path, **pair_result})
+            statuses[pair_result["status"]] = statuses.get(pair_result["status"], 0) + 1
+    writer.flush()
+    summary["ok"] = statuses.get(main.PAIR_OK, 0)
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(
+        f"{path}: {summary['items']} {'numbers' if logic_choice == 'only_cli' else 'pairs'}, "
+        f"{summary['ok']} ok, statuses {statuses} in {summary['seconds']:.1f}s."
+    )
+    return summary
+
+
+async def run_batch(
+    paths: List[str], logic_choice: str, writer: ResultWriter, workers: int, files_in_flight: int
+) -> List[Dict]:
+    """Обрабатывает отчеты: не более files_in_flight одновременно, разбор - в workers процессах."""
+    limit = asyncio.Semaphore(files_in_flight)
+
+    async def limited(path: str) -> Dict:
+        async with limit:
+            return await process_report_file(path, logic_choice, pool, writer)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_parse_worker) as pool:
+        try:
+            return list(await asyncio.gather(*(limited(path) for path in paths)))
+        finally:
+            await main.close_elk_client()
+
+
+def _totals(summaries: List[Dict], started: float) -> Dict:
+    statuses: Dict[str, int] = {}
+    for summary in summaries:
+        for status, count in summary["statuses"].items():
+            statuses[status] = statuses.get(status, 0) + count
+    return {
+        "files": len(summaries),
+        "failed_files": sum(1 for summary in summaries if summary["error"]),
+        "items": sum(summary["items"] for summary in summaries),
+        "ok": statuses.get(main.PAIR_OK, 0),
+        "statuses": statuses,
+        "elk_cache": main.elk_cache.stats(),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _output_format(args) -> str:
+    if args.format:
+        return args.format
+    return "csv" if args.output and args.output.lower().endswith(".csv") else "jsonl"
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Process many iTest report files without the web UI.")
+    parser.add_argument("inputs", nargs="+", help="Report files, directories or glob patterns (quote them)")
+    parser.add_argument("--logic", choices=LOGIC_CHOICES, default="with_samples", help="Same as logic_choice in /process")
+    parser.add_argument("--output", "-o", help="Output file (default: stdout)")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="Output format (default: by --output extension, else jsonl)")
+    parser.add_argument("--summary", help="Write per-file summaries and totals to this JSON file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Processes for parsing reports")
+    parser.add_argument("--files-in-flight", type=int, default=4, help="Reports processed at the same time")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log every ELK request (INFO from main and httpx)")
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.INFO)
+    if not args.verbose:
+        for name in ("main", "httpx"):
+            logging.getLogger(name).setLevel(logging.WARNING)
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        logger.error("No report files to process.")
+        return 2
+    logger.info(f"Processing {len(paths)} report file(s) with logic '{args.logic}'.")
+
+    output_file: TextIO = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    started = time.perf_counter()
+    try:
+        writer = ResultWriter(output_file, _output_format(args))
+        summaries = asyncio.run(
+            run_batch(paths, args.logic, writer, max(1, args.workers), max(1, args.files_in_flight))
+        )
+    finally:
+        if output_file is not sys.stdout:
+            output_file.close()
+
+    totals = _totals(summaries, started)
+    logger.info(
+        f"Done: {totals['files']} file(s), {totals['items']} item(s), {totals['ok']} ok, "
+        f"{totals['failed_files']} unreadable file(s) in {totals['seconds']:.1f}s. Statuses: {totals['statuses']}"
+    )
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as summary_file:
+            json.dump({"files": summaries, "totals": totals}, summary_file, ensure_ascii=False, indent=2)
+    return 1 if totals["failed_files"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
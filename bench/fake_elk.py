@@ -0,0 +1,207 @@
+"""Локальная замена Elasticsearch для бенчмарков.
+
+Отвечает на POST /<index>/_search и /<index>/_msearch синтетическими сообщениями
+BYE/INVITE в формате SIP-логов, которые ожидает main.py. Ответ для CLI детерминирован
+(зависит только от номера и --seed): часть номеров без записей (--miss-rate), часть -
+с INVITE, который находится только отдельным запросом по call_id (--invite-lookup-rate).
+Поддерживаются size/search_after, point-in-time (POST /<index>/_pit, POST /_search с "pit",
+DELETE /_pit), задержка ответа и доля ошибок 500.
+
+    python -m bench.fake_elk --port 9200 --latency 0.02 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import ClientDisconnect
+
+app = FastAPI(title="fake ELK")
+
+# Открытые point-in-time (закрытые main.py удаляются)
+open_pits = set()
+_pit_ids = itertools.count(1)
+
+# Параметры сервера; меняются аргументами командной строки (см. main)
+config = {
+    "latency": 0.02,             # Средняя задержка ответа, секунды
+    "jitter": 0.005,             # Стандартное отклонение задержки
+    "item_latency": 0.001,       # Дополнительная задержка на каждый подзапрос _msearch
+    "error_rate": 0.0,           # Доля запросов, на которые отвечаем 500
+    "miss_rate": 0.1,            # Доля CLI без записей
+    "invite_lookup_rate": 0.05,  # Доля CLI, у которых INVITE не попадает в выдачу по номеру
+    "hits": 10,                  # Сообщений на CLI (шумовые INVITE + INVITE + BYE)
+    "seed": 1,
+}
+
+_BASE_TIME = datetime(2024, 1, 1, 10, 0, 0)
+
+
+def _cli_random(cli: str) -> random.Random:
+    return random.Random(zlib.crc32(cli.encode()) ^ config["seed"])
+
+
+def _hit(cli: str, method: str, call_id: str, seconds: int, position: int, dst_user: str) -> Dict:
+    moment = _BASE_TIME + timedelta(seconds=seconds)
+    message = (
+        f"{moment:%b} {moment.day:2d} {moment:%H:%M:%S} sbc-1 kamailio[4242]: ACC: transaction answered:"
+        f" timestamp={int(moment.timestamp())};method={method};from_tag=ft{position};to_tag=tt{position};"
+        f"call_id={call_id}@10.0.0.1;code=200;reason=OK;src_user={cli};src_domain=10.0.0.1;"
+        f"dst_user={dst_user};dst_ouser=+44{dst_user[-9:]};"
+    )
+    return {
+        "_index": "fake-elk",
+        "_id": f"{cli}-{position}-{method}",
+        "_source": {"@timestamp": moment.strftime("%Y-%m-%dT%H:%M:%S.000Z"), "message": message},
+        "sort": [int(moment.timestamp() * 1000), position],
+    }
+
+
+def _call_id(cli: str) -> str:
+    return f"call-{cli}"
+
+
+def hits_for_cli(cli: str) -> List[Dict]:
+    """Все сообщения для CLI в порядке сортировки ELK (по времени)."""
+    rnd = _cli_random(cli)
+    if rnd.random() < config["miss_rate"]:
+        return []
+    hide_invite = rnd.random() < config["invite_lookup_rate"]
+    dst_user = f"44{rnd.randrange(10 ** 9, 10 ** 10)}"
+    hits = []
+    for position in range(max(0, config["hits"] - 2)):
+        hits.append(_hit(cli, "INVITE", f"noise-{position}-{cli}", position, position, dst_user))
+    position = len(hits)
+    if not hide_invite:
+        hits.append(_hit(cli, "INVITE", _call_id(cli), position, position, dst_user))
+        position += 1
+    hits.append(_hit(cli, "BYE", _call_id(cli), position + 30, position, dst_user))
+    return hits
+
+
+def _invite_by_call_id(call_id: str) -> List[Dict]:
+    if not call_id.startswith("call-"):
+        return []
+    cli = call_id[len("call-"):]
+    rnd = _cli_random(cli)
+    rnd.random() # miss_rate
+    rnd.random() # invite_lookup_rate
+    dst_user = f"44{rnd.randrange(10 ** 9, 10 ** 10)}"
+    return [_hit(cli, "INVITE", call_id, 0, 0, dst_user)]
+
+
+def _search(query: Dict) -> Dict:
+    bool_query = query.get("query", {}).get("bool", {})
+    call_id: Optional[str] = None
+    for clause in bool_query.get("filter", []):
+        phrase = clause.get("match_phrase", {}).get("message", "")
+        if phrase.startswith("call_id="):
+            call_id = phrase[len("call_id="):]
+    if call_id is not None:
+        hits = _invite_by_call_id(call_id)
+    else:
+        cli = bool_query["must"][0]["match"]["message"]
+        hits = hits_for_cli(cli)
+
+    total = len(hits)
+    search_after = query.get("search_after")
+    if search_after:
+        hits = hits[search_after[1] + 1:]
+    hits = hits[:query.get("size", 10)]
+    response = {"took": 1, "timed_out": False, "hits": {"total": {"value": total, "relation": "eq"}, "hits": hits}}
+    if "pit" in query:
+        response["pit_id"] = query["pit"]["id"]
+    return response
+
+
+async def _delay(extra: float = 0.0) -> None:
+    delay = random.gauss(config["latency"], config["jitter"]) + extra
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+
+def _error_response() -> Optional[JSONResponse]:
+    if random.random() < config["error_rate"]:
+        return JSONResponse(status_code=500, content={"error": {"type": "fake_error", "reason": "injected failure"}})
+    return None
+
+
+@app.exception_handler(ClientDisconnect)
+async def client_disconnect(request: Request, exc: ClientDisconnect):
+    # Клиент отменил запрос (hedging, дедлайн) - для бенчмарка это штатная ситуация
+    return Response(status_code=499)
+
+
+@app.post("/{index}/_search")
+async def search(index: str, request: Request):
+    await _delay()
+    error = _error_response()
+    if error is not None:
+        return error
+    return JSONResponse(content=_search(await request.json()))
+
+
+@app.post("/{index}/_pit")
+async def open_pit(index: str):
+    await _delay()
+    error = _error_response()
+    if error is not None:
+        return error
+    pit_id = f"pit-{next(_pit_ids)}"
+    open_pits.add(pit_id)
+    return JSONResponse(content={"id": pit_id})
+
+
+@app.post("/_search")
+async def pit_search(request: Request):
+    await _delay()
+    error = _error_response()
+    if error is not None:
+        return error
+    query = await request.json()
+    if query.get("pit", {}).get("id") not in open_pits:
+        return JSONResponse(status_code=404, content={"error": {"type": "search_context_missing_exception"}})
+    return JSONResponse(content=_search(query))
+
+
+@app.delete("/_pit")
+async def close_pit(request: Request):
+    pit_id = (await request.json()).get("id")
+    freed = int(pit_id in open_pits)
+    open_pits.discard(pit_id)
+    return JSONResponse(content={"succeeded": True, "num_freed": freed})
+
+
+@app.post("/{index}/_msearch")
+async def msearch(index: str, request: Request):
+    lines = [line for line in (await request.body()).decode("utf-8").split("\n") if line.strip()]
+    queries = [json.loads(line) for line in lines[1::2]]
+    await _delay(config["item_latency"] * len(queries))
+    error = _error_response()
+    if error is not None:
+        return error
+    return JSONResponse(content={"took": 1, "responses": [{**_search(query), "status": 200} for query in queries]})
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake Elasticsearch server for benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    for key, value in config.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    for key in config:
+        config[key] = getattr(args, key)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Генератор синтетических отчетов iTest для бенчмарков.
+
+Отчет содержит блоки тестов: служебные строки, строку CLI Sent ('42123...') и ответ -
+номер (с '+' или без) либо 'No CLI presented'. Часть блоков без ответа или с "шумом"
+между строками, чтобы парсер проходил все ветки.
+
+    python -m bench.report_gen --pairs 5000 --output report.txt
+"""
+import argparse
+import random
+import sys
+from typing import List
+
+CLI_SENT_PREFIX = "42123"
+NO_CLI_PRESENTED = "No CLI presented"
+
+_NOISE_LINES = (
+    "Call result: Success",
+    "Call result: Failed (no answer)",
+    "Duration: 00:00:12",
+    "Route: UK Mobile - Premium",
+    "Supplier: Carrier-A",
+    "Status: Completed",
+)
+
+
+def cli_sent_number(index: int) -> str:
+    """Номер CLI Sent для пары index (тот же, что отвечает fake ELK)."""
+    return f"{CLI_SENT_PREFIX}{index:07d}"
+
+
+def generate_report(
+    pairs: int,
+    no_cli_ratio: float = 0.1,
+    unanswered_ratio: float = 0.05,
+    noise_lines: int = 3,
+    seed: int = 42,
+) -> str:
+    """Возвращает текст отчета с pairs строками CLI Sent.
+
+    no_cli_ratio - доля ответов 'No CLI presented', unanswered_ratio - доля строк CLI Sent
+    без ответа (пара не образуется), noise_lines - служебных строк на блок.
+    """
+    rnd = random.Random(seed)
+    lines: List[str] = []
+    for i in range(pairs):
+        lines.append(f"Test #{i + 1} - Voice CLI check")
+        lines.extend(rnd.choice(_NOISE_LINES) for _ in range(noise_lines))
+        lines.append(cli_sent_number(i))
+        roll = rnd.random()
+        if roll < unanswered_ratio:
+            lines.append(rnd.choice(_NOISE_LINES))
+        elif roll < unanswered_ratio + no_cli_ratio:
+            lines.append(NO_CLI_PRESENTED)
+        else:
+            prefix = "+" if rnd.random() < 0.5 else ""
+            lines.append(f"{prefix}44{rnd.randrange(10 ** 9, 10 ** 10)}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate a synthetic iTest report.")
+    parser.add_argument("--pairs", type=int, default=1000, help="Number of CLI Sent lines")
+    parser.add_argument("--no-cli-ratio", type=float, default=0.1)
+    parser.add_argument("--unanswered-ratio", type=float, default=0.05)
+    parser.add_argument("--noise-lines", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Output file (stdout by default)")
+    args = parser.parse_args()
+
+    report = generate_report(args.pairs, args.no_cli_ratio, args.unanswered_ratio, args.noise_lines, args.seed)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report)
+    else:
+        sys.stdout.write(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+"""Сценарии бенчмарков: разбор отчета, process_elk_hits и /process целиком.
+
+Каждый сценарий печатает p50/p99 задержки, операций в секунду и пиковый RSS.
+Результат можно сохранить (--json) и сравнить с сохраненным ранее (--compare):
+при ухудшении p50/p99 или пропускной способности больше --tolerance код выхода 1.
+
+    python -m bench.run parser --pairs 5000
+    python -m bench.run analyze --hits 50
+    python -m bench.run process --pairs 200 --requests 40 --concurrency 4 --elk-latency 0.02
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import httpx
+
+from bench import fake_elk
+from bench.report_gen import cli_sent_number, generate_report
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Перцентиль по методу ближайшего ранга."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(name: str, latencies: List[float], wall_seconds: float, peak_rss_kb: Optional[int], **extra) -> Dict:
+    return {
+        "scenario": name,
+        "operations": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "ops_per_sec": round(len(latencies) / wall_seconds, 2) if wall_seconds else 0.0,
+        "peak_rss_mb": round(peak_rss_kb / 1024, 1) if peak_rss_kb else None,
+        **extra,
+    }
+
+
+def _self_peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak # На macOS ru_maxrss в байтах
+
+
+def _import_main():
+    """Импортирует main.py из корня репозитория."""
+    sys.path.insert(0, ROOT_DIR)
+    import main
+    logging.getLogger().setLevel(logging.WARNING)
+    return main
+
+
+# --- parser: разбор отчета ---
+
+def run_parser(args) -> Dict:
+    main = _import_main()
+    text = generate_report(args.pairs, seed=args.seed)
+    latencies = []
+    pairs = 0
+    started = time.perf_counter()
+    for _ in range(args.iterations):
+        t0 = time.perf_counter()
+        pairs = len(main.extract_cli_pairs(text))
+        latencies.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - started
+    return summarize(
+        "parser", latencies, wall, _self_peak_rss_kb(),
+        report_bytes=len(text.encode("utf-8")), pairs=pairs, pairs_per_sec=round(pairs * len(latencies) / wall, 1),
+    )
+
+
+# --- analyze: process_elk_hits на ответах fake ELK ---
+
+def run_analyze(args) -> Dict:
+    main = _import_main()
+    fake_elk.config.update(hits=args.hits, miss_rate=0.0, invite_lookup_rate=0.0, seed=args.seed)
+    clis = [cli_sent_number(i) for i in range(args.clis)]
+    responses = [(cli, fake_elk.hits_for_cli(cli)) for cli in clis]
+    latencies = []
+    found = 0
+    started = time.perf_counter()
+    for i in range(args.iterations):
+        cli, hits = responses[i % len(responses)]
+        t0 = time.perf_counter()
+        result = main.process_elk_hits(hits, cli, "anonymous")
+        latencies.append(time.perf_counter() - t0)
+        found += result is not None
+    wall = time.perf_counter() - started
+    return summarize("analyze", latencies, wall, _self_peak_rss_kb(), hits_per_response=args.hits, found=found)
+
+
+# --- process: /process целиком, приложение и fake ELK в отдельных процессах ---
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process {process.args} exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Port {port} did not open within {timeout}s")
+
+
+def _tree_rss_kb(pid: int) -> Optional[int]:
+    """Суммарный RSS процесса и его потомков (воркеров uvicorn) по /proc; None, если /proc недоступен."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            if current == pid:
+                return None
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Периодически измеряет RSS дерева процессов и запоминает максимум."""
+
+    def __init__(self, pid: int, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb: Optional[int] = None
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            rss = _tree_rss_kb(self.pid)
+            if rss is not None:
+                self.peak_kb = max(self.peak_kb or 0, rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> Optional[int]:
+        self._stop_event.set()
+        self.join()
+        return self.peak_kb
+
+
+async def _load(app_url: str, reports: List[str], requests: int, concurrency: int, timeout: float):
+    latencies: List[float] = []
+    failures = 0
+    found = 0
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal failures, found
+        while not queue.empty():
+            i = queue.get_nowait()
+            data = {"text": reports[i % len(reports)], "logic_choice": "with_samples", "background": "false"}
+            t0 = time.perf_counter()
+            try:
+                response = await client.post(f"{app_url}/process", data=data)
+                response.raise_for_status()
+                found += len(response.json()["results"])
+                latencies.append(time.perf_counter() - t0)
+            except (httpx.HTTPError, ValueError, KeyError):
+                failures += 1
+
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return latencies, wall, failures, found
+
+
+def run_process(args) -> Dict:
+    elk_port = _free_port()
+    app_port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    fake_cmd = [
+        sys.executable, "-m", "bench.fake_elk", "--port", str(elk_port),
+        "--latency", str(args.elk_latency), "--jitter", str(args.elk_jitter),
+        "--error-rate", str(args.error_rate), "--miss-rate", str(args.miss_rate),
+        "--hits", str(args.hits), "--seed", str(args.seed),
+    ]
+    app_env = {
+        **os.environ,
+        "ELK_URL": f"http://127.0.0.1:{elk_port}/bench-*/_search",
+        "ELK_USER": "bench",
+        "ELK_PASSWORD": "bench",
+        "ELK_LOOKUP_MODE": args.mode,
+        # Без кэша каждый запрос доходит до ELK; --cache оставляет настройки кэша по умолчанию
+        **({} if args.cache else {"ELK_CACHE_TTL": "0"}),
+        "JOB_STORE_PATH": os.path.join(workdir, "jobs.db"),
+        "JOB_AUTO_PAIRS": "0",
+    }
+    app_cmd = [
+        sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ]
+    # Логи приложения пишутся в файл, чтобы не смешиваться с результатом
+    log_path = os.path.join(workdir, "app.log")
+    log_file = open(log_path, "w")
+    print(f"App log: {log_path}", file=sys.stderr)
+    fake_process = subprocess.Popen(fake_cmd, cwd=ROOT_DIR)
+    app_process = subprocess.Popen(app_cmd, cwd=ROOT_DIR, env=app_env, stdout=log_file, stderr=subprocess.STDOUT)
+    try:
+        _wait_for_port(elk_port, fake_process)
+        _wait_for_port(app_port, app_process)
+        # Разные отчеты, чтобы запросы не отличались от реальных только номерами
+        reports = [generate_report(args.pairs, seed=args.seed + i) for i in range(max(1, args.distinct_reports))]
+        sampler = RssSampler(app_process.pid)
+        sampler.start()
+        latencies, wall, failures, found = asyncio.run(
+            _load(f"http://127.0.0.1:{app_port}", reports, args.requests, args.concurrency, args.timeout)
+        )
+        peak_kb = sampler.stop()
+    finally:
+        for process in (app_process, fake_process):
+            process.terminate()
+        for process in (app_process, fake_process):
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        log_file.close()
+    return summarize(
+        "process", latencies, wall, peak_kb,
+        pairs_per_request=args.pairs, failures=failures, found=found, workers=args.workers, mode=args.mode,
+        concurrency=args.concurrency, elk_latency_ms=args.elk_latency * 1000, error_rate=args.error_rate,
+    )
+
+
+# --- сравнение с сохраненным результатом ---
+
+def compare(result: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Возвращает список ухудшений относительно baseline больше чем на tolerance (доля)."""
+    regressions = []
+    for key in ("p50_ms", "p99_ms"):
+        if baseline.get(key) and result[key] > baseline[key] * (1 + tolerance):
+            regressions.append(f"{key}: {baseline[key]} -> {result[key]}")
+    if baseline.get("ops_per_sec") and result["ops_per_sec"] < baseline["ops_per_sec"] * (1 - tolerance):
+        regressions.append(f"ops_per_sec: {baseline['ops_per_sec']} -> {result['ops_per_sec']}")
+    return regressions
+
+
+def main() -> None:
+    # Общие параметры доступны у каждого сценария: python -m bench.run analyze --json out.json
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--seed", type=int, default=42)
+    common.add_argument("--json", help="Write the result to this file")
+    common.add_argument("--compare", help="Baseline result file (from --json) to compare against")
+    common.add_argument("--tolerance", type=float, default=0.2, help="Allowed regression vs. baseline (0.2 = 20%%)")
+    parser = argparse.ArgumentParser(description="text_filter benchmarks.")
+    scenarios = parser.add_subparsers(dest="scenario", required=True)
+
+    parser_scenario = scenarios.add_parser("parser", parents=[common], help="extract_cli_pairs on a generated report")
+    parser_scenario.add_argument("--pairs", type=int, default=5000)
+    parser_scenario.add_argument("--iterations", type=int, default=20)
+
+    analyze_scenario = scenarios.add_parser("analyze", parents=[common], help="process_elk_hits on fake ELK responses")
+    analyze_scenario.add_argument("--hits", type=int, default=10, help="Hits per ELK response")
+    analyze_scenario.add_argument("--clis", type=int, default=200, help="Distinct responses to cycle through")
+    analyze_scenario.add_argument("--iterations", type=int, default=20000)
+
+    process_scenario = scenarios.add_parser("process", parents=[common], help="End-to-end POST /process against fake ELK")
+    process_scenario.add_argument("--pairs", type=int, default=100, help="CLI pairs per report")
+    process_scenario.add_argument("--requests", type=int, default=20)
+    process_scenario.add_argument("--concurrency", type=int, default=2, help="Concurrent client requests")
+    process_scenario.add_argument("--distinct-reports", type=int, default=4)
+    process_scenario.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    process_scenario.add_argument("--mode", choices=("single", "msearch"), default="single", help="ELK_LOOKUP_MODE")
+    process_scenario.add_argument("--cache", action="store_true", help="Keep the ELK cache enabled")
+    process_scenario.add_argument("--elk-latency", type=float, default=0.02, help="Fake ELK latency, seconds")
+    process_scenario.add_argument("--elk-jitter", type=float, default=0.005)
+    process_scenario.add_argument("--error-rate", type=float, default=0.0, help="Share of fake ELK 500 answers")
+    process_scenario.add_argument("--miss-rate", type=float, default=0.1, help="Share of CLIs without ELK records")
+    process_scenario.add_argument("--hits", type=int, default=10, help="Hits per CLI")
+    process_scenario.add_argument("--timeout", type=float, default=600)
+
+    args = parser.parse_args()
+    runner = {"parser": run_parser, "analyze": run_analyze, "process": run_process}[args.scenario]
+    result = runner(args)
+    print(json.dumps(result, indent=2))
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions vs. baseline: " + "; ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print("No regressions vs. baseline.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ELKCache:
+    """Кэш ответов ELK с TTL и LRU-вытеснением.
+
+    Записи хранятся в памяти процесса (OrderedDict в порядке последнего обращения).
+    Если задан db_path, записи дополнительно пишутся в общий SQLite-файл, чтобы
+    ими могли пользоваться все воркеры uvicorn. Неудачные поиски кэшируются
+    как "отрицательные" записи на короткий срок (negative_ttl).
+    """
+
+    def __init__(self, max_entries: int, ttl: float, negative_ttl: float, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict]]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._writes_since_prune = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.enabled and db_path:
+            try:
+                self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS elk_cache ("
+                    " key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS elk_cache_expires ON elk_cache (expires_at)")
+                logger.info(f"ELK cache uses shared SQLite store at {db_path}.")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open shared ELK cache at {db_path}: {e}. Using in-memory cache only.")
+                self._db = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    def get(self, key: str) -> Tuple[bool, Optional[Dict]]:
+        """Возвращает (найдено, значение). Для отрицательной записи значение равно None."""
+        if not self.enabled:
+            return False, None
+
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                if value is None:
+                    self.negative_hits += 1
+                return True, value
+            del self._entries[key]
+
+        if self._db is not None:
+            try:
+                row = self._db.execute(
+                    "SELECT expires_at, value FROM elk_cache WHERE key = ? AND expires_at > ?", (key, now)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Shared ELK cache read failed for {key}: {e}")
+                row = None
+            if row is not None:
+                expires_at, raw_value = row
+                value = json.loads(raw_value) if raw_value is not None else None
+                self._store_local(key, expires_at, value)
+                self.hits += 1
+                self.shared_hits += 1
+                if value is None:
+                    self.negative_hits += 1
+                return True, value
+
+        self.misses += 1
+        return False, None
+
+    def put(self, key: str, value: Optional[Dict], negative: bool = False) -> None:
+        """Сохраняет значение. Отрицательные записи (negative=True или value=None) живут negative_ttl секунд."""
+        if not self.enabled:
+            return
+        negative = negative or value is None
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._store_local(key, expires_at, value)
+
+        if self._db is not None:
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO elk_cache (key, expires_at, value) VALUES (?, ?, ?)",
+                    (key, expires_at, json.dumps(value) if value is not None else None),
+                )
+                self._writes_since_prune += 1
+                if self._writes_since_prune >= 100:
+                    self._prune_shared()
+            except sqlite3.Error as e:
+                logger.warning(f"Shared ELK cache write failed for {key}: {e}")
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "shared": self._db is not None,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def _store_local(self, key: str, expires_at: float, value: Optional[Dict]) -> None:
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_shared(self) -> None:
+        """Удаляет просроченные записи и ограничивает размер общего хранилища max_entries."""
+        self._writes_since_prune = 0
+        self._db.execute("DELETE FROM elk_cache WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM elk_cache WHERE key IN ("
+            " SELECT key FROM elk_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+
+class SingleFlight:
+    """Объединяет одновременные запросы к ELK с одинаковым ключом в один.
+
+    Первый запрос по ключу запускает задачу, остальные ждут ее результата, пока она
+    выполняется. Ожидающие ждут через wait(): задача не отменяется, пока ее ждет хотя бы
+    один запрос (результат нужен ему и попадает в кэш), и отменяется, когда отменен
+    последний ожидающий, - иначе запросы к ELK продолжались бы уже ни для кого.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, "asyncio.Future[Any]"] = {}
+        self._waiters: Dict["asyncio.Future[Any]", int] = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(self, key: str) -> Optional["asyncio.Future[Any]"]:
+        """Возвращает уже выполняющуюся задачу по ключу или None."""
+        call = self._calls.get(key)
+        if call is not None:
+            self.joined += 1
+        return call
+
+    def start(self, key: str, awaitable: Awaitable[Any]) -> "asyncio.Future[Any]":
+        """Запускает задачу для ключа; пока она выполняется, join(key) возвращает ее."""
+        call = asyncio.ensure_future(awaitable)
+        self._calls[key] = call
+        self.started += 1
+
+        def forget(done: "asyncio.Future[Any]") -> None:
+            if self._calls.get(key) is done:
+                del self._calls[key]
+            if not done.cancelled():
+                done.exception() # Ошибка уже обработана ожидающими; не даем asyncio писать "never retrieved"
+
+        call.add_done_callback(forget)
+        return call
+
+    async def wait(self, calls: List["asyncio.Future[Any]"]) -> List[Any]:
+        """Ждет завершения всех задач и возвращает их результаты в том же порядке.
+
+        Как asyncio.gather, но первая ошибка выбрасывается только после завершения всех
+        задач. Если ожидающий отменен, задачи, которые больше никто не ждет, отменяются.
+        """
+        for call in calls:
+            self._waiters[call] = self._waiters.get(call, 0) + 1
+        try:
+            if calls:
+                await asyncio.wait(set(calls))
+        finally:
+            for call in calls:
+                self._release(call)
+        return [call.result() for call in calls]
+
+    def _release(self, call: "asyncio.Future[Any]") -> None:
+        waiters = self._waiters[call] - 1
+        if waiters:
+            self._waiters[call] = waiters
+            return
+        del self._waiters[call]
+        if not call.done():
+            call.cancel()
+
+    def stats(self) -> Dict:
+        return {"in_flight": len(self._calls), "started": self.started, "joined": self.joined}
@@ -0,0 +1,118 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Optional, Tuple
+
+_MIN_LATENCY_SAMPLES = 20 # Сколько успешных запросов нужно, чтобы доверять перцентилю
+
+
+class ElkUnavailableError(Exception):
+    """ELK признан недоступным (circuit breaker открыт) - запрос не отправлялся."""
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей последних успешных запросов для расчета перцентиля."""
+
+    def __init__(self, size: int = 500):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """Перцентиль (0-100) по окну или None, пока данных недостаточно."""
+        if len(self._samples) < _MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        position = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+        return ordered[position]
+
+
+class CircuitBreaker:
+    """Circuit breaker для ELK: после failure_threshold неудач подряд запросы не отправляются.
+
+    Через reset_timeout секунд пропускается один пробный запрос (half-open): успех
+    закрывает breaker, неудача снова открывает его. failure_threshold=0 - breaker выключен.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if self._clock() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос. В состоянии half-open пропускает только один пробный запрос."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.failure_threshold and (self._opened_at is not None or self._failures >= self.failure_threshold):
+            self._opened_at = self._clock()
+
+    def release(self) -> None:
+        """Пробный запрос завершился без оценки здоровья ELK (например, отменен)."""
+        self._probe_in_flight = False
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Задержка перед повтором attempt (1, 2, ...): экспоненциальная, со случайным разбросом (full jitter)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def hedged(factory: Callable[[], Awaitable[Any]], hedge_after: Optional[float]) -> Tuple[Any, Optional[str]]:
+    """Выполняет factory(); если ответа нет дольше hedge_after секунд, запускает второй такой же запрос.
+
+    Возвращает (результат первого успешного запроса, победитель): "primary" или "hedge", если
+    второй запрос запускался, иначе None. Оставшийся запрос отменяется. Если оба завершились
+    ошибкой, выбрасывается ошибка последнего. hedge_after=None - без второго запроса.
+    """
+    if hedge_after is None:
+        return await factory(), None
+
+    primary = asyncio.ensure_future(factory())
+    tasks = {primary}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        hedge_started = not done
+        if hedge_started:
+            tasks.add(asyncio.ensure_future(factory()))
+        error: Optional[BaseException] = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    winner = ("primary" if task is primary else "hedge") if hedge_started else None
+                    return task.result(), winner
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,100 @@
+import re
+from datetime import datetime, timedelta
+from typing import Iterable, List, NamedTuple, Optional
+
+# Длительность: число и единица (s, m, h, d), например "90s", "30m", "1h", "3d"
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhd])\s*$")
+_DURATION_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+_ELK_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+
+
+class TimeWindow(NamedTuple):
+    """Интервал поиска в ELK [gte, lt) в UTC."""
+
+    gte: datetime
+    lt: datetime
+
+    def range_filter(self) -> dict:
+        """Фильтр range по @timestamp для запроса ELK."""
+        return {
+          "range": {
+            "@timestamp": {
+              "gte": self.gte.strftime(_ELK_TIME_FORMAT),
+              "lt": self.lt.strftime(_ELK_TIME_FORMAT),
+              "format": "strict_date_optional_time_nanos||epoch_millis"
+            }
+          }
+        }
+
+    def widen(self, before: timedelta) -> "TimeWindow":
+        return TimeWindow(self.gte - before, self.lt)
+
+    def label(self) -> str:
+        return f"{self.gte:%Y%m%dT%H%M%S}-{self.lt:%Y%m%dT%H%M%S}"
+
+
+def parse_duration(text: str) -> timedelta:
+    """Разбирает длительность вида "30m", "1h", "3d". Ошибка формата - ValueError."""
+    duration_match = _DURATION_RE.match(text)
+    if not duration_match:
+        raise ValueError(f"Invalid duration '{text}' (expected e.g. '30m', '1h', '3d').")
+    value, unit = duration_match.groups()
+    return timedelta(**{_DURATION_UNITS[unit]: float(value)})
+
+
+def format_duration(delta: timedelta) -> str:
+    """Обратное к parse_duration: "1h", "3d", "90s"."""
+    seconds = int(delta.total_seconds())
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds and seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+def parse_duration_list(text: str) -> List[timedelta]:
+    """Разбирает список длительностей через запятую ("1h,6h"); пустая строка - пустой список."""
+    return [parse_duration(part) for part in text.split(",") if part.strip()]
+
+
+def progressive_windows(now: datetime, steps: Iterable[timedelta], lookback: timedelta) -> List[TimeWindow]:
+    """Окна для поиска с постепенным расширением, от самого свежего.
+
+    Окна не пересекаются: [now - step1, now), [now - step2, now - step1), ...,
+    [now - lookback, now - stepN). Шаги не меньше lookback отбрасываются.
+    """
+    windows = []
+    newer = now
+    for step in sorted(set(steps)):
+        if step <= timedelta(0) or step >= lookback:
+            continue
+        windows.append(TimeWindow(now - step, newer))
+        newer = now - step
+    windows.append(TimeWindow(now - lookback, newer))
+    return windows
+
+
+def report_window(times: Iterable[datetime], margin: timedelta) -> Optional[TimeWindow]:
+    """Окно по времени тестов из отчета: от самого раннего до самого позднего плюс margin с обеих сторон."""
+    earliest = latest = None
+    for moment in times:
+        if earliest is None or moment < earliest:
+            earliest = moment
+        if latest is None or moment > latest:
+            latest = moment
+    if earliest is None:
+        return None
+    return TimeWindow(earliest - margin, latest + margin)
+
+
+def daily_index_names(pattern: str, window: TimeWindow, max_indices: int) -> Optional[List[str]]:
+    """Имена суточных индексов, покрывающих окно (pattern - формат strftime, например "sip-%Y.%m.%d").
+
+    Если индексов больше max_indices, возвращает None - тогда запрос идет по индексу из ELK_URL.
+    """
+    first_day = window.gte.date()
+    last_day = (window.lt - timedelta(microseconds=1)).date()
+    day_count = (last_day - first_day).days + 1
+    if day_count > max_indices:
+        return None
+    return [(first_day + timedelta(days=offset)).strftime(pattern) for offset in range(max(day_count, 1))]
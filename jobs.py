@@ -0,0 +1,325 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Статусы фоновой задачи
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_FLUSH_SIZE = 50       # Сколько результатов пар копить перед записью в хранилище
+_FLUSH_INTERVAL = 1.0  # Не реже чем раз в столько секунд результаты пишутся в хранилище
+_PRUNE_INTERVAL = 600  # Как часто удалять старые завершенные задачи, в секундах
+_PAIR_OK = "ok"        # Статус успешно обработанной пары (main.PAIR_OK)
+
+
+class JobStore:
+    """Хранилище фоновых задач "With Samples" в SQLite.
+
+    Файл общий для всех воркеров uvicorn: задачу, созданную одним воркером, может
+    выполнить и опросить любой другой. Результаты пар пишутся по мере готовности,
+    поэтому прогресс виден во время выполнения, а задача, прерванная перезапуском
+    воркера, продолжается с необработанных пар.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, logic_choice TEXT NOT NULL,"
+            " total INTEGER NOT NULL, pairs TEXT NOT NULL, error TEXT, worker TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL, heartbeat REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        # seq - порядок записи результатов, по нему клиент запрашивает только новые
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS job_results ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT, job_id TEXT NOT NULL, idx INTEGER NOT NULL,"
+            " sent TEXT, received TEXT, status TEXT NOT NULL, result TEXT,"
+            " UNIQUE (job_id, idx))"
+        )
+
+    def create(self, pairs: List[Dict[str, str]], logic_choice: str = "with_samples") -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO jobs (id, status, logic_choice, total, pairs, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, JOB_QUEUED, logic_choice, len(pairs), json.dumps(pairs), now, now),
+        )
+        return job_id
+
+    def claim(self, worker: str, stale_before: float, limit: int) -> List[Tuple[str, List[Dict[str, str]]]]:
+        """Забирает до limit задач: ожидающие и "зависшие" (heartbeat старше stale_before).
+
+        Захват атомарный (UPDATE с проверкой статуса), поэтому одну задачу не возьмут два воркера.
+        Возвращает [(job_id, пары)].
+        """
+        if limit <= 0:
+            return []
+        candidates = self._db.execute(
+            "SELECT id FROM jobs WHERE status = ? OR (status = ? AND heartbeat < ?)"
+            " ORDER BY created_at LIMIT ?",
+            (JOB_QUEUED, JOB_RUNNING, stale_before, limit),
+        ).fetchall()
+        claimed = []
+        for (job_id,) in candidates:
+            now = time.time()
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = ?, worker = ?, heartbeat = ?, updated_at = ?"
+                " WHERE id = ? AND (status = ? OR (status = ? AND heartbeat < ?))",
+                (JOB_RUNNING, worker, now, now, job_id, JOB_QUEUED, JOB_RUNNING, stale_before),
+            )
+            if cursor.rowcount != 1:
+                continue # Задачу уже забрал другой воркер
+            row = self._db.execute("SELECT pairs FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            try:
+                pairs = json.loads(row[0])
+            except ValueError as e:
+                # Иначе задача снова и снова забиралась бы как "зависшая"
+                logger.error(f"Job {job_id} has corrupted pairs data: {e}")
+                self.finish(job_id, JOB_FAILED, "Stored job data is corrupted.")
+                continue
+            claimed.append((job_id, pairs))
+        return claimed
+
+    def completed_indexes(self, job_id: str) -> Set[int]:
+        rows = self._db.execute("SELECT idx FROM job_results WHERE job_id = ?", (job_id,)).fetchall()
+        return {idx for (idx,) in rows}
+
+    def add_results(self, job_id: str, pair_results: List[Dict], worker: str) -> None:
+        """Записывает результаты пар и обновляет heartbeat задачи."""
+        now = time.time()
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO job_results (job_id, idx, sent, received, status, result)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, r["index"], r.get("sent"), r.get("received"), r["status"], r.get("result"))
+                    for r in pair_results
+                ],
+            )
+            self._db.execute(
+                "UPDATE jobs SET heartbeat = ?, updated_at = ? WHERE id = ? AND worker = ?",
+                (now, now, job_id, worker),
+            )
+
+    def heartbeat(self, job_ids: List[str], worker: str) -> None:
+        if not job_ids:
+            return
+        now = time.time()
+        self._db.executemany(
+            "UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = ?",
+            [(now, job_id, worker, JOB_RUNNING) for job_id in job_ids],
+        )
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> None:
+        now = time.time()
+        self._db.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ?, heartbeat = ? WHERE id = ?",
+            (status, error, now, now, job_id),
+        )
+
+    def release(self, job_ids: List[str], worker: str) -> None:
+        """Возвращает незавершенные задачи в очередь (например, при остановке воркера)."""
+        if not job_ids:
+            return
+        now = time.time()
+        self._db.executemany(
+            "UPDATE jobs SET status = ?, worker = NULL, updated_at = ? WHERE id = ? AND worker = ? AND status = ?",
+            [(JOB_QUEUED, now, job_id, worker, JOB_RUNNING) for job_id in job_ids],
+        )
+
+    def get(self, job_id: str, after: int = 0) -> Optional[Dict]:
+        """Состояние задачи и результаты пар, записанные после курсора after.
+
+        Возвращает {"job_id", "status", "total", "done", "found", "cursor", "pairs", "error"},
+        для завершенной задачи также "results" - итоговые строки в порядке входных пар (как в /process).
+        """
+        row = self._db.execute(
+            "SELECT status, logic_choice, total, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, logic_choice, total, error, created_at, updated_at = row
+        done, found = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(status = ?), 0) FROM job_results WHERE job_id = ?", (_PAIR_OK, job_id)
+        ).fetchone()
+        rows = self._db.execute(
+            "SELECT seq, idx, sent, received, status, result FROM job_results"
+            " WHERE job_id = ? AND seq > ? ORDER BY seq",
+            (job_id, after),
+        ).fetchall()
+        job = {
+            "job_id": job_id,
+            "status": status,
+            "logic_choice": logic_choice,
+            "total": total,
+            "done": done,
+            "found": found,
+            "cursor": rows[-1][0] if rows else after,
+            "pairs": [
+                {"index": idx, "sent": sent, "received": received, "status": pair_status, "result": result}
+                for _, idx, sent, received, pair_status, result in rows
+            ],
+            "error": error,
+            "created_at": created_at,
+            "updated_at": updated_at,
+        }
+        if status == JOB_DONE:
+            job["results"] = [
+                result for (result,) in self._db.execute(
+                    "SELECT result FROM job_results WHERE job_id = ? AND status = ? ORDER BY idx", (job_id, _PAIR_OK)
+                )
+            ]
+        return job
+
+    def prune(self, older_than: float) -> int:
+        """Удаляет завершенные задачи, не обновлявшиеся с момента older_than."""
+        with self._db:
+            self._db.execute("BEGIN")
+            job_ids = [
+                job_id for (job_id,) in self._db.execute(
+                    "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (JOB_DONE, JOB_FAILED, older_than)
+                )
+            ]
+            self._db.executemany("DELETE FROM job_results WHERE job_id = ?", [(job_id,) for job_id in job_ids])
+            self._db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+        return len(job_ids)
+
+    def close(self) -> None:
+        self._db.close()
+
+
+# run_pairs(пары, лимит одновременных запросов) - асинхронный генератор результатов пар
+# в формате process_elk_response (поле "index" - позиция в переданном списке)
+PairRunner = Callable[[List[Dict[str, str]], Optional[int]], AsyncIterator[Dict]]
+
+
+class JobRunner:
+    """Выполняет задачи из JobStore в фоне, внутри event loop воркера.
+
+    Одновременно выполняется не более max_jobs задач на воркер, у каждой задачи не более
+    job_concurrency запросов к ELK "в полете". Раз в poll_interval секунд воркер подтверждает
+    (heartbeat) свои задачи и забирает новые; задачи с heartbeat старше stale_after секунд
+    считаются брошенными (воркер перезапущен) и забираются заново.
+    """
+
+    def __init__(
+        self,
+        store: JobStore,
+        run_pairs: PairRunner,
+        max_jobs: int,
+        job_concurrency: int,
+        poll_interval: float,
+        stale_after: float,
+        retention: float,
+    ):
+        self.store = store
+        self.run_pairs = run_pairs
+        self.max_jobs = max_jobs
+        self.job_concurrency = job_concurrency
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.retention = retention
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_prune = 0.0
+
+    def start(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.ensure_future(self._dispatch_loop())
+        logger.info(f"Job runner started on {self.worker} (max {self.max_jobs} jobs, store {self.store.db_path}).")
+
+    async def stop(self) -> None:
+        """Останавливает выполнение и возвращает незавершенные задачи в очередь."""
+        unfinished = list(self._tasks)
+        tasks = [self._dispatcher] if self._dispatcher else []
+        tasks.extend(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if unfinished:
+            self.store.release(unfinished, self.worker)
+            logger.info(f"Released {len(unfinished)} unfinished job(s) back to the queue.")
+        self._tasks.clear()
+        self._dispatcher = None
+
+    def submit(self, pairs: List[Dict[str, str]], logic_choice: str = "with_samples") -> str:
+        job_id = self.store.create(pairs, logic_choice)
+        logger.info(f"Queued job {job_id} with {len(pairs)} CLI pairs.")
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return job_id
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            try:
+                self.store.heartbeat(list(self._tasks), self.worker)
+                claimed = self.store.claim(
+                    self.worker, time.time() - self.stale_after, self.max_jobs - len(self._tasks)
+                )
+                for job_id, pairs in claimed:
+                    self._tasks[job_id] = asyncio.ensure_future(self._run_job(job_id, pairs))
+                if time.time() - self._last_prune > _PRUNE_INTERVAL:
+                    self._last_prune = time.time()
+                    pruned = self.store.prune(time.time() - self.retention)
+                    if pruned:
+                        logger.info(f"Pruned {pruned} finished job(s).")
+            except sqlite3.Error as e:
+                logger.error(f"Job store error in dispatcher: {e}")
+            except Exception as e:
+                # Диспетчер не должен останавливаться: иначе воркер перестанет выполнять задачи до перезапуска
+                logger.error(f"Unexpected error in job dispatcher: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _run_job(self, job_id: str, pairs: List[Dict[str, str]]) -> None:
+        buffer: List[Dict] = []
+        last_flush = time.monotonic()
+        try:
+            completed = self.store.completed_indexes(job_id)
+            # Пары, обработанные до перезапуска воркера, повторно не запрашиваются
+            positions = [i for i in range(len(pairs)) if i not in completed]
+            if completed:
+                logger.info(f"Resuming job {job_id}: {len(completed)}/{len(pairs)} pairs already done.")
+            else:
+                logger.info(f"Running job {job_id} with {len(pairs)} CLI pairs.")
+            async for pair_result in self.run_pairs([pairs[i] for i in positions], self.job_concurrency):
+                buffer.append({**pair_result, "index": positions[pair_result["index"]]})
+                if len(buffer) >= _FLUSH_SIZE or time.monotonic() - last_flush >= _FLUSH_INTERVAL:
+                    self.store.add_results(job_id, buffer, self.worker)
+                    buffer = []
+                    last_flush = time.monotonic()
+            if buffer:
+                self.store.add_results(job_id, buffer, self.worker)
+            self.store.finish(job_id, JOB_DONE)
+            logger.info(f"Job {job_id} finished.")
+        except asyncio.CancelledError:
+            if buffer:
+                self.store.add_results(job_id, buffer, self.worker)
+            raise
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {str(e)}", exc_info=True)
+            self.store.finish(job_id, JOB_FAILED, "An internal server error occurred during processing.")
+        finally:
+            self._tasks.pop(job_id, None)
+            if self._wakeup is not None:
+                self._wakeup.set()
@@ -1,178 +1,1139 @@
 from fastapi import FastAPI, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from typing import List, Optional, Dict
+from starlette.datastructures import UploadFile
+from typing import Any, AsyncIterator, Awaitable, Iterable, Iterator, List, Optional, Dict, Tuple, Union
+from contextlib import asynccontextmanager
+import asyncio
+import codecs
 import logging
 import re
-import requests
-from requests.auth import HTTPBasicAuth
+import httpx
 from datetime import datetime, timedelta
 import json
+import time
 import os # <-- Добавляем импорт os
+import sqlite3
+import zlib
+from elk_cache import ELKCache, SingleFlight
+from elk_resilience import CircuitBreaker, ElkUnavailableError, LatencyTracker, backoff_delay, hedged
+from elk_window import (
+    TimeWindow,
+    daily_index_names,
+    format_duration,
+    parse_duration,
+    parse_duration_list,
+    progressive_windows,
+    report_window,
+)
+from jobs import JobRunner, JobStore
+from metrics import (
+    ELK_IN_FLIGHT,
+    count_elk_hedge,
+    count_elk_request,
+    count_elk_retry,
+    count_lookup_window,
+    count_pair_outcome,
+    count_saved_lookups,
+    mark_worker_stopped,
+    observe_stage,
+    render_metrics,
+    request_timings,
+    set_elk_circuit_open,
+    stage_timer,
+    start_request_timings,
+)
+from sip_log import SipHitIndex, extract_syslog_time, parse_sip_fields
+from sip_store import SipLogStore
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Каталог приложения: static и templates ищутся относительно него, а не рабочего каталога
+# (main импортируется и из командной строки, см. batch.py)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 # --- ELK Configuration ---
 # Читаем конфигурацию из переменных окружения
+# Где искать SIP-сообщения: "elk" - запросы к ELK, "sqlite" - локальное хранилище SIP-логов
+# (SIP_STORE_PATH, загрузка - python -m sip_store ingest ...)
+SIP_LOG_BACKEND = os.getenv("SIP_LOG_BACKEND", "elk").strip().lower()
+SIP_STORE_PATH = os.getenv("SIP_STORE_PATH", "sip_log.sqlite3")
 ELK_URL = os.getenv("ELK_URL")
 ELK_USER = os.getenv("ELK_USER")
 ELK_PASSWORD = os.getenv("ELK_PASSWORD")
-ELK_TIMEOUT = int(os.getenv("ELK_TIMEOUT", "15")) # Таймаут тоже можно сделать переменной
+ELK_TIMEOUT = int(os.getenv("ELK_TIMEOUT", "15")) # Бюджет на один запрос к ELK вместе с повторами, секунды
+ELK_CONCURRENCY = max(1, int(os.getenv("ELK_CONCURRENCY", "10"))) # Максимум одновременных запросов к ELK на воркер
+# Режим поиска: "single" - отдельный запрос на каждый CLI, "msearch" - пачки CLI в одном запросе _msearch
+ELK_LOOKUP_MODE = os.getenv("ELK_LOOKUP_MODE", "single").strip().lower()
+ELK_BATCH_SIZE = max(1, int(os.getenv("ELK_BATCH_SIZE", "50"))) # Сколько CLI отправлять в одном _msearch
+# URL для _msearch; по умолчанию выводится из ELK_URL заменой '/_search' на '/_msearch'
+ELK_MSEARCH_URL = os.getenv("ELK_MSEARCH_URL") or (
+    re.sub(r"/_search/?$", "/_msearch", ELK_URL) if ELK_URL and re.search(r"/_search/?$", ELK_URL) else None
+)
+ELK_LOOKBACK_DAYS = float(os.getenv("ELK_LOOKBACK_DAYS", "3")) # Глубина поиска в ELK (дней назад от текущего момента)
+# Постепенное расширение окна: сначала ищем за последний шаг (например, час), более
+# старые интервалы - только для CLI, у которых BYE не найден. Пусто - сразу все ELK_LOOKBACK_DAYS
+ELK_WINDOW_STEPS = os.getenv("ELK_WINDOW_STEPS", "1h")
+# Окно по времени тестов из отчета (если в отчете есть дата и время, ищется первым) и запас вокруг него;
+# ELK_REPORT_UTC_OFFSET - смещение времени отчета от UTC в часах
+ELK_REPORT_WINDOW = os.getenv("ELK_REPORT_WINDOW", "true").strip().lower() in ("1", "true", "yes")
+ELK_REPORT_WINDOW_MARGIN = os.getenv("ELK_REPORT_WINDOW_MARGIN", "1h")
+ELK_REPORT_UTC_OFFSET = float(os.getenv("ELK_REPORT_UTC_OFFSET", "0"))
+# Шаблон имени суточного индекса (формат strftime, например "sip-logs-%Y.%m.%d"): запрос
+# отправляется только в индексы дней, которые покрывает окно. Не задан - индекс из ELK_URL
+ELK_INDEX_PATTERN = os.getenv("ELK_INDEX_PATTERN")
+ELK_INDEX_MAX_DAYS = 31 # При более длинном окне запрос идет по индексу из ELK_URL
+ELK_INVITE_MARGIN = timedelta(hours=1) # Насколько раньше окна BYE искать его INVITE по call_id
+# Хвостовые задержки ELK: таймаут одной попытки (меньше бюджета ELK_TIMEOUT), повторы после
+# 429/5xx, таймаута или ошибки соединения - с экспоненциальной задержкой и случайным разбросом
+ELK_ATTEMPT_TIMEOUT = min(float(os.getenv("ELK_ATTEMPT_TIMEOUT", "5")), ELK_TIMEOUT)
+ELK_RETRIES = max(0, int(os.getenv("ELK_RETRIES", "2")))
+ELK_RETRY_BACKOFF = float(os.getenv("ELK_RETRY_BACKOFF", "0.2")) # Базовая задержка перед повтором, секунды
+ELK_RETRY_BACKOFF_MAX = 2.0
+# Hedging: если ответа нет дольше этого перцентиля недавних запросов, отправляется второй такой же
+# запрос и берется первый ответ. 0 - выключено
+ELK_HEDGE_PERCENTILE = float(os.getenv("ELK_HEDGE_PERCENTILE", "95"))
+ELK_HEDGE_MIN_DELAY = 0.05
+# Circuit breaker: после ELK_BREAKER_FAILURES неудачных запросов подряд ELK считается недоступным
+# и пары сразу получают статус "elk-unavailable"; через ELK_BREAKER_RESET секунд - пробный запрос
+ELK_BREAKER_FAILURES = max(0, int(os.getenv("ELK_BREAKER_FAILURES", "5")))
+ELK_BREAKER_RESET = float(os.getenv("ELK_BREAKER_RESET", "30"))
+# Общий срок обработки запроса /process, /process/stream и /process/upload: по его истечении
+# возвращаются уже готовые пары, остальные получают статус "timed-out". 0 - без срока.
+# Должен быть меньше proxy_read_timeout обратного прокси (nginx/nginx.conf), иначе прокси вернет 504 раньше
+ELK_REQUEST_DEADLINE = float(os.getenv("ELK_REQUEST_DEADLINE", "120"))
+ELK_PAGE_SIZE = max(1, int(os.getenv("ELK_PAGE_SIZE", "100"))) # Размер страницы выдачи ELK
+ELK_MAX_PAGES = max(1, int(os.getenv("ELK_MAX_PAGES", "10"))) # Сколько страниц (search_after) читать в поисках BYE
+ELK_PIT_KEEP_ALIVE = os.getenv("ELK_PIT_KEEP_ALIVE", "1m") # Время жизни point-in-time между страницами
+# Кэш результатов ELK: размер (LRU), TTL в секундах, TTL для неудачных/пустых поисков и
+# необязательный путь к SQLite-файлу, общему для всех воркеров
+ELK_CACHE_MAX_ENTRIES = int(os.getenv("ELK_CACHE_MAX_ENTRIES", "1000"))
+ELK_CACHE_TTL = float(os.getenv("ELK_CACHE_TTL", "300"))
+ELK_CACHE_NEGATIVE_TTL = float(os.getenv("ELK_CACHE_NEGATIVE_TTL", "30"))
+ELK_CACHE_PATH = os.getenv("ELK_CACHE_PATH")
+
+# Максимальный размер загружаемого отчета (/process/upload), в байтах после распаковки gzip
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+
+# Фоновые задачи "With Samples": SQLite-файл, общий для воркеров, число задач, выполняемых
+# одновременно на воркер, и лимит запросов к ELK "в полете" на одну задачу
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "jobs.db")
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "2")))
+JOB_ELK_CONCURRENCY = max(1, int(os.getenv("JOB_ELK_CONCURRENCY", "5")))
+# С какого числа пар /process сам ставит задачу в очередь (0 - только по background=true)
+JOB_AUTO_PAIRS = int(os.getenv("JOB_AUTO_PAIRS", "0"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "2")) # Как часто воркер ищет задачи в очереди
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60")) # Через сколько секунд без heartbeat задача считается брошенной
+JOB_RETENTION = float(os.getenv("JOB_RETENTION", str(24 * 3600))) # Сколько хранить завершенные задачи
+
+if SIP_LOG_BACKEND not in ("elk", "sqlite"):
+    logger.warning(f"Unknown SIP_LOG_BACKEND '{SIP_LOG_BACKEND}', falling back to 'elk'.")
+    SIP_LOG_BACKEND = "elk"
 
 # Проверка наличия необходимых переменных для ELK
-if not all([ELK_URL, ELK_USER, ELK_PASSWORD]):
+if SIP_LOG_BACKEND == "elk" and not all([ELK_URL, ELK_USER, ELK_PASSWORD]):
     logger.warning("ELK credentials (ELK_URL, ELK_USER, ELK_PASSWORD) are not fully configured in environment variables. 'With Samples' logic will likely fail.")
     # В зависимости от требований, можно выбросить исключение при старте
     # raise ValueError("Missing required ELK environment variables")
 
-app = FastAPI(title="iTest text filter", version="1.0.0")
+try:
+    ELK_WINDOW_STEP_DURATIONS = parse_duration_list(ELK_WINDOW_STEPS)
+    ELK_REPORT_WINDOW_MARGIN_DURATION = parse_duration(ELK_REPORT_WINDOW_MARGIN)
+except ValueError as e:
+    raise ValueError(f"Invalid ELK window configuration: {e}") from e
+
+# URL поиска по выбранным индексам: ELK_URL вида '<host>/<index>/_search', индекс заменяется списком
+_ELK_INDEX_IN_URL_RE = re.compile(r"/([^/]+)/_search/?$")
+if ELK_INDEX_PATTERN and not (ELK_URL and _ELK_INDEX_IN_URL_RE.search(ELK_URL)):
+    logger.warning("ELK_INDEX_PATTERN is set but ELK_URL does not look like '<host>/<index>/_search'. Daily index targeting is disabled.")
+    ELK_INDEX_PATTERN = None
+
+if ELK_LOOKUP_MODE not in ("single", "msearch"):
+    logger.warning(f"Unknown ELK_LOOKUP_MODE '{ELK_LOOKUP_MODE}', falling back to 'single'.")
+    ELK_LOOKUP_MODE = "single"
+elif ELK_LOOKUP_MODE == "msearch" and not ELK_MSEARCH_URL:
+    logger.warning("ELK_LOOKUP_MODE=msearch but ELK_MSEARCH_URL could not be derived from ELK_URL (expected a '.../_search' URL). Falling back to 'single'.")
+    ELK_LOOKUP_MODE = "single"
+
+# Общий асинхронный клиент ELK (пул соединений) и семафор, ограничивающий число запросов "в полете".
+# Создаются лениво внутри работающего event loop и закрываются при остановке приложения.
+_elk_client: Optional[httpx.AsyncClient] = None
+_elk_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def get_elk_client() -> httpx.AsyncClient:
+    """Возвращает общий httpx.AsyncClient для ELK, создавая его при первом обращении."""
+    global _elk_client, _elk_semaphore
+    if _elk_client is None:
+        _elk_client = httpx.AsyncClient(
+            auth=httpx.BasicAuth(ELK_USER or "", ELK_PASSWORD or ""),
+            headers={'Content-Type': 'application/json'},
+            timeout=ELK_TIMEOUT,
+            # Запас соединений для hedged-запросов: они идут сверх ELK_CONCURRENCY
+            limits=httpx.Limits(max_connections=ELK_CONCURRENCY * 2, max_keepalive_connections=ELK_CONCURRENCY),
+        )
+        _elk_semaphore = asyncio.Semaphore(ELK_CONCURRENCY)
+    return _elk_client
+
+
+async def close_elk_client() -> None:
+    """Закрывает общий клиент ELK и освобождает соединения пула."""
+    global _elk_client, _elk_semaphore
+    if _elk_client is not None:
+        await _elk_client.aclose()
+    _elk_client = None
+    _elk_semaphore = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global job_store, job_runner
+    # Хранилище задач открывается при старте воркера, а не при импорте: batch.py, тесты и
+    # бенчмарки импортируют main без фоновых задач и не создают jobs.db
+    job_store = JobStore(JOB_STORE_PATH)
+    job_runner = JobRunner(
+        job_store,
+        iter_cli_pair_results,
+        max_jobs=JOB_WORKERS,
+        job_concurrency=JOB_ELK_CONCURRENCY,
+        poll_interval=JOB_POLL_INTERVAL,
+        stale_after=JOB_STALE_AFTER,
+        retention=JOB_RETENTION,
+    )
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    job_store.close()
+    job_store = job_runner = None
+    await close_elk_client()
+    mark_worker_stopped()
+
+
+app = FastAPI(title="iTest text filter", version="1.0.0", lifespan=lifespan)
+
+elk_cache = ELKCache(
+    max_entries=ELK_CACHE_MAX_ENTRIES,
+    ttl=ELK_CACHE_TTL,
+    negative_ttl=ELK_CACHE_NEGATIVE_TTL,
+    db_path=ELK_CACHE_PATH,
+)
+
+# Одновременные поиски одного CLI (из разных запросов) выполняются одним запросом к ELK
+elk_flight = SingleFlight()
+# Состояние ELK на воркере: circuit breaker и задержки недавних запросов (для hedging)
+elk_breaker = CircuitBreaker(ELK_BREAKER_FAILURES, ELK_BREAKER_RESET)
+_elk_latency = {"search": LatencyTracker(), "msearch": LatencyTracker(), "pit": LatencyTracker()}
+
+# Фоновые задачи "With Samples" (создаются в lifespan)
+job_store: Optional[JobStore] = None
+job_runner: Optional[JobRunner] = None
+
+# Локальное хранилище SIP-логов вместо ELK (SIP_LOG_BACKEND=sqlite)
+sip_store: Optional[SipLogStore] = None
+if SIP_LOG_BACKEND == "sqlite":
+    sip_store = SipLogStore(SIP_STORE_PATH)
+    logger.info(f"'With Samples' lookups use the local SIP log store at {SIP_STORE_PATH} instead of ELK.")
 
 # Монтирование статических файлов
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 
 # Настройка шаблонов Jinja2
-templates = Jinja2Templates(directory="templates")
+templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+
+# Статусы обработки одной пары CLI в режиме "With Samples"
+PAIR_OK = "ok"                                   # Найдены BYE и INVITE, результат сформирован
+PAIR_NO_HITS = "no-hits"                         # В ELK нет записей о звонке (нет hits, BYE или INVITE)
+PAIR_VERIFICATION_FAILED = "verification-failed" # Записи найдены, но поля не извлечены или CLI не совпал
+PAIR_ELK_ERROR = "elk-error"                     # Запрос к ELK не удался
+PAIR_ELK_UNAVAILABLE = "elk-unavailable"         # ELK недоступен (circuit breaker открыт), запрос не отправлялся
+PAIR_TIMED_OUT = "timed-out"                     # Истек общий срок запроса (ELK_REQUEST_DEADLINE)
 
 # --- Вспомогательные функции ---
 
-def extract_numeric_lines(text: str) -> List[str]:
+# Разделители строк - те же, что у str.splitlines()
+_LINE_BREAKS = frozenset("\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029")
+_SCAN_BLOCK_SIZE = 64 * 1024 # Размер блока, которым читается большой текст
+
+CLI_SENT_PREFIX = "42123"
+NO_CLI_PRESENTED = "No CLI presented"
+
+# Дата и время в строке отчета: "2024-01-31 10:00[:00]" (или с 'T') и "31.01.2024 10:00[:00]" (или через '/')
+_REPORT_TIME_RE = re.compile(
+    r"(?:(\d{4})-(\d{2})-(\d{2})|(\d{2})[./](\d{2})[./](\d{4}))[ T](\d{2}):(\d{2})(?::(\d{2}))?"
+)
+
+
+def parse_report_time(line: str) -> Optional[str]:
+    """Возвращает дату и время из строки отчета в виде 'YYYY-MM-DDTHH:MM:SS' или None."""
+    time_match = _REPORT_TIME_RE.search(line)
+    if not time_match:
+        return None
+    year, month, day, day2, month2, year2, hour, minute, second = time_match.groups()
+    try:
+        moment = datetime(
+            int(year or year2), int(month or month2), int(day or day2), int(hour), int(minute), int(second or 0)
+        )
+    except ValueError:
+        return None
+    return moment.isoformat()
+
+
+class ReportLineSplitter:
+    """Разбивает текст, поступающий кусками, на непустые строки без пробелов по краям.
+
+    Строка, разорванная между кусками, склеивается; после последнего куска нужно вызвать close().
+    """
+
+    def __init__(self):
+        self._carry = ""
+
+    def feed(self, chunk: str) -> Iterator[str]:
+        if not chunk:
+            return
+        parts = (self._carry + chunk).splitlines(True)
+        self._carry = ""
+        if parts[-1][-1] not in _LINE_BREAKS:
+            self._carry = parts.pop() # Последняя строка может продолжиться в следующем куске
+        for part in parts:
+            line = part.strip()
+            if line:
+                yield line
+
+    def close(self) -> Iterator[str]:
+        line = self._carry.strip()
+        self._carry = ""
+        if line:
+            yield line
+
+
+def iter_report_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """Отдает непустые строки отчета (strip) за один проход, не создавая список всех строк.
+
+    source - весь текст целиком (читается блоками по _SCAN_BLOCK_SIZE) или итерируемый
+    источник кусков текста (например, текстовый файл).
+    """
+    if isinstance(source, str):
+        text = source
+        chunks: Iterable[str] = (text[i:i + _SCAN_BLOCK_SIZE] for i in range(0, len(text), _SCAN_BLOCK_SIZE))
+    else:
+        chunks = source
+
+    splitter = ReportLineSplitter()
+    for chunk in chunks:
+        yield from splitter.feed(chunk)
+    yield from splitter.close()
+
+
+class NumericLineScanner:
+    """Автомат для логики "Only CLI": номер, следующий за строкой, начинающейся с '42123'.
+
+    Состояние сохраняется между вызовами feed(), поэтому строки можно подавать порциями.
+    """
+
+    def __init__(self):
+        self._after_sent = False
+
+    def feed(self, lines: Iterable[str]) -> Iterator[str]:
+        after_sent = self._after_sent
+        for line in lines:
+            # Проверяем, является ли строка числом (возможно, со знаком '+')
+            if after_sent and (line.isdigit() or (line.startswith("+") and line[1:].isdigit())):
+                yield line
+            after_sent = line.startswith(CLI_SENT_PREFIX)
+            self._after_sent = after_sent
+
+
+class CliPairScanner:
+    """Автомат для логики "With Samples": пары (CLI Sent, CLI Received).
+
+    Строка '42123...' ждет следующую строку: номер или 'No CLI presented' (сохраняется как
+    "anonymous"). Строка, вошедшая в пару, уже не может начать новую пару. Если выше в
+    отчете встречались дата и время, пара получает последнее из них в поле "time"
+    (см. parse_report_time). Состояние сохраняется между вызовами feed(), поэтому строки
+    можно подавать порциями.
+    """
+
+    def __init__(self):
+        self._pending_sent: Optional[str] = None
+        self._time: Optional[str] = None
+
+    def feed(self, lines: Iterable[str]) -> Iterator[Dict[str, str]]:
+        pending_sent = self._pending_sent
+        report_time = self._time
+        for line in lines:
+            # Дешевая проверка до регулярного выражения: в строке с датой есть ':' и год 20xx
+            if ":" in line and "20" in line:
+                report_time = parse_report_time(line) or report_time
+                self._time = report_time
+            if pending_sent is not None:
+                # Проверяем, является ли строка валидным номером
+                if line.isdigit() or (line.startswith("+") and line[1:].isdigit()):
+                    self._pending_sent = None
+                    pair = {"sent": pending_sent, "received": line}
+                    if report_time is not None:
+                        pair["time"] = report_time
+                    yield pair
+                    pending_sent = None
+                    continue
+                # Если строка "No CLI presented" - сохраняем как "anonymous"
+                if line == NO_CLI_PRESENTED:
+                    self._pending_sent = None
+                    pair = {"sent": pending_sent, "received": "anonymous"}
+                    if report_time is not None:
+                        pair["time"] = report_time
+                    yield pair
+                    pending_sent = None
+                    continue
+            pending_sent = line if line.startswith(CLI_SENT_PREFIX) else None
+            self._pending_sent = pending_sent
+
+
+def iter_numeric_lines(source: Union[str, Iterable[str]]) -> Iterator[str]:
+    """Генератор для extract_numeric_lines: отдает номера по мере разбора source."""
+    return NumericLineScanner().feed(iter_report_lines(source))
+
+
+def iter_cli_pairs(source: Union[str, Iterable[str]]) -> Iterator[Dict[str, str]]:
+    """Генератор для extract_cli_pairs: отдает пары по мере разбора source."""
+    return CliPairScanner().feed(iter_report_lines(source))
+
+
+def extract_numeric_lines(text: Union[str, Iterable[str]]) -> List[str]:
     """Извлекает числовые строки, следующие за строками, начинающимися с '42123'."""
     if not text:
         return []
-    
-    # Возвращаем старый метод итерации по строкам
-    lines = [line.strip() for line in text.splitlines() if line.strip()]
-    results = []
-    for i, line in enumerate(lines):
-        if line.startswith("42123") and i + 1 < len(lines):
-            next_line = lines[i + 1].strip()
-            # Проверяем, является ли следующая строка числом (возможно, со знаком '+')
-            if next_line.isdigit() or (next_line.startswith("+") and next_line[1:].isdigit()):
-                results.append(next_line)
-
-    return results
+    return list(iter_numeric_lines(text))
 
-def extract_cli_pairs(text: str) -> List[Dict[str, str]]:
+def extract_cli_pairs(text: Union[str, Iterable[str]]) -> List[Dict[str, str]]:
     """Извлекает пары (CLI Sent, CLI Received), включая случаи с 'No CLI presented'."""
     if not text:
         return []
 
-    lines = [line.strip() for line in text.splitlines() if line.strip()] # Убираем пустые строки
-    pairs = []
-    i = 0
-    while i < len(lines):
-        current_line = lines[i]
-        # Проверяем, начинается ли текущая строка с 42123 и есть ли следующая строка
-        if current_line.startswith("42123") and i + 1 < len(lines):
-            next_line = lines[i + 1]
-            # Проверяем, является ли следующая строка валидным номером
-            if next_line.isdigit() or (next_line.startswith("+") and next_line[1:].isdigit()):
-                # Нашли валидную пару с номером!
-                pairs.append({"sent": current_line, "received": next_line})
-                # Перескакиваем через найденную пару
-                i += 2
-                continue # Переходим к следующей итерации внешнего цикла
-            # --- Новая проверка: если следующая строка "No CLI presented" ---
-            elif next_line == "No CLI presented":
-                 # Нашли пару с "No CLI presented", сохраняем как "anonymous"
-                 pairs.append({"sent": current_line, "received": "anonymous"})
-                 # Перескакиваем через найденную пару
-                 i += 2
-                 continue # Переходим к следующей итерации внешнего цикла
-            # --- Конец новой проверки ---
-
-        # Если пара (валидная или "No CLI") не найдена на текущей строке,
-        # просто переходим к следующей
-        i += 1
+    pairs = list(iter_cli_pairs(text))
 
     if not pairs:
          # Updated warning message
          logger.warning("No lines starting with '42123' followed by a number or 'No CLI presented' were found.")
-         logger.debug("Text snippet where search failed (first 1000 chars): %s", text[:1000])
+         if isinstance(text, str):
+             logger.debug("Text snippet where search failed (first 1000 chars): %s", text[:1000])
     else:
          # Updated info message
         logger.info(f"Extracted {len(pairs)} CLI pairs (including 'anonymous').")
 
     return pairs
 
-def query_elk(cli_sent: str) -> Optional[Dict]:
-    """Выполняет запрос к Elasticsearch для поиска записей по cli_sent за последние 3 дня."""
-    # Дополнительная проверка перед запросом
-    if not all([ELK_URL, ELK_USER, ELK_PASSWORD]):
-        logger.error("Cannot query ELK: Credentials are not configured.")
+_GZIP_MAGIC = b"\x1f\x8b"
+_UPLOAD_READ_SIZE = 64 * 1024 # Размер куска при чтении загруженного файла и распаковке gzip
+
+
+async def _iter_upload_file(upload: UploadFile) -> AsyncIterator[bytes]:
+    """Читает загруженный multipart-файл кусками по _UPLOAD_READ_SIZE."""
+    while True:
+        chunk = await upload.read(_UPLOAD_READ_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+async def iter_upload_text(byte_chunks: AsyncIterator[bytes], max_bytes: int = MAX_UPLOAD_BYTES) -> AsyncIterator[str]:
+    """Превращает поток байт загрузки в поток текста: распаковывает gzip (по сигнатуре) и декодирует UTF-8.
+
+    Превышение max_bytes (до или после распаковки) - HTTP 413, поврежденный gzip - HTTP 400.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    decompressor = None
+    head = b"" # Начало загрузки, пока не набралось байт на сигнатуру gzip
+    received_bytes = 0
+    text_bytes = 0
+
+    def check_size(size: int) -> None:
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Uploaded report exceeds the limit of {max_bytes} bytes.")
+
+    async for chunk in byte_chunks:
+        if not chunk:
+            continue
+        received_bytes += len(chunk)
+        check_size(received_bytes)
+        if head is not None:
+            head += chunk
+            if len(head) < len(_GZIP_MAGIC):
+                continue
+            chunk, head = head, None
+            if chunk.startswith(_GZIP_MAGIC):
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) # 16 + - формат gzip
+        if decompressor is None:
+            yield decoder.decode(chunk)
+            continue
+
+        # Распаковываем порциями, чтобы "gzip-бомба" не развернулась в памяти целиком.
+        # Файл может состоять из нескольких gzip-членов подряд (cat a.gz b.gz > report.gz):
+        # данные после конца очередного члена распаковываются новым decompressobj
+        try:
+            pending = chunk
+            while pending:
+                if decompressor.eof:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data = decompressor.decompress(pending, _UPLOAD_READ_SIZE)
+                text_bytes += len(data)
+                check_size(text_bytes)
+                yield decoder.decode(data)
+                pending = decompressor.unconsumed_tail or decompressor.unused_data
+        except zlib.error as e:
+            raise HTTPException(status_code=400, detail=f"Uploaded gzip data is corrupted: {e}")
+
+    if decompressor is not None and not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Uploaded gzip data is truncated.")
+    yield decoder.decode(head or b"", final=True)
+
+
+async def parse_report_upload(byte_chunks: AsyncIterator[bytes], logic_choice: str) -> List:
+    """Разбирает загружаемый отчет по мере поступления кусков, не собирая весь текст в одну строку.
+
+    Возвращает номера (logic_choice="only_cli") или пары CLI ("with_samples").
+    """
+    splitter = ReportLineSplitter()
+    scanner = NumericLineScanner() if logic_choice == "only_cli" else CliPairScanner()
+    results = []
+    async for text_chunk in iter_upload_text(byte_chunks):
+        results.extend(scanner.feed(splitter.feed(text_chunk)))
+    results.extend(scanner.feed(splitter.close()))
+    return results
+
+
+def pair_report_window(cli_pairs: Iterable[Dict[str, str]]) -> Optional[TimeWindow]:
+    """Окно поиска по времени тестов из отчета (поле "time" пар, см. CliPairScanner) или None.
+
+    Время отчета переводится в UTC по ELK_REPORT_UTC_OFFSET, окно расширяется на ELK_REPORT_WINDOW_MARGIN.
+    """
+    if not ELK_REPORT_WINDOW:
         return None
-        
+    offset = timedelta(hours=ELK_REPORT_UTC_OFFSET)
+    times = (datetime.fromisoformat(pair["time"]) - offset for pair in cli_pairs if pair.get("time"))
+    return report_window(times, ELK_REPORT_WINDOW_MARGIN_DURATION)
+
+
+def lookup_windows(window: Optional[TimeWindow] = None) -> List[Tuple[str, TimeWindow]]:
+    """Окна поиска для CLI в порядке запросов, с метками для метрик и логов.
+
+    Окна постепенного расширения идут от текущего момента (ELK_WINDOW_STEPS, затем до
+    ELK_LOOKBACK_DAYS); метка - глубина окна. Если есть окно из отчета, первым ищется оно
+    ("report"), а окна расширения остаются запасными: при неверном ELK_REPORT_UTC_OFFSET
+    BYE в окне отчета не найдется, и пары не должны из-за этого теряться.
+    """
     now = datetime.utcnow()
-    three_days_ago = now - timedelta(days=3)
-    
-    # Форматируем даты для ELK range query
-    # Используем 'strict_date_optional_time_nanos' совместимый формат
-    gte_date = three_days_ago.strftime('%Y-%m-%dT%H:%M:%S.%fZ') 
-    lt_date = now.strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+    windows = progressive_windows(now, ELK_WINDOW_STEP_DURATIONS, timedelta(days=ELK_LOOKBACK_DAYS))
+    progressive = [(format_duration(now - search_window.gte), search_window) for search_window in windows]
+    if window is not None:
+        return [("report", window)] + progressive
+    return progressive
 
+
+def elk_window_indices(window: TimeWindow) -> Optional[str]:
+    """Суточные индексы, покрывающие окно, через запятую (см. ELK_INDEX_PATTERN) или None - индекс из ELK_URL."""
+    if not ELK_INDEX_PATTERN:
+        return None
+    index_names = daily_index_names(ELK_INDEX_PATTERN, window, ELK_INDEX_MAX_DAYS)
+    return ",".join(index_names) if index_names else None
+
+
+# Суточного индекса может еще не быть или он уже удален - это не ошибка запроса
+_ELK_INDEX_OPTIONS = {"ignore_unavailable": "true", "allow_no_indices": "true"}
+
+
+def build_elk_query(
+    cli_sent: str, window: TimeWindow, search_after: Optional[List] = None, pit: Optional[Dict] = None
+) -> Dict:
+    """Формирует тело запроса к Elasticsearch для поиска записей по cli_sent в окне window.
+
+    Фильтрация выполняется на стороне ELK: только сообщения BYE/INVITE и только поля
+    'message' и '@timestamp'. search_after - значения 'sort' последнего документа
+    предыдущей страницы. pit - {"id", "keep_alive"} point-in-time для чтения страниц
+    (см. complete_elk_response).
+    """
     query_payload = {
       "query": {
         "bool": {
           "must": [
-            { "match": { "message": cli_sent }} 
+            { "match": { "message": cli_sent }}
           ],
           "filter": [
+            window.range_filter(),
             {
-              "range": {
-                "@timestamp": {
-                  "gte": gte_date, 
-                  "lt": lt_date,
-                  "format": "strict_date_optional_time_nanos||epoch_millis" # Добавляем формат
-                }
+              "bool": {
+                "should": [
+                  { "match_phrase": { "message": "method=BYE;" }},
+                  { "match_phrase": { "message": "method=INVITE;" }}
+                ],
+                "minimum_should_match": 1
               }
             }
           ]
         }
       },
-      "size": 100, # Достаточно для поиска нужных записей
-      "sort": [ { "@timestamp": "asc" } ] # Сортируем по времени
+      "_source": ["message", "@timestamp"],
+      "size": ELK_PAGE_SIZE,
+      # Сортируем по времени; _doc - для стабильного порядка при одинаковом времени. _doc уникален
+      # только внутри шарда, поэтому для search_after по нескольким страницам нужен PIT (см. ниже)
+      "sort": [ { "@timestamp": "asc" }, { "_doc": "asc" } ]
+    }
+    if pit is not None:
+        # В PIT _shard_doc уникален для всех шардов и индексов: hits с одинаковым временем
+        # на границе страниц не пропускаются. Индекс задается самим PIT, а не URL
+        query_payload["pit"] = dict(pit)
+        query_payload["sort"] = [ { "@timestamp": "asc" }, { "_shard_doc": "asc" } ]
+    if search_after:
+        query_payload["search_after"] = search_after
+    return query_payload
+
+
+def build_invite_query(call_id: str, window: TimeWindow) -> Dict:
+    """Формирует запрос для точечного поиска INVITE по call_id в окне window."""
+    return {
+      "query": {
+        "bool": {
+          "filter": [
+            window.range_filter(),
+            { "match_phrase": { "message": f"call_id={call_id}" }},
+            { "match_phrase": { "message": "method=INVITE;" }}
+          ]
+        }
+      },
+      "_source": ["message", "@timestamp"],
+      "size": 10,
+      "sort": [ { "@timestamp": "asc" } ]
     }
 
+
+def elk_cache_key(cli_sent: str, window: Optional[TimeWindow] = None) -> str:
+    """Ключ кэша ELK: номер CLI и окно поиска (окно из отчета или шаги расширения и глубина)."""
+    if window is not None:
+        return f"{cli_sent}|{window.label()}"
+    return f"{cli_sent}|{ELK_WINDOW_STEPS.replace(' ', '')}|{ELK_LOOKBACK_DAYS:g}d"
+
+
+def cache_elk_response(cli_sent: str, elk_response: Optional[Dict], window: Optional[TimeWindow] = None) -> None:
+    """Сохраняет ответ ELK в кэш. Ошибки и пустые ответы кэшируются как отрицательные записи."""
+    if elk_response is None or not isinstance(elk_response.get('hits'), dict):
+        elk_cache.put(elk_cache_key(cli_sent, window), None)
+        return
+    # Храним только секцию 'hits' - остальное (took, _shards) для обработки не нужно
+    hits_section = elk_response['hits']
+    elk_cache.put(elk_cache_key(cli_sent, window), {"hits": hits_section}, negative=not hits_section.get('hits'))
+
+
+def _window_result(previous: Optional[Dict], elk_response: Optional[Dict]) -> Tuple[Optional[Dict], bool]:
+    """Выбирает ответ после поиска в очередном окне. Возвращает (ответ, поиск закончен).
+
+    Поиск заканчивается, если найден BYE или запрос не удался (без ответа нельзя сказать,
+    есть ли BYE в этом окне). Если BYE нет, остается ответ с hits - от него зависит статус пары.
+    """
+    if not elk_response or not isinstance(elk_response.get('hits'), dict):
+        return elk_response, True
+    hits = elk_response['hits'].get('hits', [])
+    if hits and SipHitIndex(hits).bye_source is not None:
+        return elk_response, True
+    if not hits and previous and previous['hits'].get('hits'):
+        return previous, False
+    return elk_response, False
+
+
+async def query_elk(cli_sent: str, window: Optional[TimeWindow] = None) -> Optional[Dict]:
+    """Асинхронно выполняет запрос к Elasticsearch для поиска записей по cli_sent.
+
+    window - окно из отчета; без него окно расширяется постепенно (см. lookup_windows).
+    Сначала проверяется кэш ELK. Если этот CLI уже ищется другим запросом, ждем его
+    результата вместо нового запроса. Число одновременных запросов ограничено
+    ELK_CONCURRENCY, соединения берутся из общего пула. С SIP_LOG_BACKEND=sqlite поиск
+    идет в локальном хранилище, без кэша.
+    """
+    if sip_store is not None:
+        return lookup_sip_store(cli_sent, window)
+    cache_key = elk_cache_key(cli_sent, window)
+    found, cached_response = elk_cache.get(cache_key)
+    if found:
+        logger.debug(f"ELK cache hit for {cli_sent}.")
+        return cached_response
+
+    call = elk_flight.join(cache_key)
+    if call is not None:
+        logger.debug("ELK lookup for %s is already in flight, waiting for it.", cli_sent)
+        count_saved_lookups("in_flight")
+    else:
+        call = elk_flight.start(cache_key, _fetch_and_cache_elk(cli_sent, window))
+    return (await elk_flight.wait([call]))[0]
+
+
+def lookup_sip_store(cli_sent: str, window: Optional[TimeWindow] = None) -> Optional[Dict]:
+    """Поиск по cli_sent в локальном хранилище SIP-логов (см. sip_store) с теми же окнами, что в ELK.
+
+    Ответ - в формате ELK _search; None, если хранилище недоступно.
+    """
+    result = None
     try:
-        response = requests.post(
-            ELK_URL,
-            auth=HTTPBasicAuth(ELK_USER, ELK_PASSWORD),
-            headers={'Content-Type': 'application/json'},
-            json=query_payload, # Используем json параметр для авто-сериализации
-            timeout=ELK_TIMEOUT
-        )
+        with stage_timer("store_lookup"):
+            for depth, search_window in lookup_windows(window):
+                store_response = sip_store.lookup(cli_sent, search_window, ELK_INVITE_MARGIN)
+                result, done = _window_result(result, store_response)
+                if done:
+                    count_lookup_window(depth)
+                    return result
+    except sqlite3.Error as e:
+        logger.error(f"SIP log store lookup failed for {cli_sent}: {e}")
+        return None
+    count_lookup_window("not_found")
+    return result
+
+
+async def _fetch_and_cache_elk(cli_sent: str, window: Optional[TimeWindow]) -> Optional[Dict]:
+    elk_response = await _fetch_elk(cli_sent, window)
+    cache_elk_response(cli_sent, elk_response, window)
+    return elk_response
+
+
+async def _fetch_elk(cli_sent: str, window: Optional[TimeWindow] = None) -> Optional[Dict]:
+    """Выполняет поиск по cli_sent в ELK (с дочитыванием страниц и расширением окна), минуя кэш."""
+    # Дополнительная проверка перед запросом
+    if not all([ELK_URL, ELK_USER, ELK_PASSWORD]):
+        logger.error("Cannot query ELK: Credentials are not configured.")
+        return None
+
+    result = None
+    windows = lookup_windows(window)
+    for step, (depth, search_window) in enumerate(windows, 1):
+        elk_response = await _elk_search(build_elk_query(cli_sent, search_window), cli_sent, search_window)
+        elk_response = await complete_elk_response(cli_sent, elk_response, search_window)
+        result, done = _window_result(result, elk_response)
+        if done:
+            if result:
+                count_lookup_window(depth)
+            return result
+        if step < len(windows):
+            logger.debug("No BYE for %s within %s, widening the ELK window.", cli_sent, depth)
+    count_lookup_window("not_found")
+    return result
+
+
+async def _elk_search(query_payload: Dict, label: str, window: TimeWindow) -> Optional[Dict]:
+    """Выполняет один запрос _search к ELK (по индексам окна window). label используется только в логах."""
+    indices = elk_window_indices(window)
+    if indices:
+        url = _ELK_INDEX_IN_URL_RE.sub(lambda _: f"/{indices}/_search", ELK_URL)
+        params = _ELK_INDEX_OPTIONS
+    else:
+        url, params = ELK_URL, None
+    return await _elk_post("search", url, label, json=query_payload, params=params) # json - авто-сериализация
+
+
+def _elk_health(healthy: bool) -> None:
+    """Сообщает circuit breaker итог запроса к ELK и пишет в лог смену его состояния."""
+    was_open = elk_breaker.state != CircuitBreaker.CLOSED
+    if healthy:
+        elk_breaker.record_success()
+    else:
+        elk_breaker.record_failure()
+    is_open = elk_breaker.state != CircuitBreaker.CLOSED
+    if is_open != was_open:
+        if is_open:
+            logger.error(f"ELK circuit breaker opened: ELK is treated as unavailable for {ELK_BREAKER_RESET:g}s.")
+        else:
+            logger.info("ELK circuit breaker closed: ELK is available again.")
+    set_elk_circuit_open(is_open)
+
+
+def _retry_after(response: httpx.Response) -> float:
+    """Задержка из заголовка Retry-After (только число секунд) или 0."""
+    value = response.headers.get("retry-after", "").strip()
+    return float(value) if value.isdigit() else 0.0
+
+
+async def _elk_attempt(endpoint: str, url: str, timeout: float, request_kwargs: Dict) -> httpx.Response:
+    """Одна попытка запроса к ELK: ответ 2xx или исключение httpx.
+
+    Если ответа нет дольше ELK_HEDGE_PERCENTILE-перцентиля недавних запросов, параллельно
+    отправляется такой же запрос (hedging) и берется первый ответ.
+    """
+    client = get_elk_client()
+    latency = _elk_latency[endpoint]
+
+    async def send() -> httpx.Response:
+        started = time.perf_counter()
+        with ELK_IN_FLIGHT.track_inprogress(), stage_timer("elk_request"):
+            response = await client.post(url, timeout=timeout, **request_kwargs)
         response.raise_for_status() # Вызовет исключение для кодов 4xx/5xx
-        return response.json()
-    except requests.exceptions.Timeout:
-        logger.error(f"ELK query timed out for {cli_sent}.")
+        latency.observe(time.perf_counter() - started)
+        return response
+
+    hedge_after = latency.percentile(ELK_HEDGE_PERCENTILE) if ELK_HEDGE_PERCENTILE > 0 else None
+    if hedge_after is not None:
+        hedge_after = max(hedge_after, ELK_HEDGE_MIN_DELAY)
+    # Hedged-запрос занимает соединение сверх ELK_CONCURRENCY, но не место в очереди семафора
+    async with _elk_semaphore:
+        response, winner = await hedged(send, hedge_after)
+    if winner is not None:
+        count_elk_hedge(endpoint, winner)
+    return response
+
+
+async def _elk_post(endpoint: str, url: str, label: str, **request_kwargs) -> Optional[Any]:
+    """Отправляет запрос к ELK ("search", "msearch" или "pit") и возвращает разобранный JSON или None при ошибке.
+
+    Попытка ограничена ELK_ATTEMPT_TIMEOUT. После 429/5xx, таймаута или ошибки соединения
+    запрос повторяется до ELK_RETRIES раз с задержкой, пока не исчерпан бюджет ELK_TIMEOUT.
+    Пока circuit breaker открыт, запрос не отправляется и выбрасывается ElkUnavailableError.
+    Breaker проверяется один раз на вызов: повторы пробного (half-open) запроса идут без
+    новой проверки, а итог вызова (или его отмена) всегда снимает отметку пробного запроса.
+    """
+    probing = elk_breaker.state == CircuitBreaker.HALF_OPEN
+    if not elk_breaker.allow():
+        count_elk_request(endpoint, "circuit_open")
+        raise ElkUnavailableError(f"ELK _{endpoint} skipped for {label}: ELK is unavailable (circuit breaker open).")
+    try:
+        return await _elk_post_attempts(endpoint, url, label, request_kwargs)
+    finally:
+        if probing:
+            elk_breaker.release() # Итог уже записан в _elk_health; здесь - только отмена или неожиданная ошибка
+
+
+async def _elk_post_attempts(endpoint: str, url: str, label: str, request_kwargs: Dict) -> Optional[Any]:
+    """Попытки запроса к ELK с повторами (см. _elk_post); итог сообщается circuit breaker."""
+    loop = asyncio.get_running_loop()
+    budget_ends = loop.time() + ELK_TIMEOUT
+    name = f"ELK _{endpoint}"
+    attempt = 0
+    while True:
+        attempt += 1
+        retry_after = 0.0
+        try:
+            response = await _elk_attempt(endpoint, url, min(ELK_ATTEMPT_TIMEOUT, budget_ends - loop.time()), request_kwargs)
+            with stage_timer("elk_decode"):
+                elk_response = response.json()
+        except httpx.TimeoutException:
+            count_elk_request(endpoint, "timeout")
+            problem = "timed out"
+        except httpx.HTTPStatusError as e:
+            count_elk_request(endpoint, "http_error")
+            status_code = e.response.status_code
+            if status_code != 429 and status_code < 500:
+                # ELK ответил - ошибка в запросе, а не в доступности ELK; повтор не поможет
+                _elk_health(True)
+                logger.error(f"{name} failed for {label}: {e}")
+                # Логируем тело ответа для диагностики
+                logger.error(f"ELK response status: {status_code}")
+                logger.error(f"ELK response body: {e.response.text[:500]}...") # Ограничиваем длину
+                return None
+            problem = f"failed with HTTP {status_code}"
+            retry_after = _retry_after(e.response)
+        except httpx.HTTPError as e:
+            count_elk_request(endpoint, "connection_error")
+            problem = f"failed: {e!r}"
+        except json.JSONDecodeError:
+            count_elk_request(endpoint, "decode_error")
+            _elk_health(True)
+            logger.error(f"Failed to decode JSON response from {name} for {label}.")
+            return None
+        else:
+            count_elk_request(endpoint, "ok")
+            _elk_health(True)
+            return elk_response
+
+        delay = max(backoff_delay(attempt, ELK_RETRY_BACKOFF, ELK_RETRY_BACKOFF_MAX), retry_after)
+        if attempt > ELK_RETRIES or loop.time() + delay >= budget_ends:
+            _elk_health(False)
+            logger.error(f"{name} {problem} for {label} (attempt {attempt}, giving up).")
+            return None
+        count_elk_retry(endpoint)
+        logger.warning(f"{name} {problem} for {label} (attempt {attempt}), retrying in {delay:.2f}s.")
+        await asyncio.sleep(delay)
+
+
+async def complete_elk_response(cli_sent: str, elk_response: Optional[Dict], window: TimeWindow) -> Optional[Dict]:
+    """Дополняет первую страницу ответа ELK (поиск в окне window) до набора, достаточного для process_elk_hits.
+
+    Если BYE нет на первой странице, следующие страницы читаются через search_after
+    (не более ELK_MAX_PAGES) в point-in-time с сортировкой по @timestamp и _shard_doc.
+    Порядок первой страницы (_doc) в PIT не продолжить, поэтому чтение в PIT начинается
+    сначала, а hits первой страницы пропускаются (по _index и _id). Если PIT открыть нельзя
+    (в ELK_URL нет индекса или ELK старше 7.10), страницы читаются по _doc, как раньше:
+    hits с одинаковым временем на границе страниц из разных шардов могут быть пропущены.
+    Если для найденного BYE нет INVITE с тем же call_id,
+    INVITE ищется отдельным запросом по call_id (окно расширяется назад на ELK_INVITE_MARGIN).
+    В результате остаются только hits, нужные для analyze_elk_hits (см. SipHitIndex.relevant_hits).
+    """
+    if not elk_response or not isinstance(elk_response.get('hits'), dict):
+        return elk_response
+
+    page = elk_response['hits'].get('hits', [])
+    if not page:
+        return elk_response
+    first_hit = page[0]
+    # Индекс пополняется постранично, так что hits просматриваются один раз
+    hit_index = SipHitIndex(page)
+    hits_read = len(page)
+    pages_read = 1
+    search_after = page[-1].get('sort')
+    seen = set()
+    pit = None
+    if hit_index.bye_source is None and len(page) >= ELK_PAGE_SIZE and ELK_MAX_PAGES > 1:
+        pit = await _open_elk_pit(cli_sent, window)
+    if pit is not None:
+        seen = {key for key in map(_elk_hit_key, page) if key is not None}
+        search_after = None
+        pages_read = 0
+    try:
+        while hit_index.bye_source is None and len(page) >= ELK_PAGE_SIZE and pages_read < ELK_MAX_PAGES:
+            if pages_read and not search_after:
+                break
+            query = build_elk_query(cli_sent, window, search_after=search_after, pit=pit)
+            label = f"{cli_sent} (page {pages_read + 1})"
+            next_response = await (_elk_pit_search(query, label) if pit is not None else _elk_search(query, label, window))
+            if not next_response or not isinstance(next_response.get('hits'), dict):
+                break
+            if pit is not None:
+                pit["id"] = next_response.get("pit_id") or pit["id"] # ELK может вернуть новый id
+            page = next_response['hits'].get('hits', [])
+            search_after = page[-1].get('sort') if page else None
+            hit_index.add([hit for hit in page if _elk_hit_key(hit) not in seen])
+            hits_read += len(page)
+            pages_read += 1
+    finally:
+        if pit is not None:
+            await _close_elk_pit(pit)
+    if pages_read > 1:
+        logger.debug(f"Read {pages_read} ELK pages ({hits_read} hits) for {cli_sent}.")
+
+    call_id = hit_index.bye_call_id
+    if call_id and hit_index.invite_for(call_id) is None:
+        logger.debug(f"INVITE for Call ID {call_id} not in first results for {cli_sent}, fetching by call_id.")
+        invite_window = window.widen(ELK_INVITE_MARGIN)
+        invite_response = await _elk_search(
+            build_invite_query(call_id, invite_window), f"{cli_sent} (INVITE {call_id})", invite_window
+        )
+        if invite_response and isinstance(invite_response.get('hits'), dict):
+            hit_index.add(invite_response['hits'].get('hits', []))
+
+    hits = hit_index.relevant_hits(first_hit)
+    return {"hits": {"total": elk_response['hits'].get('total', {}), "hits": hits}}
+
+
+def _elk_hit_key(hit: Dict) -> Optional[Tuple[str, str]]:
+    """Уникальный ключ документа ELK (_index, _id) или None, если _id в ответе нет."""
+    if hit.get('_id') is None:
         return None
-    except requests.exceptions.RequestException as e:
-        logger.error(f"ELK query failed for {cli_sent}: {e}")
-         # Логируем тело ответа, если есть, для диагностики
-        if hasattr(e, 'response') and e.response is not None:
-             logger.error(f"ELK response status: {e.response.status_code}")
-             logger.error(f"ELK response body: {e.response.text[:500]}...") # Ограничиваем длину
+    return hit.get('_index'), hit['_id']
+
+
+async def _open_elk_pit(label: str, window: TimeWindow) -> Optional[Dict]:
+    """Открывает point-in-time по индексам окна window (или индексу из ELK_URL).
+
+    Возвращает {"id", "keep_alive"} для build_elk_query или None, если PIT открыть нельзя.
+    """
+    match = _ELK_INDEX_IN_URL_RE.search(ELK_URL or "")
+    if match is None:
         return None
-    except json.JSONDecodeError:
-        logger.error(f"Failed to decode JSON response from ELK for {cli_sent}.")
+    indices = elk_window_indices(window) or match.group(1)
+    url = _ELK_INDEX_IN_URL_RE.sub(lambda _: f"/{indices}/_pit", ELK_URL)
+    params = {"keep_alive": ELK_PIT_KEEP_ALIVE, "ignore_unavailable": "true"}
+    response = await _elk_post("pit", url, f"{label} (point-in-time)", params=params)
+    if not isinstance(response, dict) or not response.get("id"):
         return None
+    return {"id": response["id"], "keep_alive": ELK_PIT_KEEP_ALIVE}
 
 
-def process_elk_hits(hits: List[Dict], cli_sent: str, delivered_cli: str) -> Optional[str]:
-    """Обрабатывает результаты ELK: находит timestamp из message, BYE и INVITE, извлекает данные и форматирует строку."""
+async def _elk_pit_search(query_payload: Dict, label: str) -> Optional[Dict]:
+    """Выполняет _search в point-in-time: индекс задан в PIT, поэтому запрос идет без индекса в URL."""
+    url = _ELK_INDEX_IN_URL_RE.sub(lambda _: "/_search", ELK_URL)
+    return await _elk_post("search", url, label, json=query_payload)
+
+
+async def _close_elk_pit(pit: Dict) -> None:
+    """Закрывает point-in-time. Ошибка не критична: PIT истечет сам через ELK_PIT_KEEP_ALIVE."""
+    url = _ELK_INDEX_IN_URL_RE.sub(lambda _: "/_pit", ELK_URL)
+    try:
+        response = await get_elk_client().request("DELETE", url, json={"id": pit["id"]}, timeout=ELK_ATTEMPT_TIMEOUT)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.warning(f"Could not close ELK point-in-time: {e!r}. It expires after {ELK_PIT_KEEP_ALIVE}.")
+
+
+async def _msearch_chunk(cli_chunk: List[str], window: TimeWindow) -> List[Optional[Dict]]:
+    """Отправляет один запрос _msearch для группы CLI и возвращает ответы в том же порядке."""
+    # Тело _msearch - NDJSON: заголовок (индекс из URL или суточные индексы окна) + запрос на каждый CLI
+    indices = elk_window_indices(window)
+    header = json.dumps({"index": indices, "ignore_unavailable": True, "allow_no_indices": True}) if indices else "{}"
+    body_lines = []
+    for cli_sent in cli_chunk:
+        body_lines.append(header)
+        body_lines.append(json.dumps(build_elk_query(cli_sent, window)))
+    body = "\n".join(body_lines) + "\n"
+    chunk_label = f"{len(cli_chunk)} CLIs ({cli_chunk[0]}...)"
+
+    elk_response = await _elk_post(
+        "msearch",
+        ELK_MSEARCH_URL,
+        chunk_label,
+        content=body.encode("utf-8"),
+        headers={'Content-Type': 'application/x-ndjson'},
+    )
+    if elk_response is None:
+        return [None] * len(cli_chunk)
+    responses = elk_response.get("responses", [])
+    if len(responses) != len(cli_chunk):
+        logger.error(f"ELK _msearch returned {len(responses)} responses for {len(cli_chunk)} queries ({chunk_label}).")
+        return [None] * len(cli_chunk)
+
+    results: List[Optional[Dict]] = []
+    for cli_sent, item in zip(cli_chunk, responses):
+        # Ошибка одного подзапроса не должна ломать остальные
+        if "error" in item:
+            logger.error(f"ELK _msearch sub-query failed for {cli_sent}: status={item.get('status')} error={str(item['error'])[:500]}")
+            results.append(None)
+        else:
+            results.append(item)
+    return results
+
+
+async def query_elk_batch(cli_list: List[str], window: Optional[TimeWindow] = None) -> List[Optional[Dict]]:
+    """Выполняет поиск для списка CLI через _msearch пачками по ELK_BATCH_SIZE.
+
+    window - окно из отчета (см. query_elk). CLI, найденные в кэше ELK или уже
+    запрашиваемые другими запросами, в _msearch не попадают. Возвращает ответы в порядке
+    входного списка; None - для CLI, по которым запрос не удался.
+    """
+    if sip_store is not None:
+        return [lookup_sip_store(cli_sent, window) for cli_sent in cli_list]
+    results: List[Optional[Dict]] = [None] * len(cli_list)
+    missing_indexes = []
+    for i, cli_sent in enumerate(cli_list):
+        found, cached_response = elk_cache.get(elk_cache_key(cli_sent, window))
+        if found:
+            results[i] = cached_response
+        else:
+            missing_indexes.append(i)
+    if not missing_indexes:
+        logger.info(f"All {len(cli_list)} CLIs served from ELK cache.")
+        return results
+
+    if not all([ELK_URL, ELK_USER, ELK_PASSWORD]):
+        logger.error("Cannot query ELK: Credentials are not configured.")
+        return results
+
+    get_elk_client()
+    calls: Dict[str, asyncio.Future] = {}
+    new_clis = []
+    for i in missing_indexes:
+        cli_sent = cli_list[i]
+        if cli_sent in calls:
+            continue
+        call = elk_flight.join(elk_cache_key(cli_sent, window))
+        if call is not None:
+            calls[cli_sent] = call
+        else:
+            new_clis.append(cli_sent)
+            calls[cli_sent] = None
+    joined = len(calls) - len(new_clis)
+    count_saved_lookups("in_flight", joined)
+
+    if new_clis:
+        chunk_count = (len(new_clis) + ELK_BATCH_SIZE - 1) // ELK_BATCH_SIZE
+        logger.info(f"Querying ELK via _msearch: {len(new_clis)} CLIs in {chunk_count} batch(es), {len(cli_list) - len(missing_indexes)} from cache, {joined} already in flight.")
+        batch = asyncio.ensure_future(_fetch_and_cache_elk_batch(new_clis, window))
+        batch_items = []
+        for position, cli_sent in enumerate(new_clis):
+            calls[cli_sent] = elk_flight.start(elk_cache_key(cli_sent, window), _batch_item(batch, position))
+            batch_items.append(calls[cli_sent])
+        _cancel_when_abandoned(batch, batch_items)
+
+    responses = dict(zip(calls, await elk_flight.wait(list(calls.values()))))
+    for i in missing_indexes:
+        results[i] = responses[cli_list[i]]
+    return results
+
+
+async def _fetch_and_cache_elk_batch(cli_list: List[str], window: Optional[TimeWindow]) -> List[Optional[Dict]]:
+    """Выполняет _msearch для CLI, которых нет в кэше, дочитывает ответы и кэширует их.
+
+    В следующее окно (см. lookup_windows) уходят только CLI, для которых BYE еще не найден.
+    """
+    results: Dict[str, Optional[Dict]] = {}
+    pending = cli_list
+    windows = lookup_windows(window)
+    for step, (depth, search_window) in enumerate(windows, 1):
+        chunks = [pending[i:i + ELK_BATCH_SIZE] for i in range(0, len(pending), ELK_BATCH_SIZE)]
+        chunk_results = await _gather_all(_msearch_chunk(chunk, search_window) for chunk in chunks)
+        fetched = [response for chunk in chunk_results for response in chunk]
+        # Недостающие страницы и INVITE дочитываются отдельными запросами только там, где нужно
+        fetched = await _gather_all(
+            complete_elk_response(cli_sent, elk_response, search_window) for cli_sent, elk_response in zip(pending, fetched)
+        )
+        widen = []
+        found = 0
+        for cli_sent, elk_response in zip(pending, fetched):
+            results[cli_sent], done = _window_result(results.get(cli_sent), elk_response)
+            if not done:
+                widen.append(cli_sent)
+            elif results[cli_sent]:
+                found += 1
+        count_lookup_window(depth, found)
+        if widen and step < len(windows):
+            logger.info(f"{len(widen)} of {len(pending)} CLIs have no BYE within {depth}, widening the ELK window.")
+        pending = widen
+        if not pending:
+            break
+    count_lookup_window("not_found", len(pending))
+
+    for cli_sent in cli_list:
+        cache_elk_response(cli_sent, results[cli_sent], window)
+    return [results[cli_sent] for cli_sent in cli_list]
+
+
+async def _gather_all(awaitables: Iterable[Awaitable]) -> List:
+    """Как asyncio.gather, но первая ошибка (например, ElkUnavailableError) выбрасывается
+    только после завершения всех awaitables, чтобы не оставлять их выполняться без присмотра."""
+    results = await asyncio.gather(*awaitables, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+    return results
+
+
+async def _batch_item(batch: "asyncio.Future[List[Optional[Dict]]]", position: int) -> Optional[Dict]:
+    """Ответ для одного CLI из общего _msearch (для single-flight по отдельным CLI)."""
+    return (await asyncio.shield(batch))[position]
+
+
+def _cancel_when_abandoned(batch: asyncio.Future, batch_items: List[asyncio.Future]) -> None:
+    """Отменяет общий _msearch, когда отменены задачи всех его CLI (их ответы больше никто не ждет)."""
+    remaining = len(batch_items)
+
+    def item_done(_: asyncio.Future) -> None:
+        nonlocal remaining
+        remaining -= 1
+        if not remaining and not batch.done():
+            batch.cancel()
+
+    for batch_item in batch_items:
+        batch_item.add_done_callback(item_done)
+
+
+def analyze_elk_hits(hits: List[Dict], cli_sent: str, delivered_cli: str) -> Tuple[str, Optional[str]]:
+    """Обрабатывает результаты ELK: находит timestamp из message, BYE и INVITE, извлекает данные и форматирует строку.
+
+    Возвращает (статус, строка результата). Строка есть только при статусе PAIR_OK.
+    """
     if not hits:
         logger.warning(f"No ELK hits provided for processing {cli_sent}.")
-        return None
+        count_pair_outcome("no_hits")
+        return PAIR_NO_HITS, None
 
     # Ищем timestamp в первом сообщении
     first_message = hits[0]["_source"].get("message", "")
-    time_match = re.search(r"^\w+\s+\d+\s+(\d{2}:\d{2}:\d{2})", first_message) # Ищем ЧЧ:ММ:СС
+    extracted_time = extract_syslog_time(first_message) # Ищем ЧЧ:ММ:СС
     formatted_timestamp = None
-    if time_match:
-        extracted_time = time_match.group(1)
+    if extracted_time:
         # Если нужно добавить дату, можно взять ее из @timestamp, если он есть
         timestamp_field = hits[0]["_source"].get("@timestamp")
         if timestamp_field:
@@ -184,12 +1145,12 @@ def process_elk_hits(hits: List[Dict], cli_sent: str, delivered_cli: str) -> Opt
                 dt_object = datetime.fromisoformat(timestamp_field)
                 date_part = dt_object.strftime('%Y-%m-%d')
                 formatted_timestamp = f"{date_part} {extracted_time}"
-                logger.debug(f"Extracted time '{extracted_time}' from message, combined with date '{date_part}' from @timestamp for {cli_sent}")
+                logger.debug("Extracted time '%s' from message, combined with date '%s' from @timestamp for %s", extracted_time, date_part, cli_sent)
             except ValueError:
                  logger.warning(f"Could not parse date from '@timestamp': {timestamp_field} for {cli_sent}. Using time only.")
                  formatted_timestamp = extracted_time # Используем только время, если дата не парсится
         else:
-            logger.debug(f"Extracted time '{extracted_time}' from message for {cli_sent}, @timestamp field missing.")
+            logger.debug("Extracted time '%s' from message for %s, @timestamp field missing.", extracted_time, cli_sent)
             formatted_timestamp = extracted_time # Используем только время, если @timestamp нет
     else:
         logger.warning(f"Could not extract HH:MM:SS time from the beginning of the first message for {cli_sent}. Message: '{first_message[:100]}...' Attempting fallback to @timestamp.")
@@ -205,74 +1166,60 @@ def process_elk_hits(hits: List[Dict], cli_sent: str, delivered_cli: str) -> Opt
                  logger.info(f"Using fallback timestamp from '@timestamp' field for {cli_sent}: {formatted_timestamp}")
              except ValueError:
                  logger.error(f"Could not parse fallback timestamp '@timestamp': {timestamp_field} for {cli_sent}.")
-                 return None # Не можем получить время
+                 count_pair_outcome("verification_failed")
+                 return PAIR_VERIFICATION_FAILED, None # Не можем получить время
         else:
              logger.error(f"Could not extract time from message and '@timestamp' field is missing for {cli_sent}.")
-             return None # Не можем получить время
-
-    bye_message_source = None
-    invite_message_source = None
-    call_id = None
-
-    # Сначала найдем BYE и извлечем call_id
-    for hit in hits:
-        message = hit.get("_source", {}).get("message", "")
-        if "method=BYE;" in message:
-            bye_message_source = hit.get("_source")
-            call_id_match = re.search(r'call_id=([^;@]+)', message) # Извлекаем call_id
-            if call_id_match:
-                call_id = call_id_match.group(1)
-            logger.debug(f"Found BYE message for {cli_sent}. Call ID: {call_id}")
-            break
+             count_pair_outcome("verification_failed")
+             return PAIR_VERIFICATION_FAILED, None # Не можем получить время
 
-    if not bye_message_source or not call_id:
-        logger.warning(f"Could not find BYE message or Call ID for {cli_sent}. Cannot process.")
-        return None
+    # Один проход по hits: первый BYE и INVITE по каждому call_id (поля разобраны один раз)
+    hit_index = SipHitIndex(hits)
+    bye_fields = hit_index.bye_fields
+    call_id = bye_fields.get("call_id")
+    if hit_index.bye_source is not None:
+        logger.debug("Found BYE message for %s. Call ID: %s", cli_sent, call_id)
 
-    # Теперь найдем соответствующий INVITE по call_id
-    for hit in hits:
-        message = hit.get("_source", {}).get("message", "")
-        if f"method=INVITE;" in message and f"call_id={call_id}" in message:
-            invite_message_source = hit.get("_source")
-            logger.debug(f"Found matching INVITE message for {cli_sent} with Call ID: {call_id}")
-            break
+    if hit_index.bye_source is None or not call_id:
+        logger.warning(f"Could not find BYE message or Call ID for {cli_sent}. Cannot process.")
+        count_pair_outcome("bye_not_found")
+        return PAIR_NO_HITS, None
 
-    if not invite_message_source:
+    # Соответствующий INVITE по call_id
+    invite_source = hit_index.invite_for(call_id)
+    if invite_source is None:
         logger.warning(f"Could not find matching INVITE message for Call ID {call_id} ({cli_sent}). Cannot determine 'To' number.")
         # В зависимости от требований, можно либо вернуть None, либо продолжить без 'To'?
         # Пока возвращаем None, так как 'To' нужен для результата.
-        return None
+        count_pair_outcome("invite_not_found")
+        return PAIR_NO_HITS, None
+    logger.debug("Found matching INVITE message for %s with Call ID: %s", cli_sent, call_id)
+    invite_fields = parse_sip_fields(invite_source.get("message", ""), ("dst_user",))
 
     # --- Извлечение данных ---
-    bye_message_content = bye_message_source.get("message", "")
-    invite_message_content = invite_message_source.get("message", "")
-
     # Из BYE
-    src_user_bye_match = re.search(r'src_user=(\d+)', bye_message_content)
-    dst_user_bye_match = re.search(r'dst_user=(\d+)', bye_message_content)
-    dst_ouser_bye_match = re.search(r'dst_ouser=(\+?\d+)', bye_message_content)
+    src_user_in_bye = bye_fields.get("src_user")
+    dst_user_in_bye = bye_fields.get("dst_user")
+    dst_ouser = bye_fields.get("dst_ouser")
 
-    # Из INVITE (нужен только dst_user)
-    dst_user_invite_match = re.search(r'dst_user=(\d+)', invite_message_content)
+    # Из INVITE (нужен только dst_user) - это номер "to"
+    dst_user_in_invite = invite_fields.get("dst_user")
 
     # Проверка наличия всех нужных полей
-    if not (src_user_bye_match and dst_user_bye_match and dst_ouser_bye_match and dst_user_invite_match):
+    if not (src_user_in_bye and dst_user_in_bye and dst_ouser and dst_user_in_invite):
         logger.warning(f"Could not extract all required fields from BYE/INVITE messages for {cli_sent} (Call ID: {call_id}).")
-        logger.debug(f"BYE Fields: src_user={src_user_bye_match}, dst_user={dst_user_bye_match}, dst_ouser={dst_ouser_bye_match}")
-        logger.debug(f"INVITE Fields: dst_user={dst_user_invite_match}")
-        return None
-
-    src_user_in_bye = src_user_bye_match.group(1)
-    dst_user_in_bye = dst_user_bye_match.group(1)
-    dst_ouser = dst_ouser_bye_match.group(1)
-    dst_user_in_invite = dst_user_invite_match.group(1) # Это номер "to"
+        logger.debug("BYE Fields: src_user=%s, dst_user=%s, dst_ouser=%s", src_user_in_bye, dst_user_in_bye, dst_ouser)
+        logger.debug("INVITE Fields: dst_user=%s", dst_user_in_invite)
+        count_pair_outcome("verification_failed")
+        return PAIR_VERIFICATION_FAILED, None
 
     # --- Верификация ---
     # Проверяем, что cli_sent совпадает ЛИБО с src_user из BYE, ЛИБО с dst_user из BYE
     if cli_sent != src_user_in_bye and cli_sent != dst_user_in_bye:
         logger.warning(f"Verification failed for {cli_sent}: Neither src_user ({src_user_in_bye}) nor dst_user ({dst_user_in_bye}) in BYE message match original CLI Sent.")
-        return None
-    logger.debug(f"Verification passed for {cli_sent}: Found in BYE src_user or dst_user.")
+        count_pair_outcome("verification_failed")
+        return PAIR_VERIFICATION_FAILED, None
+    logger.debug("Verification passed for %s: Found in BYE src_user or dst_user.", cli_sent)
     # --- Конец Верификации ---
 
     # --- Формируем итоговую строку ---
@@ -291,7 +1238,7 @@ def process_elk_hits(hits: List[Dict], cli_sent: str, delivered_cli: str) -> Opt
     
     # Номер "from" - это dst_ouser, извлеченный из BYE сообщения
     from_number = dst_ouser 
-    logger.debug(f"Setting 'from' number from BYE message dst_ouser: {from_number}")
+    logger.debug("Setting 'from' number from BYE message dst_ouser: %s", from_number)
 
     # Номер "to" - это dst_user из INVITE
     to_number = dst_user_in_invite
@@ -299,8 +1246,185 @@ def process_elk_hits(hits: List[Dict], cli_sent: str, delivered_cli: str) -> Opt
     # Собираем результат, используя 'formatted_timestamp', полученный ранее
     # Возвращаем формат: "YYYY-MM-DD HH:MM:SS UTC from [num] to [num] | CLI displayed [num]"
     result_string = f"{formatted_timestamp} UTC from {from_number} to {to_number} | CLI displayed {delivered_cli}"
-    logger.info(f"Successfully processed ELK results for {cli_sent}. Result: {result_string}")
-    return result_string
+    logger.debug("Successfully processed ELK results for %s. Result: %s", cli_sent, result_string)
+    count_pair_outcome("ok")
+    return PAIR_OK, result_string
+
+
+def process_elk_hits(hits: List[Dict], cli_sent: str, delivered_cli: str) -> Optional[str]:
+    """Обрабатывает результаты ELK и возвращает отформатированную строку или None (см. analyze_elk_hits)."""
+    return analyze_elk_hits(hits, cli_sent, delivered_cli)[1]
+
+
+def process_elk_response(index: int, total: int, pair: Dict[str, str], elk_response: Optional[Dict]) -> Dict:
+    """Разбирает ответ ELK для одной пары CLI.
+
+    Возвращает словарь {"index", "sent", "received", "status", "result"}, где status -
+    один из PAIR_*, а result - отформатированная строка (только при PAIR_OK).
+    """
+    cli_sent = pair['sent']
+    delivered_cli = pair['received']
+    # Построчные логи пар - на уровне DEBUG: при тысячах пар INFO-логирование само заметно замедляет обработку
+    logger.debug("--- Processing pair %d/%d: sent=%s, received=%s ---", index + 1, total, cli_sent, delivered_cli)
+    pair_result = {"index": index, "sent": cli_sent, "received": delivered_cli, "status": PAIR_ELK_ERROR, "result": None}
+
+    if not elk_response:
+        # Логируем, что запрос к ELK не удался
+        logger.warning(f"ELK query failed or returned no response for {cli_sent} (check previous logs for request errors).")
+        count_pair_outcome("elk_error")
+        return pair_result
+
+    # Логируем часть ответа для проверки
+    logger.debug("ELK response received for %s. Keys: %s", cli_sent, list(elk_response.keys()))
+    if 'hits' not in elk_response or not isinstance(elk_response['hits'], dict):
+        logger.error(f"Unexpected ELK response format for {cli_sent}. 'hits' key missing or not a dictionary. Response snippet: {str(elk_response)[:500]}...")
+        count_pair_outcome("elk_error")
+        return pair_result
+
+    total_hits_value = elk_response['hits'].get('total', {}).get('value', 'N/A')
+    hits_list = elk_response['hits'].get('hits', [])
+    logger.debug("ELK reported %s total hits for %s. Received %d hits in response.", total_hits_value, cli_sent, len(hits_list))
+    if hits_list and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("First hit: %s...", str(hits_list[0])[:300])
+    
+    # Шаг 2b, 2c, 2d: Обработка результатов ELK
+    if not hits_list:
+        logger.debug("No hits returned in the list for %s, cannot process.", cli_sent)
+        count_pair_outcome("no_hits")
+        pair_result["status"] = PAIR_NO_HITS
+        return pair_result
+
+    logger.debug("Processing %d ELK hits for %s...", len(hits_list), cli_sent)
+    with stage_timer("analyze"):
+        status, processed_result = analyze_elk_hits(hits_list, cli_sent, delivered_cli)
+    if not processed_result:
+        logger.debug("Processing ELK hits for %s did not yield a result (check logs for process_elk_hits warnings).", cli_sent)
+    pair_result["status"] = status
+    pair_result["result"] = processed_result
+    return pair_result
+
+
+def pair_skipped_result(index: int, pair: Dict[str, str], status: str) -> Dict:
+    """Результат пары без ответа ELK: PAIR_ELK_UNAVAILABLE или PAIR_TIMED_OUT (см. process_elk_response)."""
+    count_pair_outcome(status.replace("-", "_"))
+    return {"index": index, "sent": pair['sent'], "received": pair['received'], "status": status, "result": None}
+
+
+async def process_cli_group(
+    total: int, group: List[Tuple[int, Dict[str, str]]], window: Optional[TimeWindow] = None
+) -> List[Dict]:
+    """Выполняет один запрос к ELK для пар с одинаковым CLI Sent и разбирает ответ для каждой пары.
+
+    group - [(индекс пары, пара)]; у каждой пары свой delivered_cli. window - окно из отчета.
+    """
+    # Шаг 2a: Запрос к ELK
+    cli_sent = group[0][1]['sent']
+    logger.debug("Querying ELK for: %s", cli_sent)
+    try:
+        elk_response = await query_elk(cli_sent, window)
+    except ElkUnavailableError as e:
+        logger.debug("%s", e)
+        return [pair_skipped_result(index, pair, PAIR_ELK_UNAVAILABLE) for index, pair in group]
+    return [process_elk_response(index, total, pair, elk_response) for index, pair in group]
+
+
+async def _process_cli_group_batch(
+    total: int, groups: List[List[Tuple[int, Dict[str, str]]]], window: Optional[TimeWindow] = None
+) -> List[Dict]:
+    """Выполняет поиск для нескольких групп пар одним _msearch (см. query_elk_batch)."""
+    try:
+        elk_responses = await query_elk_batch([group[0][1]['sent'] for group in groups], window)
+    except ElkUnavailableError as e:
+        logger.debug("%s", e)
+        return [pair_skipped_result(index, pair, PAIR_ELK_UNAVAILABLE) for group in groups for index, pair in group]
+    return [
+        process_elk_response(index, total, pair, elk_response)
+        for group, elk_response in zip(groups, elk_responses)
+        for index, pair in group
+    ]
+
+
+async def iter_cli_pair_results(
+    cli_pairs: List[Dict[str, str]], max_in_flight: Optional[int] = None, deadline: Optional[float] = None
+) -> AsyncIterator[Dict]:
+    """Выполняет поиск в ELK для всех пар и отдает результаты по мере готовности.
+
+    Порядок - по времени завершения, исходная позиция пары передается в поле "index".
+    Пары с одинаковым CLI Sent ищутся одним запросом, ответ разбирается для каждой пары.
+    Если в парах есть время тестов из отчета, поиск идет только в окне вокруг него
+    (см. pair_report_window), иначе окно расширяется постепенно (см. lookup_windows).
+    В режиме "msearch" CLI отправляются пачками через _msearch (результаты пачки
+    отдаются вместе), в режиме "single" - отдельными запросами, конкурентно
+    (не более ELK_CONCURRENCY одновременно на воркер). max_in_flight дополнительно
+    ограничивает число одновременных запросов (CLI или пачек) этого вызова.
+    Если задан deadline (секунды), по его истечении запросы отменяются, а необработанные
+    пары отдаются со статусом PAIR_TIMED_OUT. Пока ELK недоступен (circuit breaker),
+    пары сразу получают статус PAIR_ELK_UNAVAILABLE.
+    """
+    total = len(cli_pairs)
+    groups_by_cli: Dict[str, List[Tuple[int, Dict[str, str]]]] = {}
+    for i, pair in enumerate(cli_pairs):
+        groups_by_cli.setdefault(pair['sent'], []).append((i, pair))
+    groups = list(groups_by_cli.values())
+    duplicates = total - len(groups)
+    if duplicates:
+        logger.info(f"{total} CLI pairs share {len(groups)} unique CLIs; {duplicates} duplicate ELK lookups skipped.")
+        count_saved_lookups("duplicate", duplicates)
+    window = pair_report_window(cli_pairs)
+    if window is not None:
+        logger.info(f"Searching ELK within the report time window {window.gte:%Y-%m-%d %H:%M:%S} - {window.lt:%Y-%m-%d %H:%M:%S} UTC.")
+
+    limit = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+
+    async def limited(coro):
+        if limit is None:
+            return await coro
+        async with limit:
+            return await coro
+
+    # Задача -> группы пар, которые она обрабатывает (для статуса PAIR_TIMED_OUT)
+    task_groups: Dict[asyncio.Future, List[List[Tuple[int, Dict[str, str]]]]] = {}
+    if ELK_LOOKUP_MODE == "msearch":
+        for start in range(0, len(groups), ELK_BATCH_SIZE):
+            batch_groups = groups[start:start + ELK_BATCH_SIZE]
+            task_groups[asyncio.ensure_future(limited(_process_cli_group_batch(total, batch_groups, window)))] = batch_groups
+    else:
+        for group in groups:
+            task_groups[asyncio.ensure_future(limited(process_cli_group(total, group, window)))] = [group]
+    tasks = list(task_groups)
+
+    loop = asyncio.get_running_loop()
+    expires_at = loop.time() + deadline if deadline else None
+    pending = set(tasks)
+    try:
+        while pending:
+            timeout = None if expires_at is None else expires_at - loop.time()
+            if timeout is not None and timeout <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                for pair_result in task.result():
+                    yield pair_result
+        if pending:
+            unfinished = [(index, pair) for task in pending for group in task_groups[task] for index, pair in group]
+            logger.warning(f"Request deadline of {deadline:g}s exceeded: {len(unfinished)} of {total} pairs not processed.")
+            for task in pending:
+                task.cancel()
+            # Ждем отмены, чтобы до ответа были отменены и запросы к ELK, которые ждал только этот вызов
+            await asyncio.wait(pending)
+            for index, pair in unfinished:
+                yield pair_skipped_result(index, pair, PAIR_TIMED_OUT)
+    finally:
+        # Клиент отключился или генератор закрыт раньше времени - не продолжаем запросы к ELK
+        for task in tasks:
+            task.cancel()
+
+
+async def lookup_cli_pairs(cli_pairs: List[Dict[str, str]], deadline: Optional[float] = None) -> List[Dict]:
+    """Выполняет поиск в ELK для всех пар и возвращает результаты в порядке входных пар (deadline - см. iter_cli_pair_results)."""
+    pair_results = [pair_result async for pair_result in iter_cli_pair_results(cli_pairs, deadline=deadline)]
+    pair_results.sort(key=lambda pair_result: pair_result["index"])
+    return pair_results
 
 
 # --- Эндпоинты ---
@@ -314,9 +1438,22 @@ async def home(request: Request):
 @app.post("/process", response_class=JSONResponse)
 async def process_text_api(
     text: str = Form(...), 
-    logic_choice: str = Form(...) 
+    logic_choice: str = Form(...),
+    background: Optional[bool] = Form(None),
+    debug: bool = Form(False)
 ):
-    """Обрабатывает текст и возвращает результат в формате JSON."""
+    """Обрабатывает текст и возвращает результат в формате JSON.
+
+    Для "With Samples" большой отчет (от JOB_AUTO_PAIRS пар или при background=true) не
+    обрабатывается в запросе: ставится фоновая задача и сразу возвращается 202 с job_id
+    (прогресс - GET /jobs/{job_id}). background=false всегда обрабатывает в запросе.
+    Если истек ELK_REQUEST_DEADLINE или ELK недоступен, возвращаются готовые результаты и
+    "incomplete" - число необработанных пар по статусам ("timed-out", "elk-unavailable").
+    При debug=true в ответ добавляется "timings" - время по этапам обработки этого запроса.
+    """
+    started = time.perf_counter()
+    if debug:
+        start_request_timings()
     try:
         if not text.strip():
             raise HTTPException(status_code=400, detail="Please provide non-empty text.")
@@ -326,59 +1463,36 @@ async def process_text_api(
         logger.debug(f"Received text (first 500 chars): {text[:500]}...") 
         
         final_results = [] 
+        incomplete = {}
         
         if logic_choice == "only_cli":
             logger.info("Using 'Only CLI' logic")
-            final_results = extract_numeric_lines(text) 
+            with stage_timer("parse"):
+                final_results = extract_numeric_lines(text) 
             logger.info(f"'Only CLI' logic found {len(final_results)} results.")
         
         elif logic_choice == "with_samples":
             logger.info("Starting 'With Samples (ELK)' logic")
-            cli_pairs = extract_cli_pairs(text)
+            with stage_timer("parse"):
+                cli_pairs = extract_cli_pairs(text)
             logger.info(f"Extracted {len(cli_pairs)} CLI pairs.")
             if cli_pairs:
                 logger.debug(f"First extracted pair (if any): {cli_pairs[0]}")
             else:
                 logger.warning("No CLI pairs were extracted. Check input text format and regex in `extract_cli_pairs`.")
                 # Возвращаем пустой результат, если пар нет
-                return JSONResponse(content={"results": []}) 
+                return JSONResponse(content=_results_content([], started, debug)) 
+
+            if _use_background_job(len(cli_pairs), background):
+                return _job_accepted_response(_get_job_runner().submit(cli_pairs), len(cli_pairs))
             
-            for i, pair in enumerate(cli_pairs):
-                cli_sent = pair['sent']
-                delivered_cli = pair['received']
-                logger.info(f"--- Processing pair {i+1}/{len(cli_pairs)}: sent={cli_sent}, received={delivered_cli} ---")
-                
-                # Шаг 2a: Запрос к ELK
-                logger.debug(f"Querying ELK for: {cli_sent}")
-                elk_response = query_elk(cli_sent)
-                
-                if elk_response:
-                     # Логируем часть ответа для проверки
-                    logger.debug(f"ELK response received for {cli_sent}. Keys: {list(elk_response.keys())}")
-                    if 'hits' in elk_response and isinstance(elk_response['hits'], dict):
-                        total_hits_value = elk_response['hits'].get('total', {}).get('value', 'N/A')
-                        hits_list = elk_response['hits'].get('hits', [])
-                        logger.info(f"ELK reported {total_hits_value} total hits for {cli_sent}. Received {len(hits_list)} hits in response.")
-                        logger.debug(f"First hit (if any): {str(hits_list[0])[:300]}..." if hits_list else "No hits in list.")
-                        
-                        # Шаг 2b, 2c, 2d: Обработка результатов ELK
-                        if hits_list:
-                             logger.debug(f"Processing {len(hits_list)} ELK hits for {cli_sent}...")
-                             processed_result = process_elk_hits(hits_list, cli_sent, delivered_cli)
-                             if processed_result:
-                                 logger.info(f"Successfully processed ELK data for {cli_sent}. Result: {processed_result}")
-                                 final_results.append(processed_result)
-                             else:
-                                 logger.warning(f"Processing ELK hits for {cli_sent} did not yield a result (check logs for process_elk_hits warnings).")
-                        else:
-                             logger.info(f"No hits returned in the list for {cli_sent}, cannot process.")
-                    else:
-                         logger.error(f"Unexpected ELK response format for {cli_sent}. 'hits' key missing or not a dictionary. Response snippet: {str(elk_response)[:500]}...")
-                else:
-                     # Логируем, что запрос к ELK не удался
-                    logger.warning(f"ELK query failed or returned no response for {cli_sent} (check previous logs for request errors).")
+            pair_results = await lookup_cli_pairs(cli_pairs, deadline=ELK_REQUEST_DEADLINE)
+            final_results = [pair_result["result"] for pair_result in pair_results if pair_result["status"] == PAIR_OK]
+            incomplete = _incomplete_counts(pair_results)
             
             logger.info(f"Finished processing all {len(cli_pairs)} pairs for 'With Samples'. Generated {len(final_results)} final results.")
+            cache_stats = elk_cache.stats()
+            logger.info(f"ELK cache: hits={cache_stats['hits']} misses={cache_stats['misses']} size={cache_stats['size']}")
 
         else:
             logger.warning(f"Unknown logic choice received: {logic_choice}")
@@ -386,7 +1500,7 @@ async def process_text_api(
 
         logger.info(f"Generated {len(final_results)} results for logic '{logic_choice}'")
 
-        return JSONResponse(content={"results": final_results}) # Возвращаем final_results
+        return JSONResponse(content=_results_content(final_results, started, debug, incomplete)) # Возвращаем final_results
         
     except HTTPException as http_exc:
         logger.warning(f"HTTP Exception: {http_exc.status_code} - {http_exc.detail}")
@@ -395,6 +1509,253 @@ async def process_text_api(
         logger.error(f"Error processing text: {str(e)}", exc_info=True) 
         # Используем стандартный ответ FastAPI для 500 ошибки, он вернет JSON
         raise HTTPException(status_code=500, detail="An internal server error occurred during processing.")
+    finally:
+        observe_stage("request", time.perf_counter() - started)
+
+
+def _incomplete_counts(pair_results: List[Dict]) -> Dict[str, int]:
+    """Число пар, оставшихся без ответа ELK, по статусам PAIR_ELK_UNAVAILABLE и PAIR_TIMED_OUT."""
+    counts: Dict[str, int] = {}
+    for pair_result in pair_results:
+        if pair_result["status"] in (PAIR_ELK_UNAVAILABLE, PAIR_TIMED_OUT):
+            counts[pair_result["status"]] = counts.get(pair_result["status"], 0) + 1
+    return counts
+
+
+def _results_content(results: List, started: float, debug: bool, incomplete: Optional[Dict[str, int]] = None) -> Dict:
+    """Тело ответа /process; при debug - с разбивкой времени по этапам.
+
+    incomplete - число пар без ответа ELK по статусам (результат частичный), см. _incomplete_counts.
+    """
+    content = {"results": results}
+    if incomplete:
+        content["incomplete"] = incomplete
+    if debug:
+        content["timings"] = _timings_content(started)
+    return content
+
+
+def _timings_content(started: float) -> Dict:
+    """Поле "timings" ответа при debug=true: общее время запроса и разбивка по этапам."""
+    return {"total_seconds": round(time.perf_counter() - started, 6), "stages": request_timings()}
+
+
+def _use_background_job(pair_count: int, background: Optional[bool]) -> bool:
+    if background is not None:
+        return background
+    return JOB_AUTO_PAIRS > 0 and pair_count >= JOB_AUTO_PAIRS
+
+
+def _get_job_runner() -> JobRunner:
+    """Возвращает JobRunner воркера; без запущенного приложения (lifespan) - HTTP 503."""
+    if job_runner is None:
+        raise HTTPException(status_code=503, detail="Background jobs are not available.")
+    return job_runner
+
+
+def _job_accepted_response(job_id: str, total: int) -> JSONResponse:
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued", "total": total, "status_url": f"/jobs/{job_id}"},
+    )
+
+
+def _ndjson_line(event: Dict) -> str:
+    return json.dumps(event, ensure_ascii=False) + "\n"
+
+
+async def _stream_results(logic_choice: str, parsed: List, started: float, debug: bool = False) -> AsyncIterator[str]:
+    """Генерирует события NDJSON для /process/stream и /process/upload?stream=true.
+
+    parsed - уже извлеченные номера ("only_cli") или пары CLI ("with_samples"). started -
+    начало запроса: этап "request" учитывается, когда поток закончился (или клиент отключился),
+    при debug в событие "done" добавляется "timings", как в ответе /process.
+    Формат: {"type": "start", "total": N}, затем {"type": "pair", "index", "status", "result", ...}
+    для каждой пары по мере готовности, в конце {"type": "done", "total", "found"}.
+    При внутренней ошибке отправляется {"type": "error", "detail"} и поток завершается.
+    """
+    found = 0
+    try:
+        yield _ndjson_line({"type": "start", "total": len(parsed)})
+        if logic_choice == "only_cli":
+            for i, line in enumerate(parsed):
+                yield _ndjson_line({"type": "pair", "index": i, "status": PAIR_OK, "result": line})
+            yield _ndjson_line(_stream_done(len(parsed), len(parsed), started, debug))
+            return
+
+        async for pair_result in iter_cli_pair_results(parsed, deadline=ELK_REQUEST_DEADLINE):
+            if pair_result["status"] == PAIR_OK:
+                found += 1
+            yield _ndjson_line({"type": "pair", **pair_result})
+        logger.info(f"Finished streaming {len(parsed)} pairs for 'With Samples'. Generated {found} final results.")
+        yield _ndjson_line(_stream_done(len(parsed), found, started, debug))
+    except Exception as e:
+        logger.error(f"Error streaming results: {str(e)}", exc_info=True)
+        yield _ndjson_line({"type": "error", "detail": "An internal server error occurred during processing."})
+    finally:
+        observe_stage("request", time.perf_counter() - started)
+
+
+def _stream_done(total: int, found: int, started: float, debug: bool) -> Dict:
+    event = {"type": "done", "total": total, "found": found}
+    if debug:
+        event["timings"] = _timings_content(started)
+    return event
+
+
+def _ndjson_response(logic_choice: str, parsed: List, started: float, debug: bool = False) -> StreamingResponse:
+    return StreamingResponse(
+        _stream_results(logic_choice, parsed, started, debug),
+        media_type="application/x-ndjson",
+        # Отключаем буферизацию ответа в Nginx, чтобы строки уходили клиенту сразу
+        headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
+    )
+
+
+@app.post("/process/stream")
+async def process_text_stream_api(
+    text: str = Form(...),
+    logic_choice: str = Form(...),
+    background: Optional[bool] = Form(None),
+    debug: bool = Form(False)
+):
+    """Обрабатывает текст как /process, но отдает результаты потоком NDJSON по мере готовности каждой пары.
+
+    Большой отчет "With Samples" (от JOB_AUTO_PAIRS пар или при background=true) ставится
+    фоновой задачей, как в /process: ответ 202 с job_id вместо потока. При debug=true
+    событие "done" содержит "timings" - время по этапам обработки этого запроса.
+    """
+    started = time.perf_counter()
+    if debug:
+        start_request_timings()
+    streaming = False
+    try:
+        if not text.strip():
+            raise HTTPException(status_code=400, detail="Please provide non-empty text.")
+        if logic_choice not in ("only_cli", "with_samples"):
+            logger.warning(f"Unknown logic choice received: {logic_choice}")
+            raise HTTPException(status_code=400, detail=f"Invalid logic choice: {logic_choice}")
+
+        logger.info(f"Processing streaming request with logic: {logic_choice}")
+        with stage_timer("parse"):
+            parsed = extract_numeric_lines(text) if logic_choice == "only_cli" else extract_cli_pairs(text)
+        if logic_choice == "with_samples" and parsed and _use_background_job(len(parsed), background):
+            return _job_accepted_response(_get_job_runner().submit(parsed), len(parsed))
+        streaming = True
+        return _ndjson_response(logic_choice, parsed, started, debug)
+    finally:
+        if not streaming: # Время потока учитывается в _stream_results, когда он закончится
+            observe_stage("request", time.perf_counter() - started)
+
+
+@app.post("/process/upload")
+async def process_upload_api(
+    request: Request,
+    logic_choice: str = "with_samples",
+    stream: bool = False,
+    background: Optional[bool] = None,
+    debug: bool = False,
+):
+    """Обрабатывает отчет, загруженный файлом, без формы с текстовым полем.
+
+    Тело запроса - текст отчета (text/plain или application/octet-stream) либо multipart/form-data
+    с полем 'file' (и необязательным 'logic_choice'). Поддерживается gzip (определяется по сигнатуре).
+    По мере поступления разбирается только "сырое" тело; multipart сначала целиком принимается
+    во временный файл (так работает разбор форм Starlette), поэтому для него обязателен
+    Content-Length не больше MAX_UPLOAD_BYTES (иначе 411/413). Размер текста после распаковки
+    тоже ограничен MAX_UPLOAD_BYTES. При stream=true
+    результаты отдаются потоком NDJSON, как в /process/stream, иначе - JSON, как в /process.
+    В обоих случаях большой отчет может стать фоновой задачей (202 с job_id, см. параметр
+    background у /process). debug=true добавляет "timings", как в /process и /process/stream.
+    """
+    started = time.perf_counter()
+    if debug:
+        start_request_timings()
+    streaming = False
+    try:
+        response = await _process_upload(request, logic_choice, stream, background, started, debug)
+        streaming = isinstance(response, StreamingResponse)
+        return response
+    finally:
+        if not streaming: # Время потока учитывается в _stream_results, когда он закончится
+            observe_stage("request", time.perf_counter() - started)
+
+
+async def _process_upload(
+    request: Request, logic_choice: str, stream: bool, background: Optional[bool], started: float, debug: bool
+) -> Response:
+    """Разбор загрузки и ответ для /process/upload (время запроса учитывает process_upload_api)."""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Uploaded report exceeds the limit of {MAX_UPLOAD_BYTES} bytes.")
+
+    upload = None
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        # Без Content-Length размер multipart-тела нельзя проверить до записи во временный файл
+        if not (content_length and content_length.isdigit()):
+            raise HTTPException(
+                status_code=411,
+                detail="Multipart upload requires Content-Length; send the report as the raw request body to stream it.",
+            )
+        form = await request.form()
+        upload = form.get("file")
+        if not isinstance(upload, UploadFile):
+            raise HTTPException(status_code=400, detail="Multipart upload must contain a 'file' field.")
+        logic_choice = form.get("logic_choice") or logic_choice
+        byte_chunks = _iter_upload_file(upload)
+    else:
+        byte_chunks = request.stream()
+
+    if logic_choice not in ("only_cli", "with_samples"):
+        logger.warning(f"Unknown logic choice received: {logic_choice}")
+        raise HTTPException(status_code=400, detail=f"Invalid logic choice: {logic_choice}")
+
+    logger.info(f"Processing uploaded report with logic: {logic_choice}")
+    try:
+        with stage_timer("parse"):
+            parsed = await parse_report_upload(byte_chunks, logic_choice)
+    finally:
+        if upload is not None:
+            await upload.close()
+    logger.info(f"Parsed {len(parsed)} {'numbers' if logic_choice == 'only_cli' else 'CLI pairs'} from uploaded report.")
+
+    if logic_choice == "with_samples" and parsed and _use_background_job(len(parsed), background):
+        return _job_accepted_response(_get_job_runner().submit(parsed), len(parsed))
+    if stream:
+        return _ndjson_response(logic_choice, parsed, started, debug)
+
+    if logic_choice == "only_cli":
+        return JSONResponse(content=_results_content(parsed, started, debug))
+    pair_results = await lookup_cli_pairs(parsed, deadline=ELK_REQUEST_DEADLINE) if parsed else []
+    final_results = [pair_result["result"] for pair_result in pair_results if pair_result["status"] == PAIR_OK]
+    logger.info(f"Generated {len(final_results)} results for uploaded report.")
+    return JSONResponse(content=_results_content(final_results, started, debug, _incomplete_counts(pair_results)))
+
+
+@app.get("/cache/stats", response_class=JSONResponse)
+async def cache_stats_api():
+    """Возвращает счетчики кэша ELK текущего воркера (попадания, промахи, размер) и single-flight."""
+    return JSONResponse(content={**elk_cache.stats(), "single_flight": elk_flight.stats()})
+
+
+@app.get("/metrics")
+async def metrics_api():
+    """Метрики Prometheus: длительность этапов, итоги обработки пар и запросов к ELK, запросы к ELK "в полете"."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/jobs/{job_id}", response_class=JSONResponse)
+async def job_status_api(job_id: str, after: int = 0):
+    """Возвращает состояние фоновой задачи: прогресс (done/total), найденные результаты и
+    результаты пар, записанные после курсора after (для опроса передается "cursor" из прошлого ответа).
+
+    Для завершенной задачи (status="done") поле "results" содержит итог в формате /process.
+    """
+    job = _get_job_runner().store.get(job_id, after=after)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found.")
+    return JSONResponse(content=job)
 
 # --- Код ниже удален, так как HTML/CSS/JS перенесены ---
 # HTML_TEMPLATE = ...
@@ -0,0 +1,131 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Этапы обработки, для которых собираются гистограммы длительности:
+# parse - разбор отчета (для /process/upload - вместе с получением тела), elk_request - запрос
+# к ELK (сеть; для _msearch - вся пачка), elk_decode - разбор JSON ответа ELK,
+# analyze - analyze_elk_hits, request - запрос /process, /process/stream или /process/upload
+# целиком (для потока - до его конца), store_lookup - поиск CLI
+# в локальном хранилище SIP-логов (SIP_LOG_BACKEND=sqlite)
+STAGES = ("parse", "elk_request", "elk_decode", "analyze", "request", "store_lookup")
+
+STAGE_SECONDS = Histogram(
+    "text_filter_stage_seconds",
+    "Duration of processing stages in seconds.",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+# Итог обработки пары: ok, no_hits, bye_not_found, invite_not_found, verification_failed, elk_error,
+# elk_unavailable (circuit breaker открыт), timed_out (истек ELK_REQUEST_DEADLINE)
+PAIR_OUTCOMES = Counter("text_filter_pair_outcomes_total", "Processed CLI pairs by outcome.", ["outcome"])
+# Итог попытки запроса к ELK: ok, timeout, http_error, connection_error, decode_error,
+# circuit_open (запрос не отправлен - breaker открыт)
+ELK_REQUESTS = Counter("text_filter_elk_requests_total", "ELK requests by endpoint and result.", ["endpoint", "result"])
+ELK_RETRIES = Counter("text_filter_elk_retries_total", "ELK request retries after 429/5xx or transport errors.", ["endpoint"])
+# Второй (hedged) запрос к ELK: winner - какой из двух ответил первым (primary или hedge)
+ELK_HEDGES = Counter("text_filter_elk_hedged_requests_total", "Hedged ELK requests by winner.", ["endpoint", "winner"])
+ELK_CIRCUIT_OPEN = Gauge(
+    "text_filter_elk_circuit_open", "1 while the ELK circuit breaker is open.", multiprocess_mode="livemax"
+)
+# Запросы к ELK, которые не понадобились: duplicate - повтор CLI в том же запросе,
+# in_flight - CLI уже запрашивается другим запросом (single-flight)
+ELK_LOOKUPS_SAVED = Counter("text_filter_elk_lookups_saved_total", "ELK lookups avoided by reuse.", ["reason"])
+# На каком окне поиска завершился поиск CLI: "report" - окно из отчета, иначе - глубина окна
+# от текущего момента (format_duration): шаг ELK_WINDOW_STEPS (например, "1h") или, для
+# последнего окна, ELK_LOOKBACK_DAYS (например, "3d")
+ELK_LOOKUP_WINDOWS = Counter(
+    "text_filter_elk_lookup_windows_total", "ELK lookups by the time window they finished in.", ["window"]
+)
+ELK_IN_FLIGHT = Gauge(
+    "text_filter_elk_in_flight", "ELK requests currently in flight.", multiprocess_mode="livesum"
+)
+
+# Разбивка времени по этапам для текущего запроса (debug=true): этап -> [секунды, число]
+_request_timings: ContextVar[Optional[Dict[str, list]]] = ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    """Измеряет длительность этапа: пишет в гистограмму и, если включено, в разбивку текущего запроса."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def observe_stage(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        entry = timings.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+def count_pair_outcome(outcome: str) -> None:
+    PAIR_OUTCOMES.labels(outcome).inc()
+
+
+def count_elk_request(endpoint: str, result: str) -> None:
+    ELK_REQUESTS.labels(endpoint, result).inc()
+
+
+def count_elk_retry(endpoint: str) -> None:
+    ELK_RETRIES.labels(endpoint).inc()
+
+
+def count_elk_hedge(endpoint: str, winner: str) -> None:
+    ELK_HEDGES.labels(endpoint, winner).inc()
+
+
+def set_elk_circuit_open(is_open: bool) -> None:
+    ELK_CIRCUIT_OPEN.set(1 if is_open else 0)
+
+
+def count_lookup_window(window: str, count: int = 1) -> None:
+    if count:
+        ELK_LOOKUP_WINDOWS.labels(window).inc(count)
+
+
+def count_saved_lookups(reason: str, count: int = 1) -> None:
+    if count:
+        ELK_LOOKUPS_SAVED.labels(reason).inc(count)
+
+
+def start_request_timings() -> None:
+    """Включает сбор разбивки по этапам для текущего запроса (и задач, созданных из него)."""
+    _request_timings.set({})
+
+
+def request_timings() -> Dict[str, Dict[str, float]]:
+    """Разбивка по этапам текущего запроса: {этап: {"seconds", "count"}}.
+
+    Запросы к ELK для разных пар идут конкурентно, поэтому сумма этапов может превышать время запроса.
+    """
+    timings = _request_timings.get() or {}
+    return {stage: {"seconds": round(seconds, 6), "count": count} for stage, (seconds, count) in timings.items()}
+
+
+def mark_worker_stopped() -> None:
+    """Убирает gauge остановленного воркера из общего набора (только в режиме нескольких процессов)."""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Возвращает (тело, content-type) для /metrics.
+
+    Если задан PROMETHEUS_MULTIPROC_DIR, метрики собираются со всех воркеров uvicorn.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,121 @@
+import re
+from typing import Dict, Iterable, List, Optional
+
+# Скомпилированные шаблоны полей 'key=value;' сообщения SIP-лога (значения - как раньше в re.search).
+# Отдельные шаблоны с литеральным префиксом ищутся быстрее, чем одно общее выражение с альтернативой.
+_CALL_ID_RE = re.compile(r"call_id=([^;@]+)")
+_FIELD_PATTERNS = {
+    "call_id": _CALL_ID_RE,
+    "src_user": re.compile(r"src_user=(\d+)"),
+    "dst_user": re.compile(r"dst_user=(\d+)"),
+    "dst_ouser": re.compile(r"dst_ouser=(\+?\d+)"),
+}
+SIP_FIELDS = tuple(_FIELD_PATTERNS)
+# Время ЧЧ:ММ:СС в начале syslog-строки: "Jan  1 10:00:00 ..."
+_SYSLOG_TIME_RE = re.compile(r"^\w+\s+\d+\s+(\d{2}:\d{2}:\d{2})")
+
+
+def sip_method(message: str) -> Optional[str]:
+    """Возвращает 'BYE' или 'INVITE', если сообщение содержит соответствующий 'method=...;'."""
+    if "method=BYE;" in message:
+        return "BYE"
+    if "method=INVITE;" in message:
+        return "INVITE"
+    return None
+
+
+def parse_sip_fields(message: str, keys: Iterable[str] = SIP_FIELDS) -> Dict[str, str]:
+    """Извлекает из сообщения method и поля keys (по умолчанию call_id, src_user, dst_user, dst_ouser).
+
+    call_id - до '@', src_user/dst_user - цифры, dst_ouser - цифры с необязательным '+'.
+    Отсутствующие поля в результат не попадают.
+    """
+    fields: Dict[str, str] = {}
+    method = sip_method(message)
+    if method:
+        fields["method"] = method
+    for key in keys:
+        field_match = _FIELD_PATTERNS[key].search(message)
+        if field_match:
+            fields[key] = field_match.group(1)
+    return fields
+
+
+def extract_syslog_time(message: str) -> Optional[str]:
+    """Возвращает время ЧЧ:ММ:СС из начала syslog-строки или None."""
+    time_match = _SYSLOG_TIME_RE.search(message)
+    return time_match.group(1) if time_match else None
+
+
+class SipHitIndex:
+    """Индекс hits ELK, построенный за один проход.
+
+    Хранит первое сообщение BYE и сообщения INVITE в исходном порядке; INVITE по call_id
+    ищется через словарь. call_id у INVITE извлекается лениво и только до первого
+    совпадения, так что поиск INVITE для BYE не требует повторного прохода по всем hits.
+    Поля (parse_sip_fields) разбираются только для BYE.
+    """
+
+    __slots__ = ("bye_source", "_invites", "_pending_invites", "_pending_pos")
+
+    def __init__(self, hits: Iterable[Dict] = ()):
+        self.bye_source: Optional[Dict] = None
+        self._invites: Dict[str, Dict] = {}
+        self._pending_invites: List[Dict] = []
+        self._pending_pos = 0
+        self.add(hits)
+
+    def add(self, hits: Iterable[Dict]) -> None:
+        """Добавляет в индекс следующие по порядку hits (например, дочитанную страницу)."""
+        for hit in hits:
+            source = hit.get("_source") or {}
+            message = source.get("message", "")
+            if self.bye_source is None and "method=BYE;" in message:
+                self.bye_source = source
+            if "method=INVITE;" in message:
+                self._pending_invites.append(source)
+
+    @property
+    def bye_fields(self) -> Dict[str, str]:
+        if self.bye_source is None:
+            return {}
+        return parse_sip_fields(self.bye_source.get("message", ""))
+
+    @property
+    def bye_call_id(self) -> Optional[str]:
+        if self.bye_source is None:
+            return None
+        call_id_match = _CALL_ID_RE.search(self.bye_source.get("message", ""))
+        return call_id_match.group(1) if call_id_match else None
+
+    def invite_for(self, call_id: Optional[str]) -> Optional[Dict]:
+        """Возвращает _source первого INVITE с данным call_id или None."""
+        if not call_id:
+            return None
+        source = self._invites.get(call_id)
+        if source is not None:
+            return source
+        # Индексируем еще не разобранные INVITE по порядку, пока не встретится нужный call_id
+        pending = self._pending_invites
+        while self._pending_pos < len(pending):
+            source = pending[self._pending_pos]
+            self._pending_pos += 1
+            call_id_match = _CALL_ID_RE.search(source.get("message", ""))
+            if call_id_match:
+                invite_call_id = call_id_match.group(1)
+                self._invites.setdefault(invite_call_id, source)
+                if invite_call_id == call_id:
+                    return source
+        return None
+
+    def relevant_hits(self, first_hit: Dict) -> List[Dict]:
+        """Возвращает только hits, нужные для обработки: первый (время), первый BYE и его INVITE.
+
+        Обработка такого списка дает тот же результат, что и полного, но не требует
+        повторного прохода по всем hits (например, при повторном использовании из кэша).
+        """
+        sources = [first_hit.get("_source") or {}]
+        for source in (self.bye_source, self.invite_for(self.bye_call_id)):
+            if source is not None and all(source is not kept for kept in sources):
+                sources.append(source)
+        return [{"_source": source} for source in sources]
@@ -0,0 +1,314 @@
+"""Локальное хранилище SIP-логов (SQLite) - замена поиска в ELK для массовой обработки.
+
+Сообщения BYE/INVITE из файлов SIP-логов (syslog-строки) или выгрузок ELK (NDJSON:
+hits или документы с полями message и @timestamp) разбираются один раз при загрузке:
+номера src_user/dst_user/dst_ouser, call_id и метод пишутся в индексированные колонки.
+Поиск CLI после этого - несколько обращений к индексу вместо полнотекстового запроса.
+
+Загрузка инкрементальная: для каждого файла запоминается, до какого места он прочитан,
+и при следующем запуске читается только дописанное. Файлы читаются потоком, построчно,
+поэтому размер лога не ограничен памятью. Повторная загрузка тех же строк (например,
+ротированной копии лога) не создает дубликатов.
+
+    python -m sip_store ingest /var/log/sip/*.log exports/*.ndjson --db sip_log.sqlite3
+    python -m sip_store stats --db sip_log.sqlite3
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from elk_window import TimeWindow
+from sip_log import parse_sip_fields, sip_method
+
+logger = logging.getLogger(__name__)
+
+# Время хранится строкой в формате ELK (UTC): строки сравниваются в порядке времени
+_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+# ISO-время: в @timestamp выгрузки ELK или в начале строки лога (RFC 5424)
+_ISO_TIME_RE = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?\s*(Z|[+-]\d{2}:?\d{2})?"
+)
+# Время syslog (RFC 3164) без года: "Jan  1 10:00:00"
+_SYSLOG_TIME_RE = re.compile(r"(\w{3})\s+(\d{1,2})\s+(\d{2}):(\d{2}):(\d{2})")
+_MONTHS = {name: number for number, name in enumerate(
+    ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"), 1
+)}
+
+_COMMIT_LINES = 10000 # Через сколько прочитанных строк фиксировать транзакцию и позицию в файле
+
+
+def parse_log_time(
+    text: str, utc_offset: timedelta = timedelta(0), not_after: Optional[datetime] = None
+) -> Optional[datetime]:
+    """Время (UTC, без tzinfo) из начала строки: ISO 8601 или syslog "Jan  1 10:00:00".
+
+    Время без часового пояса считается местным со смещением utc_offset. У syslog-времени
+    нет года: берется год not_after (по умолчанию - текущий момент), а если время получается
+    позже not_after больше чем на сутки - предыдущий год (лог, начатый в декабре).
+    """
+    iso_match = _ISO_TIME_RE.match(text)
+    if iso_match:
+        year_text, month, day, hour, minute, second, fraction, zone = iso_match.groups()
+        moment = datetime(
+            int(year_text), int(month), int(day), int(hour), int(minute), int(second),
+            int((fraction or "0")[:6].ljust(6, "0")),
+        )
+        if zone is None:
+            return moment - utc_offset
+        if zone == "Z":
+            return moment
+        zone = zone.replace(":", "")
+        sign = -1 if zone[0] == "-" else 1
+        return moment - sign * timedelta(hours=int(zone[1:3]), minutes=int(zone[3:5]))
+    syslog_match = _SYSLOG_TIME_RE.match(text)
+    if syslog_match:
+        month_name, day, hour, minute, second = syslog_match.groups()
+        month = _MONTHS.get(month_name)
+        if month is None:
+            return None
+        not_after = not_after or datetime.utcnow()
+        try:
+            moment = datetime(not_after.year, month, int(day), int(hour), int(minute), int(second)) - utc_offset
+            if moment > not_after + timedelta(days=1):
+                moment = moment.replace(year=moment.year - 1)
+        except ValueError:
+            return None # 29 февраля не того года или неверный день
+        return moment
+    return None
+
+
+def _message_key(message: str) -> int:
+    """Короткий хэш сообщения (64 бита) - вместе со временем отличает уже загруженные строки."""
+    return int.from_bytes(hashlib.blake2b(message.encode("utf-8"), digest_size=8).digest(), "big", signed=True)
+
+
+class SipLogStore:
+    """Индекс сообщений BYE/INVITE в SQLite с поиском по номеру и call_id.
+
+    Файл можно открыть из нескольких воркеров uvicorn одновременно с загрузкой (WAL).
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY, ts TEXT NOT NULL, method TEXT NOT NULL, call_id TEXT,"
+            " message_key INTEGER NOT NULL, message TEXT NOT NULL)"
+        )
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS messages_dedup ON messages (ts, message_key)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_call_id ON messages (call_id, method, ts)")
+        # Номера сообщения (src_user, dst_user, dst_ouser без '+') - по ним ищется CLI
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS numbers ("
+            " number TEXT NOT NULL, ts TEXT NOT NULL, method TEXT NOT NULL, message_id INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS numbers_lookup ON numbers (number, ts, message_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS numbers_method ON numbers (number, method, ts, message_id)")
+        # Загруженные файлы: до какого байта прочитан файл (для инкрементальной загрузки)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " path TEXT PRIMARY KEY, inode INTEGER, size INTEGER NOT NULL, mtime REAL NOT NULL,"
+            " offset INTEGER NOT NULL, messages INTEGER NOT NULL, ingested_at REAL NOT NULL)"
+        )
+
+    # --- Поиск ---
+
+    def lookup(self, number: str, window: TimeWindow, invite_margin: timedelta = timedelta(0)) -> Dict:
+        """Поиск CLI в окне window. Возвращает ответ в формате ELK _search ({"hits": {...}}).
+
+        hits - только нужные для analyze_elk_hits сообщения (как SipHitIndex.relevant_hits):
+        первое по времени сообщение с номером, первый BYE и INVITE с его call_id (INVITE ищется
+        в окне, расширенном назад на invite_margin).
+        """
+        gte, lt = window.gte.strftime(_TIME_FORMAT), window.lt.strftime(_TIME_FORMAT)
+        rows = []
+        first = self._db.execute(
+            "SELECT m.id, m.ts, m.message FROM numbers n JOIN messages m ON m.id = n.message_id"
+            " WHERE n.number = ? AND n.ts >= ? AND n.ts < ? ORDER BY n.ts, n.message_id LIMIT 1",
+            (number, gte, lt),
+        ).fetchone()
+        if first is not None:
+            rows.append(first)
+            bye = self._db.execute(
+                "SELECT m.id, m.ts, m.message, m.call_id FROM numbers n JOIN messages m ON m.id = n.message_id"
+                " WHERE n.number = ? AND n.method = 'BYE' AND n.ts >= ? AND n.ts < ? ORDER BY n.ts, n.message_id LIMIT 1",
+                (number, gte, lt),
+            ).fetchone()
+            if bye is not None:
+                rows.append(bye[:3])
+                if bye[3]:
+                    invite = self._db.execute(
+                        "SELECT id, ts, message FROM messages"
+                        " WHERE call_id = ? AND method = 'INVITE' AND ts >= ? AND ts < ? ORDER BY ts, id LIMIT 1",
+                        (bye[3], (window.gte - invite_margin).strftime(_TIME_FORMAT), lt),
+                    ).fetchone()
+                    if invite is not None:
+                        rows.append(invite)
+        hits = []
+        seen = set()
+        for message_id, ts, message in rows:
+            if message_id not in seen:
+                seen.add(message_id)
+                hits.append({"_source": {"message": message, "@timestamp": ts}})
+        return {"hits": {"total": {"value": len(hits), "relation": "gte"}, "hits": hits}}
+
+    # --- Загрузка ---
+
+    def ingest_file(self, path: str, utc_offset: timedelta = timedelta(0)) -> Tuple[int, int]:
+        """Загружает новые строки файла. Возвращает (прочитано строк, добавлено сообщений).
+
+        Обычный файл дочитывается с места, где остановилась прошлая загрузка; если файл
+        заменен (другой inode) или стал короче, он читается сначала. Сжатый gzip файл
+        читается целиком, если изменился. Незаконченная последняя строка (файл еще пишется)
+        остается до следующей загрузки.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        compressed = path.endswith(".gz")
+        row = self._db.execute(
+            "SELECT inode, size, mtime, offset, messages FROM sources WHERE path = ?", (path,)
+        ).fetchone()
+        offset, total_messages = 0, 0
+        if row is not None:
+            inode, size, mtime, offset, total_messages = row
+            if compressed:
+                if size == stat.st_size and mtime == stat.st_mtime:
+                    return 0, 0
+                offset = 0
+            elif inode != stat.st_ino or stat.st_size < offset:
+                logger.info(f"{path} was replaced or truncated, reading it from the start.")
+                offset = 0
+            elif stat.st_size == offset:
+                return 0, 0
+        # Год syslog-времени (без года) - по времени изменения файла
+        modified = datetime.utcfromtimestamp(stat.st_mtime)
+
+        lines_read = added = 0
+        opener = gzip.open if compressed else open
+        with opener(path, "rb") as log_file:
+            if offset:
+                log_file.seek(offset)
+            position = offset
+            self._db.execute("BEGIN")
+            try:
+                for raw_line in log_file:
+                    if not raw_line.endswith(b"\n") and not compressed:
+                        break # Строка еще дописывается
+                    position += len(raw_line)
+                    lines_read += 1
+                    # Быстрая проверка до декодирования: нужны только BYE и INVITE
+                    if b"method=BYE;" in raw_line or b"method=INVITE;" in raw_line:
+                        text = raw_line.decode("utf-8", errors="replace")
+                        for message, moment in _line_messages(text, utc_offset, modified):
+                            added += self._add_message(message, moment)
+                    if lines_read % _COMMIT_LINES == 0:
+                        # Позиция сжатого файла не сохраняется: прерванная загрузка повторится целиком
+                        if not compressed:
+                            self._save_source(path, stat, position, total_messages + added)
+                        self._db.execute("COMMIT")
+                        self._db.execute("BEGIN")
+                self._save_source(path, stat, position, total_messages + added)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return lines_read, added
+
+    def _add_message(self, message: str, moment: datetime) -> int:
+        fields = parse_sip_fields(message)
+        method = fields.get("method")
+        if method is None:
+            return 0
+        ts = moment.strftime(_TIME_FORMAT)
+        cursor = self._db.execute(
+            "INSERT OR IGNORE INTO messages (ts, method, call_id, message_key, message) VALUES (?, ?, ?, ?, ?)",
+            (ts, method, fields.get("call_id"), _message_key(message), message),
+        )
+        if cursor.rowcount != 1:
+            return 0 # Уже загружено
+        numbers = {fields[key].lstrip("+") for key in ("src_user", "dst_user", "dst_ouser") if fields.get(key)}
+        self._db.executemany(
+            "INSERT INTO numbers (number, ts, method, message_id) VALUES (?, ?, ?, ?)",
+            [(number, ts, method, cursor.lastrowid) for number in numbers],
+        )
+        return 1
+
+    def _save_source(self, path: str, stat: os.stat_result, offset: int, messages: int) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO sources (path, inode, size, mtime, offset, messages, ingested_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, stat.st_ino, stat.st_size, stat.st_mtime, offset, messages, time.time()),
+        )
+
+    def stats(self) -> Dict:
+        messages, first_ts, last_ts = self._db.execute("SELECT COUNT(*), MIN(ts), MAX(ts) FROM messages").fetchone()
+        sources = self._db.execute("SELECT COUNT(*) FROM sources").fetchone()[0]
+        return {"messages": messages, "first": first_ts, "last": last_ts, "sources": sources}
+
+    def close(self) -> None:
+        self._db.close()
+
+
+def _line_messages(text: str, utc_offset: timedelta, not_after: datetime) -> Iterator[Tuple[str, datetime]]:
+    """Сообщения строки с временем: syslog-строка - одно сообщение, строка NDJSON выгрузки ELK -
+    документ (hit с _source, документ с message/@timestamp или целый ответ _search)."""
+    stripped = text.strip()
+    if not stripped.startswith("{"):
+        moment = parse_log_time(stripped, utc_offset, not_after)
+        if moment is None:
+            logger.debug("Skipping a log line without a timestamp: %s", stripped[:100])
+            return
+        yield stripped, moment
+        return
+    try:
+        document = json.loads(stripped)
+    except json.JSONDecodeError:
+        logger.debug("Skipping an invalid JSON line: %s", stripped[:100])
+        return
+    hits = document.get("hits")
+    documents: List[Dict] = hits.get("hits", []) if isinstance(hits, dict) else [document]
+    for hit in documents:
+        source = hit.get("_source", hit) if isinstance(hit, dict) else {}
+        message = source.get("message")
+        if not isinstance(message, str) or sip_method(message) is None:
+            continue
+        moment = parse_log_time(str(source.get("@timestamp", "")), utc_offset) or parse_log_time(message, utc_offset, not_after)
+        if moment is not None:
+            yield message, moment
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local SIP log store for 'With Samples' lookups.")
+    parser.add_argument("--db", default=os.getenv("SIP_STORE_PATH", "sip_log.sqlite3"), help="SQLite file (SIP_STORE_PATH)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest = commands.add_parser("ingest", help="Load new lines of SIP log files or ELK NDJSON exports.")
+    ingest.add_argument("paths", nargs="+")
+    ingest.add_argument("--utc-offset", type=float, default=0.0, help="Offset of local log times from UTC, hours")
+    commands.add_parser("stats", help="Show the number of stored messages and their time range.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    store = SipLogStore(args.db)
+    try:
+        if args.command == "ingest":
+            for path in args.paths:
+                started = time.perf_counter()
+                lines_read, added = store.ingest_file(path, timedelta(hours=args.utc_offset))
+                logger.info(f"{path}: {lines_read} new lines, {added} messages added in {time.perf_counter() - started:.1f}s.")
+        print(json.dumps(store.stats(), indent=2))
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,6 @@
+// How often to poll a background job for progress
+const JOB_POLL_INTERVAL_MS = 1000;
+
 // Add event listener after the DOM is loaded
 document.addEventListener('DOMContentLoaded', (event) => {
     // Add listener for the clear button
@@ -9,11 +12,29 @@ document.addEventListener('DOMContentLoaded', (event) => {
             textArea.focus(); // Optionally focus the text area after clearing
         });
     }
+
+    // The text area is not required when a report file is selected
+    const fileInput = document.getElementById('file');
+    if (fileInput && textArea) {
+        fileInput.addEventListener('change', () => {
+            textArea.required = fileInput.files.length === 0;
+        });
+    }
+
+    // Keep following a background job started before the page was reloaded
+    const jobUrl = sessionStorage.getItem('jobStatusUrl');
+    if (jobUrl) {
+        runWithProgress(() => followJob(jobUrl));
+    }
 });
 
 async function handleSubmit(event) {
     event.preventDefault();
-    const form = event.target;
+    const formData = new FormData(event.target);
+    await runWithProgress(() => submitReport(formData));
+}
+
+async function runWithProgress(task) {
     const submitBtn = document.getElementById('submit-btn');
     const loading = document.getElementById('loading');
     const errorMessage = document.getElementById('error-message');
@@ -27,29 +48,118 @@ async function handleSubmit(event) {
     resultSection.innerHTML = ''; // Clear previous results
 
     try {
-        const formData = new FormData(form);
-        const response = await fetch('/process', {
+        await task();
+    } catch (error) {
+        console.error('Error submitting form:', error);
+        errorMessage.textContent = error.message || 'An unexpected error occurred.';
+        errorMessage.style.display = 'block';
+    } finally {
+        submitBtn.disabled = false;
+        loading.style.display = 'none';
+    }
+}
+
+async function submitReport(formData) {
+    const file = formData.get('file');
+    const logicChoice = formData.get('logic_choice');
+    // Results are streamed pair by pair; the server turns large "With Samples" reports
+    // into a background job (JOB_AUTO_PAIRS) and answers 202, which is then polled
+    let response;
+    if (file instanceof File && file.size > 0) {
+        // Send the file as the raw request body; the server parses it while it arrives
+        const params = new URLSearchParams({ logic_choice: logicChoice, stream: 'true' });
+        response = await fetch(`/process/upload?${params}`, {
+            method: 'POST',
+            headers: { 'Content-Type': file.type || 'application/octet-stream' },
+            body: file
+        });
+    } else {
+        formData.delete('file');
+        response = await fetch('/process/stream', {
             method: 'POST',
             body: formData
         });
+    }
+
+    if (!response.ok) {
+        // Errors before streaming starts are returned as JSON
+        const data = await response.json().catch(() => ({}));
+        throw new Error(data.detail || data.error || `HTTP error! status: ${response.status}`);
+    }
 
-        const data = await response.json(); // Always expect JSON
+    if (response.status === 202) {
+        const job = await response.json();
+        sessionStorage.setItem('jobStatusUrl', job.status_url);
+        await followJob(job.status_url);
+        return;
+    }
 
-        if (!response.ok) {
-            // Use error message from JSON response if available
-            throw new Error(data.detail || data.error || `HTTP error! status: ${response.status}`);
+    // Render each pair as soon as its NDJSON line arrives
+    const view = displayResults([]);
+    await readNdjsonStream(response, (streamEvent) => {
+        if (streamEvent.type === 'start') {
+            view.setProgress(0, streamEvent.total);
+        } else if (streamEvent.type === 'pair') {
+            view.addPair(streamEvent);
+        } else if (streamEvent.type === 'error') {
+            throw new Error(streamEvent.detail || 'An unexpected error occurred.');
         }
+    });
+    view.finish();
+}
 
-        // Process successful JSON response
-        displayResults(data.results);
+async function followJob(statusUrl) {
+    const view = displayResults([]);
+    let cursor = 0;
+    try {
+        while (true) {
+            // Only pairs finished since the previous poll are returned
+            const response = await fetch(`${statusUrl}?after=${cursor}`);
+            if (!response.ok) {
+                const data = await response.json().catch(() => ({}));
+                throw new Error(data.detail || `HTTP error! status: ${response.status}`);
+            }
+            const job = await response.json();
+            job.pairs.forEach(pair => view.addPair(pair));
+            view.setProgress(job.done, job.total);
+            cursor = job.cursor;
 
-    } catch (error) {
-        console.error('Error submitting form:', error);
-        errorMessage.textContent = error.message || 'An unexpected error occurred.';
-        errorMessage.style.display = 'block';
+            if (job.status === 'done') {
+                break;
+            }
+            if (job.status === 'failed') {
+                throw new Error(job.error || 'Processing failed.');
+            }
+            await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+        }
     } finally {
-        submitBtn.disabled = false;
-        loading.style.display = 'none';
+        sessionStorage.removeItem('jobStatusUrl');
+    }
+    view.finish();
+}
+
+async function readNdjsonStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop(); // Keep the incomplete last line for the next chunk
+        for (const line of lines) {
+            if (line.trim()) {
+                onEvent(JSON.parse(line));
+            }
+        }
+    }
+    buffer += decoder.decode();
+    if (buffer.trim()) {
+        onEvent(JSON.parse(buffer));
     }
 }
 
@@ -57,47 +167,82 @@ function displayResults(results) {
     const resultSection = document.getElementById('result-section');
     resultSection.innerHTML = ''; // Clear previous results first
 
-    if (results && results.length > 0) {
-        const resultText = results.join('\n'); // Join with actual newlines
+    // Create the result container div
+    const resultDiv = document.createElement('div');
+    resultDiv.className = 'result';
 
-        // Create the result container div
-        const resultDiv = document.createElement('div');
-        resultDiv.className = 'result';
+    // Create and add the heading
+    const heading = document.createElement('h3');
+    resultDiv.appendChild(heading);
 
-        // Create and add the heading
-        const heading = document.createElement('h3');
-        heading.textContent = `Result: (found ${results.length})`;
-        resultDiv.appendChild(heading);
+    // Create the editable paragraph; each result is a row kept in input order
+    const paragraph = document.createElement('p');
+    paragraph.id = 'result-text';
+    paragraph.contentEditable = true;
+    resultDiv.appendChild(paragraph);
 
-        // Create the editable paragraph
-        const paragraph = document.createElement('p');
-        paragraph.id = 'result-text';
-        paragraph.contentEditable = true;
-        paragraph.innerText = resultText; // Set text using innerText to preserve newlines
-        resultDiv.appendChild(paragraph);
+    // Create and add the copy button
+    const copyButton = document.createElement('button');
+    copyButton.className = 'copy-btn';
+    copyButton.textContent = 'Copy';
+    copyButton.onclick = () => copyToClipboard('result-text'); // Assign click handler
+    resultDiv.appendChild(copyButton);
 
-        // Create and add the copy button
-        const copyButton = document.createElement('button');
-        copyButton.className = 'copy-btn';
-        copyButton.textContent = 'Copy';
-        copyButton.onclick = () => copyToClipboard('result-text'); // Assign click handler
-        resultDiv.appendChild(copyButton);
+    // Add the complete result div to the section
+    resultSection.appendChild(resultDiv);
 
-        // Add the complete result div to the section
-        resultSection.appendChild(resultDiv);
+    let found = 0;
+    let processed = 0;
+    let total = null;
+    // Pairs ELK could not answer: backend unavailable or the request deadline ran out
+    let unavailable = 0;
+    let timedOut = 0;
 
-    } else {
-        // Handle case with no results
-        const noResultDiv = document.createElement('div');
-        noResultDiv.className = 'result'; // Use the same class for consistent styling
-        const heading = document.createElement('h3');
-        heading.textContent = 'Result: (found 0)';
-        noResultDiv.appendChild(heading);
-        const paragraph = document.createElement('p');
-        paragraph.textContent = 'No matches found.';
-        noResultDiv.appendChild(paragraph);
-        resultSection.appendChild(noResultDiv);
-    }
+    const updateHeading = () => {
+        const progress = total !== null && processed < total ? `, processed ${processed}/${total}` : '';
+        const skipped = (unavailable ? `, ELK unavailable for ${unavailable}` : '')
+            + (timedOut ? `, timed out ${timedOut}` : '');
+        heading.textContent = `Result: (found ${found}${progress}${skipped})`;
+    };
+
+    const view = {
+        setProgress(done, newTotal) {
+            processed = done;
+            total = newTotal;
+            updateHeading();
+        },
+        addPair(pair) {
+            processed += 1;
+            if (pair.status === 'ok' && pair.result) {
+                const row = document.createElement('div');
+                row.dataset.index = pair.index;
+                row.textContent = pair.result;
+                // Pairs resolve out of order; insert the row before the first row with a larger index
+                const next = Array.from(paragraph.children).find(child => Number(child.dataset.index) > pair.index);
+                paragraph.insertBefore(row, next || null);
+                found += 1;
+            } else if (pair.status === 'elk-unavailable') {
+                unavailable += 1;
+            } else if (pair.status === 'timed-out') {
+                timedOut += 1;
+            }
+            updateHeading();
+        },
+        finish() {
+            total = processed;
+            updateHeading();
+            if (found === 0) {
+                // Handle case with no results
+                paragraph.contentEditable = false;
+                paragraph.textContent = 'No matches found.';
+                copyButton.remove();
+            }
+        }
+    };
+
+    (results || []).forEach((result, index) => view.addPair({ index, status: 'ok', result }));
+    updateHeading();
+    return view;
 }
 
 function copyToClipboard(elementId) {
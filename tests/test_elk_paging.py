@@ -0,0 +1,120 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+
+import main
+from elk_resilience import CircuitBreaker
+from elk_window import TimeWindow
+
+CLI = "4212300001"
+MOMENT = datetime(2024, 1, 1, 10)
+WINDOW = TimeWindow(MOMENT - timedelta(hours=1), MOMENT + timedelta(hours=1))
+
+
+def _doc(shard: int, doc: int, method: str, call_id: str) -> dict:
+    message = (
+        f"Jan  1 10:00:00 sbc-1 kamailio[4242]: ACC: transaction answered: timestamp={int(MOMENT.timestamp())};"
+        f"method={method};call_id={call_id}@10.0.0.1;code=200;src_user={CLI};dst_user=441234567890;"
+        f"dst_ouser=+441234567890;"
+    )
+    return {
+        "shard": shard,
+        "doc": doc,
+        "hit": {
+            "_index": "sip",
+            "_id": f"{shard}-{doc}",
+            "_source": {"@timestamp": "2024-01-01T10:00:00.000Z", "message": message},
+        },
+    }
+
+
+# Все сообщения в одну миллисекунду; у BYE тот же _doc, что у последнего hit первой страницы,
+# но в другом шарде
+DOCS = [
+    _doc(0, 0, "INVITE", "noise-1"),
+    _doc(0, 1, "INVITE", "call-1"),
+    _doc(1, 1, "BYE", "call-1"),
+]
+
+
+class FakeShardedElk:
+    """ELK из двух шардов: сортировка (@timestamp, _doc) без PIT и (@timestamp, _shard_doc) в PIT."""
+
+    def __init__(self, support_pit: bool = True):
+        self.support_pit = support_pit
+        self.open_pits = set()
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append((request.method, request.url.path))
+        body = json.loads(request.content) if request.content else {}
+        if request.url.path == "/sip/_pit":
+            if not self.support_pit:
+                return httpx.Response(400, json={"error": "no point-in-time"})
+            self.open_pits.add("pit-1")
+            return httpx.Response(200, json={"id": "pit-1"})
+        if request.method == "DELETE":
+            self.open_pits.discard(body["id"])
+            return httpx.Response(200, json={"succeeded": True})
+        if request.url.path == "/_search":
+            assert body["pit"]["id"] in self.open_pits
+            return self._search(body, lambda doc: doc["shard"] << 32 | doc["doc"], pit_id=body["pit"]["id"])
+        return self._search(body, lambda doc: doc["doc"])
+
+    def _search(self, body: dict, tiebreaker, pit_id=None) -> httpx.Response:
+        ts = int(MOMENT.timestamp() * 1000)
+        ordered = sorted(DOCS, key=lambda doc: (ts, tiebreaker(doc)))
+        hits = [{**doc["hit"], "sort": [ts, tiebreaker(doc)]} for doc in ordered]
+        if body.get("search_after"):
+            hits = [hit for hit in hits if hit["sort"] > body["search_after"]]
+        content = {"hits": {"total": {"value": len(DOCS)}, "hits": hits[:body["size"]]}}
+        if pit_id:
+            content["pit_id"] = pit_id
+        return httpx.Response(200, json=content)
+
+
+@pytest.fixture
+def elk_paging(monkeypatch):
+    monkeypatch.setattr(main, "ELK_URL", "http://elk/sip/_search")
+    monkeypatch.setattr(main, "ELK_USER", "user")
+    monkeypatch.setattr(main, "ELK_PASSWORD", "password")
+    monkeypatch.setattr(main, "ELK_INDEX_PATTERN", None)
+    monkeypatch.setattr(main, "ELK_PAGE_SIZE", 2)
+    monkeypatch.setattr(main, "ELK_MAX_PAGES", 5)
+    monkeypatch.setattr(main, "ELK_HEDGE_PERCENTILE", 0)
+    monkeypatch.setattr(main, "elk_breaker", CircuitBreaker(5, 30))
+
+    def run(elk: FakeShardedElk):
+        async def scenario():
+            monkeypatch.setattr(main, "_elk_client", httpx.AsyncClient(transport=httpx.MockTransport(elk)))
+            monkeypatch.setattr(main, "_elk_semaphore", asyncio.Semaphore(4))
+            first_page = await main._elk_search(main.build_elk_query(CLI, WINDOW), CLI, WINDOW)
+            return await main.complete_elk_response(CLI, first_page, WINDOW)
+
+        response = asyncio.run(scenario())
+        return [hit["_source"]["message"] for hit in response["hits"]["hits"]]
+
+    return run
+
+
+def test_pages_are_read_in_point_in_time(elk_paging):
+    elk = FakeShardedElk()
+    messages = elk_paging(elk)
+    # BYE с тем же (@timestamp, _doc) на границе страниц не пропущен, и к нему найден INVITE
+    assert any("method=BYE;call_id=call-1" in message for message in messages)
+    assert any("method=INVITE;call_id=call-1" in message for message in messages)
+    assert elk.requests.count(("POST", "/_search")) == 2 # В PIT первая страница читается заново
+    assert ("POST", "/sip/_pit") in elk.requests
+    assert ("DELETE", "/_pit") in elk.requests
+    assert not elk.open_pits
+
+
+def test_paging_without_point_in_time_falls_back_to_doc_order(elk_paging):
+    elk = FakeShardedElk(support_pit=False)
+    messages = elk_paging(elk)
+    # Без PIT hit другого шарда с тем же _doc пропускается - поэтому страницы читаются в PIT
+    assert not any("method=BYE;" in message for message in messages)
+    assert ("POST", "/_search") not in elk.requests
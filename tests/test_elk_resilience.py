@@ -0,0 +1,302 @@
+import asyncio
+
+import httpx
+import pytest
+
+import main
+from elk_cache import ELKCache, SingleFlight
+from elk_resilience import CircuitBreaker, ElkUnavailableError, hedged
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_breaker_opens_after_threshold_and_probes_once():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+    clock.now = 10
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow() # Пробный запрос уже идет
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 20
+    assert breaker.allow()
+
+
+def test_breaker_disabled_with_zero_threshold():
+    breaker = CircuitBreaker(failure_threshold=0, reset_timeout=10)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+@pytest.fixture
+def elk(monkeypatch):
+    """Клиент ELK с подменным транспортом: handler(request) -> httpx.Response или исключение."""
+    state = {"handler": None, "calls": 0}
+
+    def transport_handler(request: httpx.Request) -> httpx.Response:
+        state["calls"] += 1
+        return state["handler"](request)
+
+    async def setup():
+        monkeypatch.setattr(main, "_elk_client", httpx.AsyncClient(transport=httpx.MockTransport(transport_handler)))
+        monkeypatch.setattr(main, "_elk_semaphore", asyncio.Semaphore(4))
+
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.2)
+    monkeypatch.setattr(main, "elk_breaker", breaker)
+    monkeypatch.setattr(main, "ELK_RETRIES", 2)
+    monkeypatch.setattr(main, "ELK_RETRY_BACKOFF", 0.001)
+    monkeypatch.setattr(main, "ELK_HEDGE_PERCENTILE", 0)
+    state["setup"] = setup
+    state["breaker"] = breaker
+    return state
+
+
+def _dead_elk(request: httpx.Request) -> httpx.Response:
+    raise httpx.ConnectError("connection refused", request=request)
+
+
+def test_retry_loop_recovers_from_transient_errors(elk):
+    responses = iter([httpx.Response(503), httpx.Response(200, json={"hits": {"hits": []}})])
+    elk["handler"] = lambda request: next(responses)
+
+    async def scenario():
+        await elk["setup"]()
+        return await main._elk_post("search", "http://elk/idx/_search", "test", json={})
+
+    assert asyncio.run(scenario()) == {"hits": {"hits": []}}
+    assert elk["calls"] == 2
+    assert elk["breaker"].state == CircuitBreaker.CLOSED
+
+
+def test_breaker_recovers_after_failed_probe_with_retries(elk):
+    elk["handler"] = _dead_elk
+    breaker = elk["breaker"]
+
+    async def scenario():
+        await elk["setup"]()
+        # ELK недоступен: все попытки неудачны, breaker открывается
+        assert await main._elk_post("search", "http://elk/idx/_search", "test", json={}) is None
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(ElkUnavailableError):
+            await main._elk_post("search", "http://elk/idx/_search", "test", json={})
+
+        # Пробный запрос с повторами тоже неудачен - breaker снова открыт, а не "завис"
+        await asyncio.sleep(0.25)
+        calls = elk["calls"]
+        assert await main._elk_post("search", "http://elk/idx/_search", "probe", json={}) is None
+        assert elk["calls"] - calls == 1 + main.ELK_RETRIES
+        assert breaker.state == CircuitBreaker.OPEN
+
+        # ELK снова доступен: следующий пробный запрос закрывает breaker
+        elk["handler"] = lambda request: httpx.Response(200, json={"hits": {"hits": []}})
+        await asyncio.sleep(0.25)
+        assert await main._elk_post("search", "http://elk/idx/_search", "probe", json={}) is not None
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_probe_releases_breaker(elk):
+    async def slow_elk(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(10)
+        return httpx.Response(200, json={})
+
+    breaker = elk["breaker"]
+    breaker.record_failure()
+
+    async def scenario():
+        await elk["setup"]()
+        elk["handler"] = slow_elk
+        await asyncio.sleep(0.25)
+        probe = asyncio.ensure_future(main._elk_post("search", "http://elk/idx/_search", "probe", json={}))
+        await asyncio.sleep(0.05)
+        assert not breaker.allow() # Пробный запрос идет
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_hedged_without_delay_runs_once():
+    calls = []
+
+    async def factory():
+        calls.append(1)
+        return "ok"
+
+    assert asyncio.run(hedged(factory, None)) == ("ok", None)
+    assert len(calls) == 1
+
+
+def test_hedged_second_request_wins_when_first_is_slow():
+    delays = iter([1.0, 0.01])
+
+    async def factory():
+        delay = next(delays)
+        await asyncio.sleep(delay)
+        return delay
+
+    started = asyncio.run(_timed(hedged(factory, 0.02)))
+    (result, winner), seconds = started
+    assert (result, winner) == (0.01, "hedge")
+    assert seconds < 0.5
+
+
+def test_hedged_raises_when_both_fail():
+    async def factory():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        asyncio.run(hedged(factory, 0.001))
+
+
+async def _timed(awaitable):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    result = await awaitable
+    return result, loop.time() - started
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        first = flight.start("key", fetch())
+        joined = flight.join("key")
+        assert joined is first
+        results = await asyncio.gather(first, joined)
+        await asyncio.sleep(0) # Завершенный вызов забывается
+        assert flight.join("key") is None
+        return results
+
+    assert asyncio.run(scenario()) == ["value", "value"]
+    assert len(calls) == 1
+
+
+def test_single_flight_cancels_call_without_waiters():
+    flight = SingleFlight()
+
+    async def scenario():
+        call = flight.start("key", asyncio.sleep(10))
+        first = asyncio.ensure_future(flight.wait([call]))
+        second = asyncio.ensure_future(flight.wait([flight.join("key")]))
+        await asyncio.sleep(0)
+
+        first.cancel() # Второй запрос еще ждет - вызов продолжается
+        await asyncio.sleep(0)
+        assert not call.done()
+
+        second.cancel() # Последний ожидающий отменен - вызов больше никому не нужен
+        with pytest.raises(asyncio.CancelledError):
+            await second
+        with pytest.raises(asyncio.CancelledError):
+            await call
+        await asyncio.sleep(0) # Завершенный вызов забывается
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def slow_elk(elk, monkeypatch):
+    """ELK, отвечающий за 0.2 с, без кэша и с двумя запросами "в полете" на воркер."""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(0.2)
+        if request.url.path.endswith("/_msearch"):
+            queries = len(request.content.strip().splitlines()) // 2
+            return httpx.Response(200, json={"responses": [{"hits": {"hits": []}}] * queries})
+        return httpx.Response(200, json={"hits": {"hits": []}})
+
+    elk["handler"] = handler
+    monkeypatch.setattr(main, "ELK_URL", "http://elk/idx/_search")
+    monkeypatch.setattr(main, "ELK_MSEARCH_URL", "http://elk/idx/_msearch")
+    monkeypatch.setattr(main, "ELK_USER", "user")
+    monkeypatch.setattr(main, "ELK_PASSWORD", "password")
+    monkeypatch.setattr(main, "ELK_WINDOW_STEP_DURATIONS", [])
+    monkeypatch.setattr(main, "ELK_BATCH_SIZE", 5)
+    monkeypatch.setattr(main, "elk_cache", ELKCache(max_entries=100, ttl=0, negative_ttl=0))
+    monkeypatch.setattr(main, "elk_flight", SingleFlight())
+    monkeypatch.setattr(main, "sip_store", None)
+
+    async def setup():
+        await elk["setup"]()
+        monkeypatch.setattr(main, "_elk_semaphore", asyncio.Semaphore(2))
+
+    return {**elk, "setup": setup, "state": elk}
+
+
+@pytest.mark.parametrize("mode", ["single", "msearch"])
+def test_deadline_cancels_remaining_elk_lookups(slow_elk, monkeypatch, mode):
+    monkeypatch.setattr(main, "ELK_LOOKUP_MODE", mode)
+    pairs = [{"sent": f"42123{i:05d}", "received": "555"} for i in range(100)]
+
+    async def scenario():
+        await slow_elk["setup"]()
+        results = await main.lookup_cli_pairs(pairs, deadline=0.5)
+        assert sum(result["status"] == main.PAIR_TIMED_OUT for result in results) > 50
+        assert main.elk_flight.stats()["in_flight"] == 0
+
+        # После ответа запросы к ELK для этого вызова больше не отправляются
+        calls = slow_elk["state"]["calls"]
+        await asyncio.sleep(0.3)
+        assert slow_elk["state"]["calls"] == calls
+
+        # Слоты ELK_CONCURRENCY свободны: следующий запрос не ждет отмененные поиски
+        started = asyncio.get_running_loop().time()
+        results = await main.lookup_cli_pairs([{"sent": "4212399999", "received": "555"}], deadline=5)
+        assert results[0]["status"] != main.PAIR_TIMED_OUT
+        assert asyncio.get_running_loop().time() - started < 1
+
+    asyncio.run(scenario())
+
+
+def test_closed_stream_cancels_elk_lookups(slow_elk):
+    pairs = [{"sent": f"42123{i:05d}", "received": "555"} for i in range(20)]
+
+    async def scenario():
+        await slow_elk["setup"]()
+        results = main.iter_cli_pair_results(pairs)
+        await results.__anext__() # Клиент получил первый результат и отключился
+        await results.aclose()
+        await asyncio.sleep(0.05)
+        assert main.elk_flight.stats()["in_flight"] == 0
+        calls = slow_elk["state"]["calls"]
+        await asyncio.sleep(0.3)
+        assert slow_elk["state"]["calls"] == calls
+
+    asyncio.run(scenario())
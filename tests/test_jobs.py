@@ -0,0 +1,194 @@
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobRunner, JobStore
+
+PAIRS = [{"sent": f"4212300{i}", "received": f"55{i}"} for i in range(5)]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+
+@pytest.fixture
+def store(db_path):
+    job_store = JobStore(db_path)
+    yield job_store
+    job_store.close()
+
+
+def _pair_result(index: int, pair: dict) -> dict:
+    return {"index": index, "sent": pair["sent"], "received": pair["received"], "status": "ok", "result": f"r{pair['sent']}"}
+
+
+def _runner(store: JobStore, run_pairs, worker: str = "worker-1") -> JobRunner:
+    runner = JobRunner(store, run_pairs, max_jobs=2, job_concurrency=2, poll_interval=0.01, stale_after=60, retention=3600)
+    runner.worker = worker
+    return runner
+
+
+async def _wait_for_status(store: JobStore, job_id: str, status: str) -> dict:
+    for _ in range(200):
+        job = store.get(job_id)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {store.get(job_id)['status']}, expected {status}")
+
+
+def test_claim_takes_each_job_once(db_path, store):
+    other = JobStore(db_path) # Второй воркер с тем же файлом
+    job_ids = [store.create(PAIRS) for _ in range(3)]
+
+    first = store.claim("worker-1", stale_before=0, limit=2)
+    second = other.claim("worker-2", stale_before=0, limit=2)
+    assert [job_id for job_id, _ in first] == job_ids[:2]
+    assert [job_id for job_id, _ in second] == job_ids[2:]
+    assert first[0][1] == PAIRS
+    assert store.claim("worker-1", stale_before=0, limit=2) == []
+    assert store.claim("worker-1", stale_before=0, limit=0) == []
+    other.close()
+
+
+def test_stale_job_is_taken_over(store):
+    job_id = store.create(PAIRS)
+    store.claim("worker-1", stale_before=0, limit=1)
+
+    # Heartbeat свежий - задачу другой воркер не забирает
+    assert store.claim("worker-2", stale_before=time.time() - 60, limit=1) == []
+    # Heartbeat старше stale_before - воркер считается перезапущенным
+    assert [job_id for job_id, _ in store.claim("worker-2", stale_before=time.time() + 1, limit=1)] == [job_id]
+
+    # Heartbeat прежнего воркера больше не продлевает задачу
+    heartbeat_query = "SELECT worker, heartbeat FROM jobs WHERE id = ?"
+    taken_over = store._db.execute(heartbeat_query, (job_id,)).fetchone()
+    time.sleep(0.01)
+    store.heartbeat([job_id], "worker-1")
+    store.add_results(job_id, [_pair_result(0, PAIRS[0])], "worker-1")
+    assert store._db.execute(heartbeat_query, (job_id,)).fetchone() == taken_over
+    assert taken_over[0] == "worker-2"
+
+
+def test_release_returns_job_to_queue(store):
+    job_id = store.create(PAIRS)
+    store.claim("worker-1", stale_before=0, limit=1)
+    store.release([job_id], "worker-2") # Чужую задачу не возвращаем
+    assert store.get(job_id)["status"] == JOB_RUNNING
+    store.release([job_id], "worker-1")
+    assert store.get(job_id)["status"] == JOB_QUEUED
+    assert [claimed for claimed, _ in store.claim("worker-2", stale_before=0, limit=1)] == [job_id]
+
+
+def test_corrupted_job_is_failed_instead_of_reclaimed(store):
+    job_id = store.create(PAIRS)
+    store._db.execute("UPDATE jobs SET pairs = ? WHERE id = ?", ("{not json", job_id))
+    assert store.claim("worker-1", stale_before=time.time() + 1, limit=1) == []
+    job = store.get(job_id)
+    assert job["status"] == JOB_FAILED
+    assert job["error"]
+    assert store.claim("worker-1", stale_before=time.time() + 1, limit=1) == []
+
+
+def test_runner_resumes_with_unfinished_pairs(store):
+    job_id = store.create(PAIRS)
+    store.add_results(job_id, [_pair_result(1, PAIRS[1]), _pair_result(3, PAIRS[3])], "worker-0")
+    requested = []
+
+    async def run_pairs(pairs, max_in_flight):
+        requested.extend(pairs)
+        for index, pair in reversed(list(enumerate(pairs))):
+            yield _pair_result(index, pair)
+
+    async def scenario():
+        runner = _runner(store, run_pairs)
+        runner.start()
+        try:
+            return await _wait_for_status(store, job_id, JOB_DONE)
+        finally:
+            await runner.stop()
+
+    job = asyncio.run(scenario())
+    assert requested == [PAIRS[0], PAIRS[2], PAIRS[4]]
+    assert job["done"] == job["total"] == len(PAIRS)
+    assert job["results"] == [f"r{pair['sent']}" for pair in PAIRS]
+    assert [pair["index"] for pair in store.get(job_id, after=2)["pairs"]] == [4, 2, 0]
+
+
+def test_stopped_runner_releases_unfinished_job(store):
+    job_id = store.create(PAIRS)
+    started = asyncio.Event()
+
+    async def run_pairs(pairs, max_in_flight):
+        yield _pair_result(0, pairs[0])
+        started.set()
+        await asyncio.sleep(10)
+        yield _pair_result(1, pairs[1])
+
+    async def scenario():
+        runner = _runner(store, run_pairs)
+        runner.start()
+        await asyncio.wait_for(started.wait(), 2)
+        await runner.stop()
+
+    asyncio.run(scenario())
+    job = store.get(job_id)
+    assert job["status"] == JOB_QUEUED
+    assert job["done"] == 1 # Готовый результат сохранен при остановке
+
+
+def test_dispatcher_survives_unexpected_errors(store, monkeypatch):
+    claim = store.claim
+    failures = []
+
+    def flaky_claim(*args, **kwargs):
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("boom")
+        return claim(*args, **kwargs)
+
+    monkeypatch.setattr(store, "claim", flaky_claim)
+    job_id = store.create(PAIRS)
+
+    async def run_pairs(pairs, max_in_flight):
+        for index, pair in enumerate(pairs):
+            yield _pair_result(index, pair)
+
+    async def scenario():
+        runner = _runner(store, run_pairs)
+        runner.start()
+        try:
+            return await _wait_for_status(store, job_id, JOB_DONE)
+        finally:
+            await runner.stop()
+
+    assert asyncio.run(scenario())["done"] == len(PAIRS)
+    assert failures
+
+
+def test_job_store_is_opened_by_lifespan(db_path, monkeypatch):
+    monkeypatch.setattr(main, "JOB_STORE_PATH", db_path)
+    monkeypatch.setattr(main, "JOB_POLL_INTERVAL", 0.01)
+    text = "42123001\n555\n"
+
+    # Без запущенного приложения фоновые задачи недоступны, а jobs.db не создается
+    response = TestClient(main.app).post("/process", data={"text": text, "logic_choice": "with_samples", "background": "true"})
+    assert response.status_code == 503
+    assert main.job_store is None
+
+    with TestClient(main.app) as client:
+        response = client.post("/process", data={"text": text, "logic_choice": "with_samples", "background": "true"})
+        assert response.status_code == 202
+        status_url = response.json()["status_url"]
+        for _ in range(200):
+            job = client.get(status_url).json()
+            if job["status"] == JOB_DONE:
+                break
+            time.sleep(0.01)
+        assert job["status"] == JOB_DONE
+        assert job["total"] == 1
+    assert main.job_runner is None
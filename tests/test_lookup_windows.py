@@ -0,0 +1,58 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+from elk_window import TimeWindow
+from sip_store import SipLogStore
+
+CLI = "4212300001"
+
+
+def _message(method: str, moment: datetime) -> dict:
+    message = (
+        f"{moment:%b} {moment.day:2d} {moment:%H:%M:%S} sbc-1 kamailio[4242]: ACC: transaction answered:"
+        f" timestamp={int(moment.timestamp())};method={method};call_id=call-1@10.0.0.1;code=200;"
+        f"src_user={CLI};dst_user=441234567890;dst_ouser=+441234567890;"
+    )
+    return {"_source": {"@timestamp": moment.strftime("%Y-%m-%dT%H:%M:%S.000Z"), "message": message}}
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Хранилище SIP-логов с вызовом CLI около часа назад (UTC)."""
+    moment = datetime.utcnow().replace(microsecond=0) - timedelta(minutes=50)
+    export = tmp_path / "export.ndjson"
+    export.write_text(
+        "\n".join(json.dumps(hit) for hit in (_message("INVITE", moment), _message("BYE", moment + timedelta(seconds=30))))
+        + "\n"
+    )
+    sip_store = SipLogStore(str(tmp_path / "store.db"))
+    sip_store.ingest_file(str(export))
+    monkeypatch.setattr(main, "sip_store", sip_store)
+    monkeypatch.setattr(main, "ELK_WINDOW_STEP_DURATIONS", [timedelta(hours=1)])
+    yield moment
+    sip_store.close()
+
+
+def _bye_found(response) -> bool:
+    return any("method=BYE;" in hit["_source"]["message"] for hit in response["hits"]["hits"])
+
+
+def test_report_window_is_searched_first():
+    window = TimeWindow(datetime(2024, 1, 1, 9), datetime(2024, 1, 1, 12))
+    windows = main.lookup_windows(window)
+    assert windows[0] == ("report", window)
+    assert [depth for depth, _ in windows[1:]] == [depth for depth, _ in main.lookup_windows()]
+
+
+def test_report_window_hit_needs_no_fallback(store):
+    window = TimeWindow(store - timedelta(hours=1), store + timedelta(hours=1))
+    assert _bye_found(main.lookup_sip_store(CLI, window))
+
+
+def test_wrong_report_offset_falls_back_to_progressive_windows(store):
+    # Время отчета в местном времени (UTC+5), а ELK_REPORT_UTC_OFFSET не задан
+    window = TimeWindow(store + timedelta(hours=4), store + timedelta(hours=6))
+    assert _bye_found(main.lookup_sip_store(CLI, window))
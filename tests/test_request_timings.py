@@ -0,0 +1,53 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+
+import main
+
+TEXT = "42123001\n555\n42123002\n+4422\n"
+
+
+def _request_count() -> float:
+    return REGISTRY.get_sample_value("text_filter_stage_seconds_count", {"stage": "request"}) or 0.0
+
+
+@pytest.mark.parametrize(
+    "send",
+    [
+        lambda client, debug: client.post("/process", data={"text": TEXT, "logic_choice": "only_cli", "debug": debug}),
+        lambda client, debug: client.post(
+            "/process/stream", data={"text": TEXT, "logic_choice": "only_cli", "debug": debug}
+        ),
+        lambda client, debug: client.post(
+            f"/process/upload?logic_choice=only_cli&stream=true&debug={debug}", content=TEXT.encode()
+        ),
+        lambda client, debug: client.post(f"/process/upload?logic_choice=only_cli&debug={debug}", content=TEXT.encode()),
+    ],
+    ids=["process", "stream", "upload-stream", "upload"],
+)
+def test_every_processing_endpoint_records_request_stage(send):
+    client = TestClient(main.app)
+    before = _request_count()
+    response = send(client, "true")
+    assert response.status_code == 200
+    assert _request_count() == before + 1
+
+    if response.headers["content-type"].startswith("application/x-ndjson"):
+        events = [json.loads(line) for line in response.text.splitlines()]
+        assert [event["result"] for event in events if event["type"] == "pair"] == ["555", "+4422"]
+        timings = events[-1]["timings"]
+    else:
+        assert response.json()["results"] == ["555", "+4422"]
+        timings = response.json()["timings"]
+    assert "parse" in timings["stages"]
+    assert timings["total_seconds"] >= 0
+
+
+def test_request_stage_is_recorded_for_rejected_requests():
+    client = TestClient(main.app)
+    before = _request_count()
+    response = client.post("/process/stream", data={"text": TEXT, "logic_choice": "unknown"})
+    assert response.status_code == 400
+    assert _request_count() == before + 1
@@ -0,0 +1,99 @@
+import asyncio
+import gzip
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import main
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _parse(data: bytes, logic_choice: str = "only_cli", size: int = 7) -> list:
+    return asyncio.run(main.parse_report_upload(_chunks(data, size), logic_choice))
+
+
+def _read_text(data: bytes, size: int = 7) -> str:
+    async def collect() -> str:
+        return "".join([text async for text in main.iter_upload_text(_chunks(data, size))])
+
+    return asyncio.run(collect())
+
+
+@pytest.mark.parametrize("size", [1, 7, 1024])
+def test_multi_member_gzip_is_read_to_the_end(size):
+    data = gzip.compress(b"42123001\n+4411\n") + gzip.compress(b"42123002\n+4422\n")
+    assert _read_text(data, size) == "42123001\n+4411\n42123002\n+4422\n"
+
+
+def test_multi_member_gzip_in_separate_chunks():
+    members = [gzip.compress(f"4212300{i}\n+44{i}{i}\n".encode()) for i in range(1, 4)]
+
+    async def chunks():
+        for member in members:
+            yield member
+
+    async def collect() -> str:
+        return "".join([text async for text in main.iter_upload_text(chunks())])
+
+    assert asyncio.run(collect()) == "42123001\n+4411\n42123002\n+4422\n42123003\n+4433\n"
+
+
+def test_truncated_second_gzip_member_is_rejected():
+    data = gzip.compress(b"42123001\n+4411\n") + gzip.compress(b"42123002\n+4422\n")[:-4]
+    with pytest.raises(HTTPException) as error:
+        _read_text(data)
+    assert error.value.status_code == 400
+
+
+def test_gzip_size_limit_counts_all_members():
+    data = gzip.compress(b"1" * 60) + gzip.compress(b"2" * 60)
+
+    async def collect() -> str:
+        return "".join([text async for text in main.iter_upload_text(_chunks(data, 7), max_bytes=100)])
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(collect())
+    assert error.value.status_code == 413
+
+
+def test_multi_member_gzip_report_keeps_later_pairs():
+    data = gzip.compress(b"42123001\n+4411\n") + gzip.compress(b"42123002\n+4422\n")
+    assert _parse(data) == ["+4411", "+4422"]
+    assert [pair["received"] for pair in _parse(data, "with_samples")] == ["+4411", "+4422"]
+
+
+def _body(data: bytes):
+    yield data # Тело без Content-Length (chunked)
+
+
+def test_raw_upload_without_content_length_is_streamed():
+    client = TestClient(main.app)
+    response = client.post(
+        "/process/upload?logic_choice=only_cli",
+        content=_body(gzip.compress(b"42123001\n+4411\n")),
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    assert response.json() == {"results": ["+4411"]}
+
+
+def test_multipart_upload_requires_content_length():
+    client = TestClient(main.app)
+    boundary = "report-boundary"
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"report.txt\"\r\n\r\n"
+        f"42123001\n+4411\n\r\n--{boundary}--\r\n"
+    ).encode()
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+    response = client.post("/process/upload?logic_choice=only_cli", content=_body(body), headers=headers)
+    assert response.status_code == 411
+
+    response = client.post("/process/upload?logic_choice=only_cli", content=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"results": ["+4411"]}